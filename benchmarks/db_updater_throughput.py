@@ -0,0 +1,166 @@
+#!../venv/bin/python
+""" Throughput of tools/db_updater.py in its list, full and sync modes, against the local XChain stand-in
+(xchain_stand_in.py) and a benchmark database seeded by synthetic_data.py.
+
+The stand-in answers with the given latency, so the effect of the round trips to xchain.io on a sync can be
+measured and tuned offline. Reported per mode: pepes synced per second, XChain calls per pepe and database writes
+(INSERT, UPDATE, DELETE statements) per pepe. The full mode is limited to the first pepe_count pepes, and the sync
+mode syncs the last sync_blocks blocks. The list mode is run twice, fetching one pepe at a time and with the
+fetch_workers of the xchain settings, to show the speedup of the concurrent fetches. Each mode starts with an empty
+XChain response cache, except the sync mode run a second time, which shows the calls left once the messages of the
+final blocks and the issuances are cached.
+The updater's printed output is discarded, and its block state and response cache are kept in scratch files, so the
+files of the site are left alone. The benchmark database is written to.
+
+Usage: db_updater_throughput.py [latency_ms [pepe_count [sync_blocks [output_file]]]]
+"""
+import set_paths
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import Settings
+from synthetic_data import benchmark_database_name, use_database
+from xchain_stand_in import StandInServer, XChainStandIn, DEFAULT_TIP, use_api
+from rpw.DataConnectors import DBConnector, XChainConnector
+from rpw.Metrics import StatementFingerprints
+
+DEFAULT_LATENCY_MS = 50
+DEFAULT_PEPE_COUNT = 100
+DEFAULT_SYNC_BLOCKS = 10
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def updater_module():
+    """ tools/db_updater.py, imported once its block state file and response cache settings point at scratch files. """
+    scratch_path = Path(tempfile.mkdtemp(prefix='rpw_bench_'))
+    Settings.Sources['pepe_data']['db_state_file'] = str(scratch_path / 'db_latest_block')
+    Settings.Sources['xchain']['response_cache_file'] = str(scratch_path / 'xchain_responses.sqlite')
+    sys.path.append(str(Path(set_paths.script_path.parent) / 'tools'))
+    import db_updater
+    return db_updater
+
+
+def stand_in_for_database() -> XChainStandIn:
+    """ Stand-in generating data for the pepes and addresses of the benchmark database. """
+    db_connection = DBConnector()
+    assets = db_connection.query("SELECT asset, divisible FROM assets")
+    addresses = [row['address'] for row in
+                 db_connection.query("SELECT address FROM addresses WHERE is_burn IS NULL OR is_burn<>1")]
+    db_connection.close()
+    return XChainStandIn([row['asset'] for row in assets], addresses,
+                         divisible_assets={row['asset'] for row in assets if row['divisible']})
+
+
+def statement_counts() -> tuple[int, int]:
+    """ Writes and reads executed since the last StatementFingerprints.reset(). """
+    writes = reads = 0
+    for statement in StatementFingerprints.top(StatementFingerprints.max_fingerprints + 1, 'count'):
+        if statement['fingerprint'].split(' ', 1)[0].upper() in WRITE_STATEMENTS:
+            writes += statement['count']
+        else:
+            reads += statement['count']
+    return writes, reads
+
+
+def run_mode(name: str, stand_in: XChainStandIn, run, keep_cache: bool = False) -> dict:
+    """ Run one mode of the updater and measure it. The pepes synced are counted by their asset requests.
+    :param keep_cache: run with the XChain responses cached by the previous mode, instead of an empty cache
+    """
+    response_cache = XChainConnector.response_cache()
+    if not keep_cache:
+        response_cache.clear()
+        response_cache.observe_tip(stand_in.tip)
+    cache_hits = response_cache.stats()['hits']
+    stand_in.reset_counts()
+    StatementFingerprints.reset()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        run()
+    elapsed = time.perf_counter() - start
+    writes, reads = statement_counts()
+    calls = dict(stand_in.requests)
+    pepes = calls.get('asset', 0)
+    result = {
+        'pepes': pepes,
+        'seconds': elapsed,
+        'pepes_per_second': pepes / elapsed if elapsed else 0,
+        'xchain_calls': sum(calls.values()),
+        'xchain_calls_per_pepe': sum(calls.values()) / pepes if pepes else 0,
+        'db_writes_per_pepe': writes / pepes if pepes else 0,
+        'db_reads_per_pepe': reads / pepes if pepes else 0,
+        'xchain_cache_hits': response_cache.stats()['hits'] - cache_hits,
+        'xchain_calls_by_method': calls,
+    }
+    print(f"{name:<15} {pepes:5} pepes in {elapsed:7.1f} s  {result['pepes_per_second']:6.2f} pepes/s  "
+          f"xchain calls/pepe {result['xchain_calls_per_pepe']:5.1f} (cached {result['xchain_cache_hits']})  "
+          f"db writes/pepe {result['db_writes_per_pepe']:6.1f}  db reads/pepe {result['db_reads_per_pepe']:6.1f}")
+    return result
+
+
+def main():
+    arguments = sys.argv[1:]
+    if len(arguments) > 4 or not all(argument.isdigit() for argument in arguments[:3]):
+        print(__doc__)
+        exit(1)
+    latency = int(arguments[0]) / 1000 if len(arguments) > 0 else DEFAULT_LATENCY_MS / 1000
+    pepe_count = int(arguments[1]) if len(arguments) > 1 else DEFAULT_PEPE_COUNT
+    sync_blocks = int(arguments[2]) if len(arguments) > 2 else DEFAULT_SYNC_BLOCKS
+
+    use_database(benchmark_database_name())
+    stand_in = stand_in_for_database()
+    stand_in.latency = latency
+    server = StandInServer(stand_in)
+    server.start()
+    use_api(server.api_base_url)
+    db_updater = updater_module()
+    db_updater.MysqlUpdater.write_latest_db_block(DEFAULT_TIP - sync_blocks)
+    updater = db_updater.MysqlUpdater()
+    all_pepe_names = updater.pepes_list
+    pepe_names = all_pepe_names[:pepe_count]
+    print(f"Database {Settings.Sources['mysql']['database_name']}, XChain stand-in latency {latency * 1000:.0f} ms")
+
+    def full():
+        # as db_updater.py full: all pepes, then the blocks found during the first pass
+        updater.pepes_list = pepe_names
+        updater.initiate_db_full_sync()
+        last_block = updater.current_block
+        updater.current_block = updater.cp_data.get_btc_current_block()
+        updater.sync_pepe_list(updater.get_pepes_in_block(range(last_block, updater.current_block + 1)))
+
+    def sync():
+        updater.pepes_list = all_pepe_names
+        updater.last_db_block = DEFAULT_TIP - sync_blocks
+        updater.initiate_db_lastest_block_sync()
+
+    fetch_workers = updater.fetch_workers
+    updater.fetch_workers = 1
+    modes = {'list_sequential': run_mode('list, 1 worker', stand_in, lambda: updater.sync_pepe_list(pepe_names))}
+    updater.fetch_workers = fetch_workers
+    modes['list'] = run_mode(f"list, {fetch_workers} workers", stand_in, lambda: updater.sync_pepe_list(pepe_names))
+    modes['full'] = run_mode('full', stand_in, full)
+    modes['sync'] = run_mode('sync', stand_in, sync)
+    modes['sync_cached'] = run_mode('sync, cached', stand_in, sync, keep_cache=True)
+    speedup = modes['list']['pepes_per_second'] / modes['list_sequential']['pepes_per_second'] \
+        if modes['list_sequential']['pepes_per_second'] else 0
+    print(f"Concurrent fetch speedup: {speedup:.2f}x")
+    results = {
+        'database': Settings.Sources['mysql']['database_name'],
+        'latency_ms': latency * 1000,
+        'fetch_workers': fetch_workers,
+        'fetch_speedup': speedup,
+        'modes': modes
+    }
+    server.stop()
+    if len(arguments) > 3:
+        with open(arguments[3], 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {arguments[3]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!../venv/bin/python
+""" Latency, database statements and memory allocations of the page data builders, against a benchmark database
+seeded by synthetic_data.py.
+
+Each build runs in a Flask test request context, as in a request, with the production log profile. Builders are
+warmed up first, so the snapshots are loaded and the statements prepared. The allocations are measured in a
+separate pass under tracemalloc, which slows the code down. The results are printed, and written to a JSON file
+when one is given; compare prints the change between two result files.
+
+Usage: page_builders.py [iterations [database_name [output_file]]]
+       page_builders.py compare baseline_file result_file
+"""
+import set_paths
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+os.environ.setdefault('RPW_LOG_PROFILE', 'production')
+
+from synthetic_data import benchmark_database_name, use_database
+from rpw.DataConnectors import DBConnector
+from rpw.Metrics import Metrics, percentile
+from rpw.PagesData import IndexPage, PepePage, AddressPage, ArtistPage, SearchPage
+from rpw.QueryTools import PepeData
+from rpw.app import app, loggers
+
+DEFAULT_ITERATIONS = 200
+WARM_UP_ITERATIONS = 5
+ALLOCATION_ITERATIONS = 20
+BENCHMARK_TABLES = ['assets', 'holdings', 'dispensers', 'orders', 'addresses']
+
+
+class BuilderInputs:
+    """ Pepes, holder addresses, artists and search texts the builders are run with, picked from the benchmark
+    database in a repeatable order. """
+
+    def __init__(self, seed: int = 420):
+        chooser = random.Random(seed)
+        db_connection = DBConnector()
+        pepe_names = PepeData(db_connection).get_pepe_names()
+        holders = [row['address'] for row in db_connection.query("SELECT DISTINCT address FROM holdings")]
+        artists = [row['source'] for row in db_connection.query("SELECT DISTINCT source FROM assets WHERE source<>''")]
+        db_connection.close()
+        self.pepe_names = chooser.sample(pepe_names, min(500, len(pepe_names)))
+        self.addresses = chooser.sample(holders, min(500, len(holders)))
+        self.artists = chooser.sample(artists, min(500, len(artists)))
+        self.search_texts = [pepe_name[:chooser.randint(2, 4)] for pepe_name in self.pepe_names]
+
+    @staticmethod
+    def pick(values: list, iteration: int):
+        return values[iteration % len(values)]
+
+
+def builders(inputs: BuilderInputs) -> dict:
+    """ Page name -> function building the page data for an iteration number. """
+    return {
+        'index': lambda i: IndexPage.create(loggers=loggers),
+        'pepe': lambda i: PepePage.create(inputs.pick(inputs.pepe_names, i), loggers=loggers),
+        'address': lambda i: AddressPage.create(inputs.pick(inputs.addresses, i), loggers=loggers),
+        'artist': lambda i: ArtistPage.create(inputs.pick(inputs.artists, i), loggers=loggers),
+        'search': lambda i: SearchPage.create(inputs.pick(inputs.search_texts, i), loggers=loggers),
+    }
+
+
+def run_builder(build, iterations: int) -> dict:
+    """ Time the builder and count its statements, then measure its allocations under tracemalloc. """
+    for i in range(WARM_UP_ITERATIONS):
+        with app.test_request_context():
+            build(i)
+    timings_ms = []
+    statement_counts = []
+    for i in range(iterations):
+        with app.test_request_context():
+            Metrics.begin_request()
+            start = time.perf_counter()
+            build(i)
+            timings_ms.append((time.perf_counter() - start) * 1000)
+            statement_counts.append(Metrics.current_request().query_count)
+    peaks_kib = []
+    retained_kib = []
+    tracemalloc.start()
+    for i in range(min(iterations, ALLOCATION_ITERATIONS)):
+        with app.test_request_context():
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            build(i)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks_kib.append((peak - before) / 1024)
+            retained_kib.append((current - before) / 1024)
+    tracemalloc.stop()
+    return {
+        'iterations': iterations,
+        'p50_ms': percentile(timings_ms, 0.5),
+        'p99_ms': percentile(timings_ms, 0.99),
+        'mean_ms': sum(timings_ms) / len(timings_ms),
+        'max_ms': max(timings_ms),
+        'statements_mean': sum(statement_counts) / len(statement_counts),
+        'statements_max': max(statement_counts),
+        'peak_kib_p50': percentile(peaks_kib, 0.5),
+        'peak_kib_max': max(peaks_kib),
+        'retained_kib_p50': percentile(retained_kib, 0.5),
+    }
+
+
+def table_counts() -> dict:
+    db_connection = DBConnector()
+    counts = {table: db_connection.query(f"SELECT COUNT(*) AS row_count FROM {table}")[0]['row_count']
+              for table in BENCHMARK_TABLES}
+    db_connection.close()
+    return counts
+
+
+def run(iterations: int, database_name: str) -> dict:
+    use_database(database_name)
+    results = {
+        'database': database_name,
+        'table_counts': table_counts(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'builders': {}
+    }
+    for name, build in builders(BuilderInputs()).items():
+        results['builders'][name] = run_builder(build, iterations)
+        print_result(name, results['builders'][name])
+    return results
+
+
+def print_result(name: str, result: dict):
+    print(f"{name:<8} p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+          f"statements {result['statements_mean']:5.1f} (max {result['statements_max']})  "
+          f"peak {result['peak_kib_p50']:8.1f} KiB  retained {result['retained_kib_p50']:7.1f} KiB")
+
+
+def compare(baseline_file: str, result_file: str):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    with open(result_file) as f:
+        result = json.load(f)
+    print(f"{baseline_file} ({baseline['table_counts']}) -> {result_file} ({result['table_counts']})")
+    for name, after in result['builders'].items():
+        before = baseline['builders'].get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in ['p50_ms', 'p99_ms', 'statements_mean', 'peak_kib_p50']:
+            change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0
+            changes.append(f"{key} {before[key]:.1f} -> {after[key]:.1f} ({change:+.0f}%)")
+        print(f"{name:<8} " + '  '.join(changes))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        if len(sys.argv) != 4:
+            print(__doc__)
+            exit(1)
+        compare(sys.argv[2], sys.argv[3])
+        return
+    if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        print(__doc__)
+        exit(1)
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ITERATIONS
+    database_name = sys.argv[2] if len(sys.argv) > 2 else benchmark_database_name()
+    results = run(iterations, database_name)
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {sys.argv[3]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!../venv/bin/python
+""" Micro-benchmark of the PepePage query mix: queries built with f-strings and sent through query_and_fetch,
+against the same queries sent through DBConnector.query as cached prepared statements.
+
+Usage: prepared_statements.py [iterations] [pepe_name,pepe_name,...]
+"""
+import set_paths
+import random
+import statistics
+import sys
+import time
+
+from rpw.DataConnectors import DBConnector
+from rpw.QueryTools import PepeData
+
+DEFAULT_ITERATIONS = 200
+BURN_CHECKS_PER_PAGE = 25  # holders checked against the burn list on a page
+
+
+def pepe_page_fstring(db_connection: DBConnector, pepe_name: str):
+    """ Query mix of a pepe page, as it was sent before prepared statements. """
+    pepe = db_connection.escape(pepe_name)
+    db_connection.query_and_fetch(f"SELECT * FROM assets WHERE asset='{pepe}'")
+    db_connection.query_and_fetch(f"SELECT * FROM dispensers WHERE asset='{pepe}' "
+                                  f"AND SUBSTRING(source,1,1)<>'3' AND give_remaining>0 AND status<>10")
+    for base_asset in ['XCP', 'PEPECASH']:
+        db_connection.query_and_fetch(f"SELECT * FROM orders WHERE get_asset='{pepe}' AND status='open' "
+                                      f"AND give_asset='{base_asset}'")
+        db_connection.query_and_fetch(f"SELECT * FROM orders WHERE give_asset='{pepe}' AND status='open' "
+                                      f"AND get_asset='{base_asset}'")
+    for currency in ['BTC', 'XCP', 'PEPECASH']:
+        db_connection.query_and_fetch(f"SELECT usd_rate FROM prices WHERE currency='{currency}'")
+    holdings = db_connection.query_and_fetch(
+        f"SELECT * FROM holdings WHERE asset='{pepe}' ORDER BY address_quantity DESC")
+    for holding in holdings[:BURN_CHECKS_PER_PAGE]:
+        db_connection.query_and_fetch(f"SELECT is_burn FROM addresses WHERE address='{holding['address']}'")
+
+
+def pepe_page_prepared(db_connection: DBConnector, pepe_name: str):
+    """ Query mix of a pepe page, sent as parameterized prepared statements. """
+    db_connection.query("SELECT * FROM assets WHERE asset=%s", (pepe_name,))
+    db_connection.query("SELECT * FROM dispensers WHERE asset=%s "
+                        "AND SUBSTRING(source,1,1)<>'3' AND give_remaining>0 AND status<>10", (pepe_name,))
+    for base_asset in ['XCP', 'PEPECASH']:
+        db_connection.query("SELECT * FROM orders WHERE get_asset=%s AND status=%s AND give_asset=%s",
+                            (pepe_name, 'open', base_asset))
+        db_connection.query("SELECT * FROM orders WHERE give_asset=%s AND status=%s AND get_asset=%s",
+                            (pepe_name, 'open', base_asset))
+    for currency in ['BTC', 'XCP', 'PEPECASH']:
+        db_connection.query("SELECT usd_rate FROM prices WHERE currency=%s", (currency,))
+    holdings = db_connection.query("SELECT * FROM holdings WHERE asset=%s ORDER BY address_quantity DESC",
+                                   (pepe_name,))
+    for holding in holdings[:BURN_CHECKS_PER_PAGE]:
+        db_connection.query("SELECT is_burn FROM addresses WHERE address=%s", (holding['address'],))
+
+
+def run(path, db_connection: DBConnector, pepe_names: list, iterations: int) -> list:
+    timings = []
+    for i in range(iterations):
+        pepe_name = pepe_names[i % len(pepe_names)]
+        start = time.perf_counter()
+        path(db_connection, pepe_name)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list):
+    timings_ms = sorted(t * 1000 for t in timings)
+    p95 = timings_ms[int(len(timings_ms) * 0.95) - 1]
+    print(f"{name:<10} mean {statistics.mean(timings_ms):8.3f} ms   "
+          f"p50 {statistics.median(timings_ms):8.3f} ms   p95 {p95:8.3f} ms")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ITERATIONS
+    db_connection = DBConnector()
+    if len(sys.argv) > 2:
+        pepe_names = sys.argv[2].split(',')
+    else:
+        pepe_names = PepeData(db_connection).get_pepe_names()
+        random.shuffle(pepe_names)
+    print(f"PepePage query mix, {iterations} pages over {len(pepe_names)} pepes")
+    run(pepe_page_prepared, db_connection, pepe_names, min(iterations, 20))  # warm up caches
+    report('f-string', run(pepe_page_fstring, db_connection, pepe_names, iterations))
+    report('prepared', run(pepe_page_prepared, db_connection, pepe_names, iterations))
+    print(DBConnector.pool_stats())
+    db_connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!../venv/bin/python
+""" Micro-benchmark of the pepe name search: the scan of every name with a substring test, as the search page did
+before the search index, against the SearchIndex of the asset catalog.
+
+The name set is the pepe names of the database grown to [scale] times its size with synthetic names, built by
+recombining the halves of real names so that the grams are distributed like those of real pepe names.
+Only the search is timed, not the lookup of the details of the matches.
+
+Usage: search_index.py [iterations] [scale]
+"""
+import set_paths
+import random
+import statistics
+import sys
+import time
+
+from rpw.DataConnectors import DBConnector
+from rpw.QueryTools import PepeData
+from rpw.Utils import SearchIndex
+
+DEFAULT_ITERATIONS = 500
+DEFAULT_SCALE = 10
+RESULTS_PER_PAGE = 54  # cards per search results page
+
+
+def synthetic_names(pepe_names: list, scale: int) -> list:
+    names = set(pepe_names)
+    target_count = len(pepe_names) * scale
+    while len(names) < target_count:
+        first, second = random.sample(pepe_names, 2)
+        names.add(first[:len(first) // 2] + second[len(second) // 2:])
+    return sorted(names)
+
+
+def search_texts(pepe_names: list, count: int) -> list:
+    """ Search texts as typed in the search box: prefixes and inner substrings of 2 to 6 characters. """
+    texts = []
+    for pepe_name in random.choices(pepe_names, k=count):
+        size = random.randint(2, min(6, len(pepe_name)))
+        start = 0 if random.random() < 0.5 else random.randint(0, len(pepe_name) - size)
+        texts.append(pepe_name[start:start + size])
+    return texts
+
+
+def scan_search(sorted_names: tuple, text: str) -> tuple:
+    matches = [name for name in sorted_names if text in name]
+    return len(matches), matches[:RESULTS_PER_PAGE]
+
+
+def index_search(search_index: SearchIndex, text: str) -> tuple:
+    return search_index.search(text, limit=RESULTS_PER_PAGE)
+
+
+def run(search, texts: list) -> list:
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        search(text)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list):
+    timings_us = sorted(t * 1000000 for t in timings)
+    p95 = timings_us[int(len(timings_us) * 0.95) - 1]
+    print(f"{name:<8} mean {statistics.mean(timings_us):9.1f} us   p50 {statistics.median(timings_us):9.1f} us   "
+          f"p95 {p95:9.1f} us   max {timings_us[-1]:9.1f} us")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ITERATIONS
+    scale = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SCALE
+    db_connection = DBConnector()
+    pepe_names = PepeData(db_connection).get_pepe_names()
+    db_connection.close()
+    names = synthetic_names(pepe_names, scale)
+    start = time.perf_counter()
+    search_index = SearchIndex(names)
+    build_time = time.perf_counter() - start
+    sorted_names = search_index.sorted_names
+    print(f"{len(names)} names ({len(pepe_names)} pepes x {scale}), index built in {build_time * 1000:.1f} ms "
+          f"with {len(search_index.postings)} grams")
+
+    texts = search_texts(names, iterations)
+    for text in texts[:50]:  # both searches find the same matches
+        scan_count, scan_matches = scan_search(sorted_names, text)
+        index_count, index_matches = index_search(search_index, text)
+        assert scan_count == index_count and set(index_matches) <= set(name for name in sorted_names if text in name)
+    report('scan', run(lambda text: scan_search(sorted_names, text), texts))
+    report('index', run(lambda text: index_search(search_index, text), texts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!../venv/bin/python
+""" Pepe page latency while the database updater is writing, against the latency on an idle database.
+
+A writer thread replays the write pattern of db_updater.py sync over the benchmarked pepes: an UPDATE of the asset
+record and of every holdings record, committed per row (as with MyISAM) or per pepe in one transaction. The rows
+are rewritten with their current values, so the data is left unchanged.
+Run it before and after the InnoDB migration (tools/migrate.py) to compare the two storage engines.
+
+Usage: sync_page_latency.py [iterations] [per-row|per-pepe] [pepe_name,pepe_name,...]
+"""
+import set_paths
+import random
+import statistics
+import sys
+import threading
+import time
+
+from prepared_statements import pepe_page_prepared
+from rpw.DataConnectors import DBConnector
+from rpw.QueryTools import PepeData
+
+DEFAULT_ITERATIONS = 200
+BENCHMARK_TABLES = ['assets', 'holdings', 'dispensers', 'orders', 'addresses']
+
+
+class SyncWriter(threading.Thread):
+    """ Rewrites the asset and holdings rows of the given pepes until stopped. """
+
+    def __init__(self, pepe_names: list, per_pepe_transaction: bool):
+        super().__init__(daemon=True)
+        self.pepe_names = pepe_names
+        self.per_pepe_transaction = per_pepe_transaction
+        self.stop_event = threading.Event()
+        self.pepes_written = 0
+        self.rows_written = 0
+
+    def write_pepe(self, db_connection: DBConnector, pepe_name: str):
+        db_connection.execute_and_commit("UPDATE assets SET real_supply=real_supply WHERE asset=%s", (pepe_name,))
+        for holding in db_connection.query("SELECT id FROM holdings WHERE asset=%s", (pepe_name,)):
+            db_connection.execute_and_commit("UPDATE holdings SET address_quantity=address_quantity WHERE id=%s",
+                                             (holding['id'],))
+            self.rows_written += 1
+        self.rows_written += 1
+
+    def run(self):
+        db_connection = DBConnector()
+        while not self.stop_event.is_set():
+            for pepe_name in self.pepe_names:
+                if self.stop_event.is_set():
+                    break
+                if self.per_pepe_transaction:
+                    with db_connection.transaction():
+                        self.write_pepe(db_connection, pepe_name)
+                else:
+                    self.write_pepe(db_connection, pepe_name)
+                self.pepes_written += 1
+        db_connection.close()
+
+
+def run_pages(db_connection: DBConnector, pepe_names: list, iterations: int) -> list:
+    timings = []
+    for i in range(iterations):
+        pepe_name = pepe_names[i % len(pepe_names)]
+        start = time.perf_counter()
+        pepe_page_prepared(db_connection, pepe_name)
+        db_connection.db_connection.rollback()  # end the read snapshot, as returning a request's connection does
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list):
+    timings_ms = sorted(t * 1000 for t in timings)
+    p95 = timings_ms[int(len(timings_ms) * 0.95) - 1]
+    print(f"{name:<16} mean {statistics.mean(timings_ms):8.3f} ms   p50 {statistics.median(timings_ms):8.3f} ms   "
+          f"p95 {p95:8.3f} ms   max {timings_ms[-1]:8.3f} ms")
+
+
+def table_engines(db_connection: DBConnector) -> dict:
+    query = "SELECT table_name AS table_name, engine AS table_engine FROM information_schema.tables " \
+            "WHERE table_schema=DATABASE()"
+    return {row['table_name']: row['table_engine'] for row in db_connection.query(query)
+            if row['table_name'] in BENCHMARK_TABLES}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ITERATIONS
+    mode = sys.argv[2] if len(sys.argv) > 2 else 'per-pepe'
+    if mode not in ['per-row', 'per-pepe']:
+        print(__doc__)
+        exit(1)
+    db_connection = DBConnector()
+    if len(sys.argv) > 3:
+        pepe_names = sys.argv[3].split(',')
+    else:
+        pepe_names = PepeData(db_connection).get_pepe_names()
+        random.shuffle(pepe_names)
+    print(f"Table engines: {table_engines(db_connection)}")
+    print(f"PepePage query mix, {iterations} pages over {len(pepe_names)} pepes, updater commits {mode}")
+    run_pages(db_connection, pepe_names, min(iterations, 20))  # warm up caches
+    report('idle', run_pages(db_connection, pepe_names, iterations))
+
+    writer = SyncWriter(pepe_names, per_pepe_transaction=(mode == 'per-pepe'))
+    writer.start()
+    report('during sync', run_pages(db_connection, pepe_names, iterations))
+    writer.stop_event.set()
+    writer.join()
+    print(f"Updater wrote {writer.rows_written} rows of {writer.pepes_written} pepes during the run")
+    db_connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+#!../venv/bin/python
+""" Seed a benchmark database with synthetic pepes, holders, dispensers and orders.
+
+The database is created from rpw/static/sql/CounterpartyPepes.sql and brought up to date with tools/migrate.py,
+so it has the schema of the site database, then filled with generated rows. The sizes default to roughly those of
+the production database; scale multiplies all of them, e.g. 10 for ten times production. Single counts can be
+overridden with name=value arguments. The same seed always generates the same data.
+
+The MySQL user of Settings.Sources['mysql'] needs the CREATE and DROP privileges on the benchmark database.
+An existing database of the same name is dropped.
+
+Usage: synthetic_data.py [scale [database_name [pepes=N] [holders=N] [holdings=N] [dispensers=N] [orders=N]]]
+"""
+import set_paths
+import hashlib
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+import mysql.connector
+
+import Settings
+from rpw.DataConnectors import DBConnector
+
+SCHEMA_FILE = Path(set_paths.script_path.parent) / 'rpw' / 'static' / 'sql' / 'CounterpartyPepes.sql'
+SCHEMA_DATABASE_NAME = 'CounterpartyPepes'  # database name used in the schema file
+PRODUCTION_COUNTS = {  # approximate row counts of the production database
+    'pepes': 1800,
+    'artists': 400,  # addresses issuing the pepes
+    'holders': 15000,  # addresses holding pepes
+    'holdings': 90000,
+    'dispensers': 6000,
+    'orders': 40000,
+    'burn_addresses': 10,
+}
+FEATURED_PEPES = ['PUMPURPEPE', 'PEPETRADERS']  # default ad slots of the schema file
+BASE_ASSETS = ['XCP', 'PEPECASH']
+ORDER_STATUSES = ['open', 'filled', 'expired', 'cancelled']
+INSERT_CHUNK = 500  # rows per INSERT statement
+BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+SYLLABLES = ['PE', 'PO', 'RA', 'RE', 'KEK', 'FROG', 'MEME', 'SAD', 'RARE', 'DANK', 'BIT', 'COIN', 'MOON', 'ZOM',
+             'GOLD', 'NAKA', 'MOTO', 'LAMBO', 'PUNK', 'DOGE', 'TRUMP', 'CASH', 'SUN', 'NIGHT', 'STAR', 'KING']
+
+
+def benchmark_database_name() -> str:
+    return f"{Settings.Sources['mysql']['database_name']}_bench"
+
+
+def use_database(database_name: str):
+    """ Point the DBConnector default settings, shared by the site code, at another database of the same server. """
+    Settings.Sources['mysql']['database_name'] = database_name
+
+
+def scaled_counts(scale: float = 1.0, overrides: dict = None) -> dict:
+    counts = {name: max(1, int(count * scale)) for name, count in PRODUCTION_COUNTS.items()}
+    counts.update(overrides or {})
+    counts['holders'] = max(counts['holders'], counts['artists'])
+    return counts
+
+
+class SyntheticData:
+    """ Generator of the rows of a synthetic site database. Holder counts per pepe and the pepes of the dispensers
+    and orders follow a long tail, as in the production data: a few pepes account for most of the rows.
+    """
+
+    def __init__(self, counts: dict, seed: int = 420):
+        """
+        :param counts: number of pepes, artists, holders, holdings, dispensers, orders and burn_addresses
+        :param seed: seed of the random generator
+        """
+        self.counts = counts
+        self.random = random.Random(seed)
+        self.tx_index = 0
+        self.pepe_names = self.generate_pepe_names()
+        self.addresses = self.generate_addresses(counts['holders'] + counts['burn_addresses'])
+        self.burn_addresses = self.addresses[:counts['burn_addresses']]
+        self.holder_addresses = self.addresses[counts['burn_addresses']:]
+        self.artists = self.holder_addresses[:counts['artists']]
+        # long tail weights of the pepes, for picking the pepe of a holding, dispenser or order
+        self.pepe_weights = [1 / (rank + 1) ** 0.8 for rank in range(len(self.pepe_names))]
+
+    def generate_pepe_names(self) -> list:
+        names = set(FEATURED_PEPES)
+        while len(names) < self.counts['pepes']:
+            name = ''.join(self.random.choices(SYLLABLES, k=self.random.randint(1, 3)))
+            name = (name + 'PEPE' if self.random.random() < 0.6 else name)[:12]
+            if len(name) >= 4 and name not in BASE_ASSETS:
+                names.add(name)
+        names = sorted(names)
+        self.random.shuffle(names)
+        return names
+
+    def generate_addresses(self, count: int) -> list:
+        addresses = set()
+        while len(addresses) < count:
+            addresses.add('1' + ''.join(self.random.choices(BASE58, k=33)))
+        return sorted(addresses)
+
+    def next_tx(self) -> tuple:
+        """ Unique transaction index and hash. """
+        self.tx_index += 1
+        return self.tx_index, hashlib.sha256(str(self.tx_index).encode()).hexdigest()
+
+    def asset_rows(self) -> list:
+        rows = [('PEPECASH', 'Pepecash', 1, 1, '', '', '', 701884009 * 10 ** 8, 0, '', 'PEPECASH.png', 0)]
+        for number, pepe_name in enumerate(self.pepe_names):
+            artist = self.random.choice(self.artists)
+            divisible = int(self.random.random() < 0.05)
+            supply = self.random.choice([1, 10, 50, 100, 300, 500, 1000, 5000]) * (10 ** 8 if divisible else 1)
+            rows.append((pepe_name, f"Synthetic pepe {pepe_name}", divisible, 1, artist, artist, artist, supply,
+                         number * 36 // len(self.pepe_names) + 1,
+                         f"http://rarepepedirectory.com/?p={number}", f"{pepe_name}.jpg", supply))
+        return rows
+
+    def holding_rows(self) -> list:
+        rows = []
+        pepes_by_weight = self.random.choices(self.pepe_names, weights=self.pepe_weights, k=self.counts['holdings'])
+        holder_counts = {}
+        for pepe_name in pepes_by_weight:
+            holder_counts[pepe_name] = holder_counts.get(pepe_name, 0) + 1
+        for pepe_name, holder_count in holder_counts.items():
+            holders = self.random.sample(self.holder_addresses, min(holder_count, len(self.holder_addresses)))
+            if self.random.random() < 0.1:
+                holders[0] = self.random.choice(self.burn_addresses)
+            for address in holders:
+                rows.append((address, pepe_name, self.random.randint(1, 20), None))
+        return rows
+
+    def dispenser_rows(self) -> list:
+        rows = []
+        pepes = self.random.choices(self.pepe_names, weights=self.pepe_weights, k=self.counts['dispensers'])
+        for block_offset, pepe_name in enumerate(pepes):
+            tx_index, tx_hash = self.next_tx()
+            escrow = self.random.randint(1, 20)
+            open_dispenser = self.random.random() < 0.4
+            satoshirate = self.random.randint(1, 500) * 10000
+            rows.append((pepe_name, 600000 + block_offset, escrow, 1,
+                         self.random.randint(1, escrow) if open_dispenser else 0, satoshirate,
+                         self.random.choice(self.holder_addresses), '0' if open_dispenser else '10',
+                         tx_index, tx_hash, satoshirate))
+        return rows
+
+    def order_rows(self) -> list:
+        rows = []
+        pepes = self.random.choices(self.pepe_names, weights=self.pepe_weights, k=self.counts['orders'])
+        for block_offset, pepe_name in enumerate(pepes):
+            tx_index, tx_hash = self.next_tx()
+            base_asset = self.random.choice(BASE_ASSETS)
+            pepe_quantity = self.random.randint(1, 10)
+            base_quantity = self.random.randint(1, 5000) * 10 ** 7
+            give_asset, give_quantity, get_asset, get_quantity = (pepe_name, pepe_quantity, base_asset, base_quantity) \
+                if self.random.random() < 0.5 else (base_asset, base_quantity, pepe_name, pepe_quantity)
+            status = self.random.choices(ORDER_STATUSES, weights=[3, 4, 2, 1])[0]
+            rows.append((tx_index, tx_hash, 500000 + block_offset, self.random.choice(self.holder_addresses),
+                         give_asset, give_quantity, give_quantity if status == 'open' else 0,
+                         get_asset, get_quantity, get_quantity if status == 'open' else 0, status))
+        return rows
+
+
+class BenchmarkDatabase:
+    """ Creates and seeds a benchmark database with the schema of the site database. """
+
+    def __init__(self, database_name: str):
+        self.database_name = database_name
+
+    def create_schema(self):
+        """ Create the database from the schema file, then apply the migrations of tools/migrate.py. """
+        mysql_settings = Settings.Sources['mysql']
+        schema = SCHEMA_FILE.read_text().replace(SCHEMA_DATABASE_NAME, self.database_name)
+        connection = mysql.connector.connect(host=mysql_settings['host'], user=mysql_settings['user'],
+                                             password=mysql_settings['password'])
+        cursor = connection.cursor()
+        for statement in re.sub(r'(?m)^\s*(#|--).*$', '', schema).split(';'):
+            if statement.strip() and not statement.strip().upper().startswith('GRANT'):
+                cursor.execute(statement)
+        connection.commit()
+        connection.close()
+
+        use_database(self.database_name)
+        sys.path.append(str(Path(set_paths.script_path.parent) / 'tools'))
+        from migrate import Migrator
+        Migrator().migrate()
+
+    def seed(self, data: SyntheticData) -> dict:
+        """ Insert the generated rows, and derive the asset_stats rows and real supplies from them.
+        :return: number of rows inserted per table
+        """
+        use_database(self.database_name)
+        db_connection = DBConnector()
+        inserted = {}
+        tables = [
+            ('assets', 'asset, description, divisible, locked, issuer, owner, source, supply, series, '
+                       'rarepepedirectory_url, image_file_name, real_supply', data.asset_rows()),
+            ('addresses', 'address, is_burn',
+             [(address, int(address in data.burn_addresses)) for address in data.addresses]),
+            ('holdings', 'address, asset, address_quantity, escrow', data.holding_rows()),
+            ('dispensers', 'asset, block_index, escrow_quantity, give_quantity, give_remaining, satoshirate, source, '
+                           'status, tx_index, tx_hash, satoshi_price', data.dispenser_rows()),
+            ('orders', 'tx_index, tx_hash, block_index, source, give_asset, give_quantity, give_remaining, '
+                       'get_asset, get_quantity, get_remaining, status', data.order_rows()),
+        ]
+        for table, columns, rows in tables:
+            row_placeholders = f"({', '.join(['%s'] * len(rows[0]))})"
+            with db_connection.transaction():
+                for start in range(0, len(rows), INSERT_CHUNK):
+                    chunk = rows[start:start + INSERT_CHUNK]
+                    db_connection.execute_and_commit(
+                        f"INSERT INTO {table} ({columns}) VALUES {', '.join([row_placeholders] * len(chunk))}",
+                        tuple(value for row in chunk for value in row))
+            inserted[table] = len(rows)
+        with db_connection.transaction():
+            db_connection.execute_and_commit("UPDATE prices SET usd_rate=CASE currency "
+                                             "WHEN 'BTC' THEN 60000 WHEN 'XCP' THEN 5 ELSE 0.01 END")
+            self.derive_asset_stats(db_connection)
+        db_connection.close()
+        return inserted
+
+    @staticmethod
+    def derive_asset_stats(db_connection: DBConnector):
+        """ Set-based equivalent of MysqlUpdater.update_asset_stats for all pepes at once. """
+        db_connection.execute_and_commit(
+            "INSERT INTO asset_stats (asset, real_supply, holder_count, burn_holder_count, burned_quantity, "
+            "top_holder_quantity, top_holder_share, open_dispenser_count, floor_price, updated_block) "
+            "SELECT assets.asset, assets.supply - COALESCE(holders.burned_quantity, 0), "
+            "COALESCE(holders.holder_count, 0), COALESCE(holders.burn_holder_count, 0), "
+            "COALESCE(holders.burned_quantity, 0), COALESCE(holders.top_holder_quantity, 0), "
+            "COALESCE(holders.top_holder_quantity, 0) / NULLIF(assets.supply - COALESCE(holders.burned_quantity, 0), "
+            "0), COALESCE(open_dispensers.dispenser_count, 0), open_dispensers.floor_price, 0 "
+            "FROM assets "
+            "LEFT JOIN (SELECT holdings.asset, "
+            "SUM(IF(addresses.is_burn=1, 0, 1)) AS holder_count, SUM(IF(addresses.is_burn=1, 1, 0)) AS "
+            "burn_holder_count, SUM(IF(addresses.is_burn=1, holdings.address_quantity, 0)) AS burned_quantity, "
+            "MAX(IF(addresses.is_burn=1, 0, holdings.address_quantity)) AS top_holder_quantity "
+            "FROM holdings LEFT JOIN addresses ON addresses.address=holdings.address GROUP BY holdings.asset) "
+            "holders ON holders.asset=assets.asset "
+            "LEFT JOIN (SELECT dispensers.asset, COUNT(*) AS dispenser_count, "
+            "MIN(dispensers.satoshirate / dispensers.give_quantity * IF(assets.divisible, 100000000, 1)) "
+            "AS floor_price FROM dispensers JOIN assets ON assets.asset=dispensers.asset "
+            "WHERE SUBSTRING(dispensers.source,1,1)<>'3' AND dispensers.give_remaining>0 "
+            "AND dispensers.status<>10 GROUP BY dispensers.asset) "
+            "open_dispensers ON open_dispensers.asset=assets.asset")
+        db_connection.execute_and_commit("UPDATE assets JOIN asset_stats ON asset_stats.asset=assets.asset "
+                                         "SET assets.real_supply=asset_stats.real_supply")
+
+
+def parse_overrides(arguments: list) -> dict:
+    overrides = {}
+    for argument in arguments:
+        name, _, value = argument.partition('=')
+        if name not in PRODUCTION_COUNTS or not value.isdigit():
+            raise ValueError(argument)
+        overrides[name] = int(value)
+    return overrides
+
+
+if __name__ == '__main__':
+    try:
+        scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+        overrides = parse_overrides(sys.argv[3:])
+    except ValueError:
+        print(__doc__)
+        exit(1)
+    database_name = sys.argv[2] if len(sys.argv) > 2 else benchmark_database_name()
+    counts = scaled_counts(scale, overrides)
+    print(f"Creating {database_name} with {counts}")
+    start = time.perf_counter()
+    benchmark_database = BenchmarkDatabase(database_name)
+    benchmark_database.create_schema()
+    inserted = benchmark_database.seed(SyntheticData(counts))
+    print(f"Inserted {inserted} in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,278 @@
+#!../venv/bin/python
+""" Local stand-in for the XChain API, for running tools/db_updater.py offline.
+
+Serves /api/<method>/<params> for the methods used by XChainData: network, asset, issuances, holders, dispensers,
+orders and the per-block message lists (burns, credits, ...). Responses are replayed from a directory of recorded
+responses when one exists for the request, otherwise generated: the data of a pepe and of a block is derived from
+its name or number, so it is the same on every request and every run. Each response is delayed by the configured
+latency plus a random jitter, to stand in for the round trip to xchain.io.
+
+Usage: xchain_stand_in.py [port [latency_ms [jitter_ms [responses_dir]]]]
+       xchain_stand_in.py record responses_dir method param[,param...]
+"""
+import set_paths
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote
+
+import Settings
+from rpw.Utils import JSONTool
+
+BLOCK_MESSAGE_TYPES = ['burns', 'credits', 'debits', 'destructions', 'dispensers', 'dispenses', 'dividends', 'orders',
+                       'order_matches', 'sends']
+BASE_ASSETS = ['XCP', 'PEPECASH']
+DEFAULT_TIP = 800000  # block height reported by the network method
+
+
+def recorded_response_path(responses_dir: Path, method: str, params: str) -> Path:
+    """ File of a recorded response, e.g. holders/PEPECASH.json. """
+    return Path(responses_dir) / method / f"{params or '_'}.json"
+
+
+def quantity_str(quantity: int, divisible: bool) -> str:
+    """ Quantity in the format of the XChain API: a decimal string with 8 decimals for divisible assets. """
+    return f"{quantity / 100_000_000:.8f}" if divisible else str(quantity)
+
+
+class XChainStandIn:
+    """ Responses of the stand-in API: recorded when available, generated otherwise. Counts the requests it serves
+    by method. """
+
+    def __init__(self, pepe_names: list, addresses: list, divisible_assets: set = frozenset(), tip: int = DEFAULT_TIP,
+                 responses_dir: str = '', latency: float = 0.0, jitter: float = 0.0):
+        """
+        :param pepe_names: pepes the generated block messages refer to
+        :param addresses: addresses the generated holders, dispensers and orders use
+        :param divisible_assets: assets reported as divisible, besides XCP and PEPECASH; they should match the
+        database the updater writes to, which it reads the divisibility from
+        :param tip: block height reported by the network method
+        :param responses_dir: directory of recorded responses, '' for generated responses only
+        :param latency: seconds each response is delayed by
+        :param jitter: maximum extra random delay, in seconds
+        """
+        self.pepe_names = sorted(pepe_names)
+        self.pepe_numbers = {pepe_name: number for number, pepe_name in enumerate(self.pepe_names)}
+        self.addresses = addresses
+        self.divisible_assets = set(divisible_assets) | set(BASE_ASSETS)
+        self.tip = tip
+        self.responses_dir = Path(responses_dir) if responses_dir else None
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = {}  # method -> number of requests served
+        self._lock = threading.Lock()
+        self.generators = {
+            'network': self.network,
+            'asset': self.asset,
+            'issuances': self.issuances,
+            'holders': self.holders,
+            'dispensers': self.dispensers,
+            'orders': self.orders,
+        }
+
+    def count_request(self, method: str):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests = {}
+
+    def response(self, method: str, params: str):
+        """ Response body for a method and its comma separated parameters, None for an unknown method. """
+        self.count_request(method)
+        if self.responses_dir is not None:
+            recorded = recorded_response_path(self.responses_dir, method, params)
+            if recorded.exists():
+                return JSONTool.read_json_file(recorded)
+        if method in self.generators:
+            return self.generators[method](params)
+        if method in BLOCK_MESSAGE_TYPES and params.isdigit():
+            return self.block_messages(method, int(params))
+        return None
+
+    @staticmethod
+    def generator(seed_text: str) -> random.Random:
+        """ Random generator seeded by a pepe name or block, so the generated data is the same on every request. """
+        return random.Random(zlib.crc32(seed_text.encode()))
+
+    def is_divisible(self, asset: str) -> bool:
+        return asset in self.divisible_assets
+
+    def tx_index(self, asset: str, kind: int, number: int) -> int:
+        """ Transaction index unique to a pepe, a kind of record (dispenser 0, order 1) and its number. """
+        asset_number = self.pepe_numbers.get(asset, zlib.crc32(asset.encode()) % 1_000_000 + len(self.pepe_names))
+        return 1_000_000_000 + (asset_number * 2 + kind) * 100 + number
+
+    def network(self, params: str) -> dict:
+        return {'network_info': {'mainnet': {'block_height': self.tip}}}
+
+    def asset(self, params: str) -> dict:
+        chooser = self.generator(params)
+        divisible = self.is_divisible(params)
+        supply = chooser.choice([1, 10, 50, 100, 300, 500, 1000, 5000]) * (100_000_000 if divisible else 1)
+        issuer = chooser.choice(self.addresses)
+        return {'asset': params, 'asset_longname': '', 'description': f"Stand-in data for {params}",
+                'divisible': divisible, 'issuer': issuer, 'locked': True, 'owner': issuer,
+                'supply': quantity_str(supply, divisible)}
+
+    def issuances(self, params: str) -> dict:
+        chooser = self.generator(params)
+        return {'data': [{'asset': params, 'issuer': chooser.choice(self.addresses), 'block_index': block}
+                         for block in sorted(chooser.sample(range(300000, self.tip), 2))]}
+
+    def holders(self, params: str) -> dict:
+        chooser = self.generator(f"holders/{params}")
+        divisible = self.is_divisible(params)
+        unit = 100_000_000 if divisible else 1
+        holders = chooser.sample(self.addresses, min(chooser.randint(1, 60), len(self.addresses)))
+        return {'data': [{'address': address, 'quantity': quantity_str(chooser.randint(1, 20) * unit, divisible),
+                          'estimated_value': {'btc': '0.0', 'usd': '0.0', 'xcp': '0.0'}, 'percentage': '0.0'}
+                         for address in holders]}
+
+    def dispensers(self, params: str) -> dict:
+        chooser = self.generator(f"dispensers/{params}")
+        divisible = self.is_divisible(params)
+        unit = 100_000_000 if divisible else 1
+        dispensers = []
+        for number in range(chooser.randint(0, 4)):
+            tx_index = self.tx_index(params, 0, number)
+            escrow = chooser.randint(1, 20)
+            dispensers.append({
+                'asset': params, 'asset_longname': '', 'block_index': self.tip - chooser.randint(1, 50000),
+                'escrow_quantity': quantity_str(escrow * unit, divisible),
+                'give_quantity': quantity_str(unit, divisible),
+                'give_remaining': quantity_str(chooser.randint(0, escrow) * unit, divisible),
+                'satoshirate': f"{chooser.randint(1, 500) / 10000:.8f}", 'source': chooser.choice(self.addresses),
+                'status': chooser.choice(['0', '0', '10']), 'timestamp': 1600000000, 'tx_index': tx_index,
+                'tx_hash': f"{zlib.crc32(str(tx_index).encode()):08x}" * 8})
+        return {'data': dispensers}
+
+    def orders(self, params: str) -> dict:
+        chooser = self.generator(f"orders/{params}")
+        orders = []
+        for number in range(chooser.randint(0, 6)):
+            tx_index = self.tx_index(params, 1, number)
+            base_asset = chooser.choice([base for base in BASE_ASSETS if base != params] or BASE_ASSETS)
+            pepe_side = (params, chooser.randint(1, 10))
+            base_side = (base_asset, chooser.randint(1, 5000) * 10_000_000)
+            (give_asset, give_quantity), (get_asset, get_quantity) = \
+                (pepe_side, base_side) if chooser.random() < 0.5 else (base_side, pepe_side)
+            status = chooser.choice(['open', 'filled', 'expired', 'cancelled'])
+            give_divisible, get_divisible = self.is_divisible(give_asset), self.is_divisible(get_asset)
+            orders.append({
+                'tx_index': tx_index, 'tx_hash': f"{zlib.crc32(str(tx_index).encode()):08x}" * 8,
+                'block_index': self.tip - chooser.randint(1, 50000), 'source': chooser.choice(self.addresses),
+                'give_asset': give_asset, 'give_asset_longname': '',
+                'give_quantity': quantity_str(give_quantity, give_divisible),
+                'give_remaining': quantity_str(give_quantity if status == 'open' else 0, give_divisible),
+                'get_asset': get_asset, 'get_asset_longname': '',
+                'get_quantity': quantity_str(get_quantity, get_divisible),
+                'get_remaining': quantity_str(get_quantity if status == 'open' else 0, get_divisible),
+                'expiration': 8064, 'expire_index': self.tip + 8064, 'fee_required': '0.00000000',
+                'fee_required_remaining': '0.00000000', 'fee_provided': '0.00010000',
+                'fee_provided_remaining': '0.00010000', 'status': status, 'timestamp': 1600000000})
+        return {'data': orders}
+
+    def block_messages(self, message_type: str, block: int) -> dict:
+        chooser = self.generator(f"{message_type}/{block}")
+        assets = chooser.sample(self.pepe_names, min(chooser.choice([0, 0, 0, 1, 2]), len(self.pepe_names)))
+        return {'data': [{'asset': asset, 'block_index': block} for asset in assets + chooser.sample(BASE_ASSETS, 1)]}
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as with xchain.io
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        parts = unquote(self.path.split('?')[0]).strip('/').split('/')
+        if parts and parts[0] == 'api':
+            parts = parts[1:]
+        method = parts[0] if parts else ''
+        params = parts[1] if len(parts) > 1 else ''
+        delay = stand_in.latency + random.uniform(0, stand_in.jitter)
+        if delay:
+            time.sleep(delay)
+        body = stand_in.response(method, params)
+        status = 200 if body is not None else 404
+        content = json.dumps(body if body is not None else {'error': f"Unknown method {method}"}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """ Threaded HTTP server of an XChainStandIn, run in a background thread. """
+    daemon_threads = True
+
+    def __init__(self, stand_in: XChainStandIn, port: int = 0):
+        """
+        :param stand_in: XChainStandIn object answering the requests
+        :param port: port to listen on, 0 for any free port
+        """
+        super().__init__(('127.0.0.1', port), StandInRequestHandler)
+        self.stand_in = stand_in
+        self.thread = None
+
+    @property
+    def api_base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def use_api(api_base_url: str):
+    """ Point XChainConnector, through the shared settings, at another XChain API. """
+    Settings.Sources['xchain']['api_base_url'] = api_base_url
+
+
+def record(responses_dir: str, method: str, params: str):
+    """ Save a response of the live XChain API, to be replayed by the stand-in. """
+    response = JSONTool.query_endpoint(f"{Settings.Sources['xchain']['api_base_url']}/{method}/{params}")
+    target = recorded_response_path(Path(responses_dir), method, params)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    JSONTool.store_json_file(str(target), response, **JSONTool.JSON_PRETTY_KWARGS)
+    print(f"Recorded {method}/{params} to {target}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'record':
+        if len(sys.argv) != 5:
+            print(__doc__)
+            exit(1)
+        record(sys.argv[2], sys.argv[3], sys.argv[4])
+        return
+    from synthetic_data import SyntheticData, scaled_counts
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    jitter = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0
+    responses_dir = sys.argv[4] if len(sys.argv) > 4 else ''
+    data = SyntheticData(scaled_counts())
+    divisible_assets = {asset_row[0] for asset_row in data.asset_rows() if asset_row[2]}
+    server = StandInServer(XChainStandIn(data.pepe_names, data.holder_addresses, divisible_assets=divisible_assets,
+                                         responses_dir=responses_dir, latency=latency, jitter=jitter), port=port)
+    print(f"XChain stand-in at {server.api_base_url}, latency {latency * 1000:.0f} ms + {jitter * 1000:.0f} ms")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
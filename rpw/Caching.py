@@ -0,0 +1,331 @@
+# --*-- coding:utf-8 --*--
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from flask import Response, make_response, request
+
+import Settings
+from rpw.QueryTools import SyncState, RateSnapshot, AssetCatalog
+
+
+class PageCache:
+    """ Cache of rendered page responses, keyed by route, url, query arguments and the version of the data.
+    The data version is the latest synced block together with the price update stamp, so every cached page is
+    dropped as soon as tools/db_updater.py or tools/price_updater.py changes the database.
+    Entries are kept in a bounded in-memory LRU per worker process and, optionally, in a directory shared by all
+    the workers.
+    """
+
+    def __init__(self, cache_settings: dict = None, loggers=None):
+        """ Initiate an empty cache.
+        :param cache_settings: Dictionary of cache settings. Keys: enabled, max_entries, disk_path, max_disk_entries,
+        default_ttl and routes, a dictionary of route name to ttl in seconds (0 to never cache the route)
+        :param loggers: Logging object
+        """
+        if cache_settings is None:
+            cache_settings = Settings.Cache['pages']
+        if loggers is None:
+            loggers = {'root': logging.getLogger('root'),
+                       'errors': logging.getLogger('errors')}
+        self.loggers = loggers
+        self.enabled = cache_settings.get('enabled', True)
+        self.max_entries = cache_settings.get('max_entries', 512)
+        self.default_ttl = cache_settings.get('default_ttl', 600)
+        self.route_ttls = cache_settings.get('routes', {})
+        self.disk_path = Path(cache_settings['disk_path']) if cache_settings.get('disk_path') else None
+        self.max_disk_entries = cache_settings.get('max_disk_entries', 4096)
+        if self.disk_path:
+            self.disk_path.mkdir(parents=True, exist_ok=True)
+        self._entries = OrderedDict()  # key -> (expires at, response body, status, mimetype)
+        self._lock = threading.Lock()
+        self.version = None  # data version of the cached entries
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0,
+                         'disk_evictions': 0}
+
+    @staticmethod
+    def data_version() -> tuple:
+        """ Version of the data the pages are built from: synced block and price update stamp. """
+        return SyncState.latest_block(), RateSnapshot.data_version()
+
+    def ttl(self, route_name: str) -> int:
+        return self.route_ttls.get(route_name, self.default_ttl)
+
+    def cached(self, route_name: str):
+        """ Decorator caching the responses of a Flask view function. Only successful GET responses are cached.
+        Usage:
+            @app.route('/artist/<address_str>/')
+            @page_cache.cached('artist')
+            def artist(address_str): ...
+        :param route_name: name of the route in the routes setting
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                ttl = self.ttl(route_name)
+                if not self.enabled or not ttl or request.method != 'GET':
+                    return view(*args, **kwargs)
+                version = self.data_version()
+                key = self.make_key(route_name, version)
+                cached_response = self.get(key, version)
+                if cached_response is not None:
+                    return cached_response
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    self.put(key, version, response, ttl)
+                return response
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def make_key(route_name: str, version: tuple) -> str:
+        """ Key of the current request: route, path, sorted query arguments and data version. """
+        arguments = '&'.join(f"{name}={value}" for name, value in sorted(request.args.items(multi=True)))
+        raw_key = f"{route_name}|{request.path}|{arguments}|{version}"
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, version: tuple):
+        """ Cached response for a key, from memory or else from disk.
+        :return: Flask Response object, or None if there is no valid entry
+        """
+        self.check_version(version)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return self.build_response(entry)
+        entry = self.disk_get(key, now)
+        with self._lock:
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+            self.memory_put(key, entry)
+        return self.build_response(entry)
+
+    def put(self, key: str, version: tuple, response: Response, ttl: int):
+        """ Store a response for a key in memory and, if configured, on disk. """
+        entry = (time.time() + ttl, response.get_data(), response.status_code, response.mimetype)
+        with self._lock:
+            if version != self.version:  # data changed while the page was built
+                return
+            self.memory_put(key, entry)
+            self.counters['stores'] += 1
+        self.disk_put(key, entry)
+
+    def memory_put(self, key: str, entry: tuple):
+        """ Add an entry to the in-memory LRU, evicting the least recently used one if full. Lock must be held. """
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def check_version(self, version: tuple):
+        """ Drop every cached entry when the data version changes. """
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            if self.version is not None:
+                self.counters['invalidations'] += 1
+                self.loggers['root'].info(f"Page cache: data version changed to {version}, clearing.")
+            self._entries.clear()
+            self.version = version
+        self.disk_clear(keep_version=version)
+
+    @staticmethod
+    def build_response(entry: tuple) -> Response:
+        expires_at, body, status, mimetype = entry
+        return Response(body, status=status, mimetype=mimetype)
+
+    def disk_file(self, key: str) -> Path:
+        return self.disk_path / f"{key}.page"
+
+    def disk_get(self, key: str, now: float):
+        if not self.disk_path:
+            return None
+        cached_file = self.disk_file(key)
+        try:
+            with open(cached_file, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+        if entry[0] <= now:
+            return None
+        try:
+            os.utime(cached_file)  # the modification time orders the disk entries for eviction
+        except OSError:
+            pass
+        return entry
+
+    def disk_put(self, key: str, entry: tuple):
+        if not self.disk_path:
+            return
+        target = self.disk_file(key)
+        temporary = target.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(temporary, 'wb') as f:
+                pickle.dump(entry, f)
+            os.replace(temporary, target)  # readers never see a partly written file
+        except OSError as e:
+            self.loggers['errors'].debug(f"Page cache: could not write {target}: {e}")
+            return
+        self.disk_evict()
+
+    def disk_evict(self):
+        """ Keep the disk entries, shared by every worker, within max_disk_entries. When over, the least recently
+        used entries are removed down to 90% of the limit, so the directory is not listed on every store. """
+        try:
+            cached_files = [entry for entry in os.scandir(self.disk_path) if entry.name.endswith('.page')]
+            if len(cached_files) <= self.max_disk_entries:
+                return
+            cached_files.sort(key=lambda entry: entry.stat().st_mtime)
+            evicted = cached_files[:len(cached_files) - int(self.max_disk_entries * 0.9)]
+            for entry in evicted:
+                Path(entry.path).unlink(missing_ok=True)
+        except OSError as e:
+            self.loggers['errors'].debug(f"Page cache: could not evict from {self.disk_path}: {e}")
+            return
+        with self._lock:
+            self.counters['disk_evictions'] += len(evicted)
+
+    def disk_clear(self, keep_version: tuple):
+        """ Remove the disk entries of older data versions. The version is part of each key, so entries left behind
+        by another worker are never served; this only reclaims the space. """
+        if not self.disk_path:
+            return
+        marker = self.disk_path / 'version'
+        try:
+            if marker.exists() and marker.read_text() == repr(keep_version):
+                return
+            for cached_file in self.disk_path.glob('*.page'):
+                cached_file.unlink(missing_ok=True)
+            marker.write_text(repr(keep_version))
+        except OSError as e:
+            self.loggers['errors'].debug(f"Page cache: could not clear {self.disk_path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, 'entries': len(self._entries), 'version': self.version}
+
+
+class ConditionalGet:
+    """ HTTP validators (ETag, Last-Modified) and Cache-Control headers for page routes.
+    The ETag of a page combines its url with the version of the data it shows: the last synced block that changed
+    the entity of the page (e.g. assets.updated_block for a pepe page), or the latest synced block when the entity
+    has no version of its own, and the price update stamp. Last-Modified is the time of the latest database or price
+    update. Conditional requests which match are answered with 304 before the page is built.
+    """
+
+    def __init__(self, http_settings: dict = None, loggers=None):
+        """ Initiate the validators.
+        :param http_settings: Dictionary of settings. Keys: default_cache_control and routes, a dictionary of route
+        name to a dictionary with the route's cache_control header and whether to send validators
+        :param loggers: Logging object
+        """
+        if http_settings is None:
+            http_settings = Settings.Cache['http']
+        if loggers is None:
+            loggers = {'data_queries': logging.getLogger('data_queries'),
+                       'errors': logging.getLogger('errors')}
+        self.loggers = loggers
+        self.default_cache_control = http_settings.get('default_cache_control', 'no-cache')
+        self.routes = http_settings.get('routes', {})
+        self.counters = {'not_modified': 0, 'validated': 0}
+        self._lock = threading.Lock()
+
+    def route_settings(self, route_name: str) -> dict:
+        return self.routes.get(route_name, {})
+
+    def count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+    def entity_version(self, route_name: str, view_kwargs: dict) -> int:
+        """ Last synced block that changed the entity shown by a page, or the latest synced block. """
+        latest_block = SyncState.latest_block()
+        if route_name == 'sub_page':
+            page_name = str(view_kwargs.get('page_name', '')).upper()
+            # a database connection is only checked out when the catalog has to be reloaded
+            asset_row = AssetCatalog.current(loggers=self.loggers).assets.get(page_name)
+            if asset_row is not None and asset_row.get('updated_block'):
+                return asset_row['updated_block']
+        return latest_block
+
+    @staticmethod
+    def last_modified() -> datetime:
+        """ Time of the latest database sync or price update, to the second. """
+        modified_times = []
+        for state_file in [Settings.Sources['pepe_data']['db_state_file'],
+                           Settings.Sources['pepe_data'].get('prices_state_file', '')]:
+            try:
+                modified_times.append(int(os.stat(state_file).st_mtime))
+            except OSError:
+                pass
+        return datetime.fromtimestamp(max(modified_times, default=0), tz=timezone.utc)
+
+    def etag(self, route_name: str, view_kwargs: dict) -> str:
+        arguments = '&'.join(f"{name}={value}" for name, value in sorted(request.args.items(multi=True)))
+        version = (self.entity_version(route_name, view_kwargs), RateSnapshot.data_version())
+        raw_tag = f"{route_name}|{request.path}|{arguments}|{version}"
+        return hashlib.sha256(raw_tag.encode('utf-8')).hexdigest()[:32]
+
+    def conditional(self, route_name: str):
+        """ Decorator adding validators and Cache-Control to the responses of a Flask view function, and answering
+        matching conditional GET requests with 304 Not Modified without calling the view.
+        Usage:
+            @app.route('/artist/<address_str>/')
+            @conditional_get.conditional('artist')
+            @page_cache.cached('artist')
+            def artist(address_str): ...
+        :param route_name: name of the route in the routes setting
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                settings = self.route_settings(route_name)
+                cache_control = settings.get('cache_control', self.default_cache_control)
+                if request.method not in ['GET', 'HEAD'] or not settings.get('validators', False):
+                    response = make_response(view(*args, **kwargs))
+                    response.headers.setdefault('Cache-Control', cache_control)
+                    return response
+                etag = self.etag(route_name, kwargs)
+                last_modified = self.last_modified()
+                if self.is_not_modified(etag, last_modified):
+                    self.count('not_modified')
+                    response = Response(status=304)
+                else:
+                    self.count('validated')
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        response.headers.setdefault('Cache-Control', cache_control)
+                        return response
+                response.set_etag(etag, weak=True)
+                response.last_modified = last_modified
+                response.headers['Cache-Control'] = cache_control
+                return response
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def is_not_modified(etag: str, last_modified: datetime) -> bool:
+        """ Whether the request's validators match the current page. If-None-Match takes precedence. """
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(etag)
+        if request.if_modified_since:
+            return request.if_modified_since >= last_modified
+        return False
@@ -1,24 +1,46 @@
 # --*-- coding:utf-8 --*--
+import json
 import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 from datetime import date, timedelta, datetime
 from decimal import Decimal
 from typing import List, Tuple, Set
 
 import mysql.connector
+import mysql.connector.errors
 import pickle
-import requests
 
 from btcpay import BTCPayClient
 from mysql.connector.connection import MySQLConverter
 from requests.auth import HTTPBasicAuth
 
 import Settings
-from rpw.Utils import JSONTool
+from rpw.Metrics import Metrics, StatementFingerprints, statement_fingerprint
+from rpw.ResponseCache import ResponseCache
+from rpw.Utils import HTTPSessions, JSONTool
 
 
 class XChainConnector:
     """ Connector to the xchain website api
     """
+    # shared by every connector of the process, so concurrent fetches stay under the request limit
+    request_slots = threading.BoundedSemaphore(Settings.Sources['xchain'].get('max_concurrent_requests', 4))
+    # methods listing the messages of a block, by block index
+    BLOCK_MESSAGE_METHODS = ['burns', 'credits', 'debits', 'destructions', 'dispensers', 'dispenses', 'dividends',
+                             'orders', 'order_matches', 'sends']
+    CACHE_POLICIES = {
+        'issuances': ResponseCache.FINAL_OLDEST_ITEM,  # only the originating issuance of a pepe is read
+        'asset': ('divisible',),
+        **{method: ResponseCache.FINAL_BLOCK for method in BLOCK_MESSAGE_METHODS}
+    }
+    _response_cache = None
+    _response_cache_lock = threading.Lock()
 
     def __init__(self, loggers=None):
         if loggers is None:
@@ -40,8 +62,43 @@ class XChainConnector:
         query_url = f"{Settings.Sources['xchain']['api_base_url']}/{method}"
         if params:
             query_url += f"/{','.join(params)}"
+        response_cache = XChainConnector.response_cache()
+        if response_cache is not None:
+            response = response_cache.get(method, params)
+            if response is not None:
+                self.loggers['data_queries'].info(f"{query_url} (cached)")
+                return response
         self.loggers['data_queries'].info(query_url)
-        return JSONTool.query_endpoint(query_url)
+        with XChainConnector.request_slots, Metrics.external_call('xchain', method):
+            response = JSONTool.query_endpoint(query_url, service='xchain')
+        if response_cache is not None:
+            response_cache.store(method, params, response)
+        return response
+
+    @classmethod
+    def response_cache(cls) -> ResponseCache | None:
+        """ Cache of the final XChain responses, shared by the connectors of the process. None when no
+        Settings.Sources['xchain']['response_cache_file'] is set. """
+        cache_file = Settings.Sources['xchain'].get('response_cache_file')
+        if not cache_file:
+            return None
+        if cls._response_cache is None or cls._response_cache.cache_file != cache_file:
+            with cls._response_cache_lock:
+                if cls._response_cache is None or cls._response_cache.cache_file != cache_file:
+                    cls._response_cache = ResponseCache(cache_file, cls.CACHE_POLICIES,
+                                                        Settings.Sources['xchain'].get('final_block_depth', 6))
+        return cls._response_cache
+
+    def cached_field(self, method: str, params: list, field_name: str):
+        """ Final field of a response cached earlier, e.g. the divisibility of an asset, or None. """
+        response_cache = XChainConnector.response_cache()
+        return response_cache.field(method, params, field_name) if response_cache is not None else None
+
+    def observe_tip(self, block_index: int):
+        """ Latest block of the chain, which decides the blocks whose messages are final. """
+        response_cache = XChainConnector.response_cache()
+        if response_cache is not None:
+            response_cache.observe_tip(block_index)
 
 
 class RPCConnector:
@@ -75,48 +132,294 @@ class RPCConnector:
         }
 
         payload_json = JSONTool.parse_dict(payload)
-        self.loggers['data_queries'].info(f"RPC: Query: \'{method}\', Paramaters: {params}.")
-        response = requests.post(self.rpc_url, data=payload_json, headers=self.rpc_headers, auth=self.rpc_auth)
+        self.loggers['data_queries'].info("RPC: Query: '%s', Paramaters: %s.", method, params)
+        with Metrics.external_call('counterparty_rpc', method):
+            # read-only queries, so safe to retry
+            response = HTTPSessions.post(self.rpc_url, service='counterparty_rpc', data=payload_json,
+                                         headers=self.rpc_headers, auth=self.rpc_auth)
         return JSONTool.parse_json(response.text)
 
 
+class ConnectionPool:
+    """ Bounded pool of MySQL connections shared by every DBConnector of a process.
+    Pools are keyed by process id, so each gunicorn worker builds its own pool after the fork and never reuses a
+    socket inherited from the master process.
+    """
+
+    _pools = {}  # (pid, host, user, database) -> ConnectionPool
+    _pools_lock = threading.Lock()
+
+    def __init__(self, mysql_settings: dict, loggers=None):
+        """ Initiate an empty pool. Connections are opened lazily on checkout.
+        :param mysql_settings: Dictionary representing the settings required to connect.
+        Keys: host, user, password, database_name, and optionally pool_size, pool_max_overflow, pool_timeout,
+        statement_cache_size
+        """
+        if loggers is None:
+            loggers = {'data_queries': logging.getLogger('data_queries'),
+                       'errors': logging.getLogger('errors')}
+        self.loggers = loggers
+        self.connect_kwargs = {
+            'host': mysql_settings['host'],
+            'user': mysql_settings['user'],
+            'password': mysql_settings['password'],
+            'database': mysql_settings['database_name']
+        }
+        self.pool_size = mysql_settings.get('pool_size', 5)
+        self.max_overflow = mysql_settings.get('pool_max_overflow', 10)
+        self.timeout = mysql_settings.get('pool_timeout', 30)
+        self.statement_cache_size = mysql_settings.get('statement_cache_size', 32)
+        self.pid = os.getpid()
+        self._idle = deque()  # connections ready for checkout, most recently returned last
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._statements = weakref.WeakKeyDictionary()  # connection -> OrderedDict(sql -> (sql, prepared cursor))
+        self.counters = {
+            'checkouts': 0,  # connections handed out
+            'waits': 0,  # checkouts that had to wait for a connection to be returned
+            'timeouts': 0,  # checkouts that gave up waiting
+            'connects': 0,  # new connections opened
+            'discarded': 0,  # connections dropped after a failed health check
+            'statements_prepared': 0,  # statements parsed by the server
+            'statement_cache_hits': 0  # executions that reused an already prepared statement
+        }
+
+    @classmethod
+    def get(cls, mysql_settings: dict, loggers=None) -> 'ConnectionPool':
+        """ Pool for the given settings, belonging to the current process.
+        :param mysql_settings: Dictionary representing the settings required to connect.
+        :param loggers: Logging object
+        :return: the shared ConnectionPool object
+        """
+        key = (os.getpid(), mysql_settings['host'], mysql_settings['user'], mysql_settings['database_name'])
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                # drop pools copied from a parent process; their sockets belong to the parent
+                cls._pools = {k: v for k, v in cls._pools.items() if k[0] == key[0]}
+                pool = cls(mysql_settings, loggers=loggers)
+                cls._pools[key] = pool
+        return pool
+
+    @classmethod
+    def all_stats(cls) -> List[dict]:
+        """ Statistics of every pool in the current process, for monitoring.
+        :return: list of dictionaries, one per pool
+        """
+        pid = os.getpid()
+        with cls._pools_lock:
+            pools = [pool for key, pool in cls._pools.items() if key[0] == pid]
+        return [pool.stats() for pool in pools]
+
+    def stats(self) -> dict:
+        """ Current statistics of the pool.
+        :return: dictionary of pool sizes and counters
+        """
+        with self._condition:
+            return {
+                'database': self.connect_kwargs['database'],
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                **self.counters
+            }
+
+    def checkout(self):
+        """ Hand out a healthy connection, opening a new one if none is idle and the pool limit allows it.
+        Waits up to the pool timeout when every connection is in use.
+        :return: mysql connection object
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            has_waited = False
+            while True:
+                if self._idle:
+                    connection = self._idle.pop()
+                    break
+                if self._in_use < self.pool_size + self.max_overflow:
+                    connection = None
+                    break
+                if not has_waited:
+                    self.counters['waits'] += 1
+                    has_waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise mysql.connector.errors.PoolError(
+                        msg=f"Mysql: no connection available after {self.timeout} seconds")
+                self._condition.wait(remaining)
+            self._in_use += 1
+            self.counters['checkouts'] += 1
+        try:
+            if connection is not None and not self._is_healthy(connection):
+                connection = None
+            if connection is None:
+                connection = self._connect()
+        except mysql.connector.Error:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        return connection
+
+    def release(self, connection):
+        """ Return a connection to the pool. Any open transaction is rolled back so the next user does not see a
+        stale snapshot. Connections above the pool size are closed.
+        :param connection: mysql connection object obtained from checkout
+        """
+        if os.getpid() != self.pid:  # connection was inherited from the parent process
+            return
+        keep = True
+        try:
+            connection.rollback()
+        except mysql.connector.Error:
+            keep = False
+        with self._condition:
+            self._in_use -= 1
+            if not keep:
+                self.counters['discarded'] += 1
+            elif len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+            else:
+                keep = False
+            self._condition.notify()
+        if not keep:
+            self.forget_statements(connection)
+            try:
+                connection.close()
+            except mysql.connector.Error:
+                pass
+
+    def prepared_cursor(self, connection, sql: str) -> tuple:
+        """ Prepared statement cursor for a statement on a connection. Each cursor holds one server-side prepared
+        statement, so hot statements are parsed once per connection. The least recently used statement is closed
+        when the cache is full.
+        :param connection: mysql connection object obtained from checkout
+        :param sql: statement text with %s placeholders
+        :return: tuple of the cached statement string and its cursor. The cursor only skips re-preparing when it is
+        executed with the identical string object, so the cached string must be the one passed to execute.
+        """
+        with self._condition:
+            statements = self._statements.setdefault(connection, OrderedDict())
+            cached = statements.get(sql)
+            if cached is not None:
+                statements.move_to_end(sql)
+                self.counters['statement_cache_hits'] += 1
+                return cached
+            cached = (sql, connection.cursor(prepared=True, dictionary=True))
+            statements[sql] = cached
+            self.counters['statements_prepared'] += 1
+            evicted = statements.popitem(last=False)[1] if len(statements) > self.statement_cache_size else None
+        if evicted:
+            self._close_cursor(evicted[1])
+        return cached
+
+    def forget_statement(self, connection, sql: str):
+        """ Drop a statement from the cache of a connection, e.g. after it failed to execute. """
+        with self._condition:
+            cached = self._statements.get(connection, {}).pop(sql, None)
+        if cached:
+            self._close_cursor(cached[1])
+
+    def forget_statements(self, connection):
+        """ Drop every cached statement of a connection. Used when the server session is lost or closed. """
+        with self._condition:
+            self._statements.pop(connection, None)
+
+    @staticmethod
+    def _close_cursor(cursor):
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass
+
+    def _connect(self):
+        """ Open a new connection to the database. """
+        self.loggers['data_queries'].info(
+            f"\nMysql - connecting\nDatabase: {self.connect_kwargs['database']}\n"
+            f"User: {self.connect_kwargs['user']}\nHost: {self.connect_kwargs['host']}\n")
+        connection = mysql.connector.connect(**self.connect_kwargs)
+        with self._condition:
+            self.counters['connects'] += 1
+        return connection
+
+    def _is_healthy(self, connection) -> bool:
+        """ Ping an idle connection before handing it out. """
+        try:
+            if connection.is_connected():
+                return True
+        except mysql.connector.Error:
+            pass
+        self.loggers['data_queries'].info("Mysql: discarding stale pooled connection.")
+        self.forget_statements(connection)
+        with self._condition:
+            self.counters['discarded'] += 1
+        return False
+
+
 class DBConnector:
     """ Connector to communicate with a mysql database """
+    CALLER_MODULES = ('rpw.PagesData', 'rpw.QueryTools')  # named as the caller of a statement in the slow log
 
     class ConnectError(Exception):
         pass
 
+    class QueryBudgetExceeded(Exception):
+        pass
+
     def __init__(self, mysql_settings: dict = Settings.Sources['mysql'], loggers=None):
-        """ Initiate a connection to a MySQL server and database
+        """ Check out a connection to a MySQL server and database from the process connection pool
         :param mysql_settings: Dictionary representing the settings required to connect.
         Keys: host, user, password, database_name
+        :raise DBConnector.ConnectError: no connection could be checked out, e.g. the pool stayed exhausted for
+        pool_timeout seconds or the server is unreachable
         """
         if loggers is None:
             loggers = {'data_queries': logging.getLogger('data_queries'),
-                       'errors': logging.getLogger('errors')}
+                       'errors': logging.getLogger('errors'),
+                       'slow_queries': logging.getLogger('slow_queries')}
         self.loggers = loggers
-        db_host = mysql_settings['host']
-        db_user = mysql_settings['user']
-        db_password = mysql_settings['password']
-        db_database = mysql_settings['database_name']
+        self.slow_queries_logger = loggers.get('slow_queries', logging.getLogger('slow_queries'))
+        self.mysql_settings = mysql_settings
+        self.slow_query_seconds = mysql_settings.get('slow_query_seconds', 0)  # 0 disables the slow log
+        self.pool = ConnectionPool.get(mysql_settings, loggers=loggers)
+        self.query_count = 0  # statements executed through this connector
+        self.last_statement_failed = False  # tells a failed query apart from one returning no rows
+        self.db_connection = None
+        self._release = None
 
         try:
-            self.loggers['data_queries'].info(
-                f"\nMysql - connecting\nDatabase: {db_database}\nUser: {db_user}\nHost: {db_host}\n")
-            self.db_connection = mysql.connector.connect(
-                host=db_host, user=db_user, password=db_password, database=db_database)
+            self.db_connection = self.pool.checkout()
+            # connection goes back to the pool on close(), or when the connector is garbage collected
+            self._release = weakref.finalize(self, self.pool.release, self.db_connection)
             self.cursor = self.db_connection.cursor(buffered=True, dictionary=True)
+            self.last_cursor = self.cursor
             self.converter = MySQLConverter()
+            self.transaction_depth = 0  # nesting level of transaction() blocks
+            self.transaction_failed = False  # a statement failed inside the current transaction
             self.loggers['data_queries'].info("Success.")
         except mysql.connector.Error as e:
             self.loggers['errors'].debug(e.msg)
             self.loggers['errors'].debug(f"Mysql: connection failed\n")
+            if self._release is not None:
+                self._release()
+            raise DBConnector.ConnectError(f"Database {mysql_settings['database_name']}: {e.msg}") from e
+
+    @staticmethod
+    def pool_stats() -> List[dict]:
+        """ Statistics of the connection pools of the current process: checkouts, waits, connections in use.
+        :return: list of dictionaries, one per pool
+        """
+        return ConnectionPool.all_stats()
 
     def reconnect(self):
         """ Reconnected to the database to prevent the event of timeout of the rpc. """
         self.loggers['data_queries'].info("Attempting to reconnect to the database.")
         try:
-            self.reconnect()
+            self.pool.forget_statements(self.db_connection)
+            self.db_connection.reconnect()
+            self.cursor = self.db_connection.cursor(buffered=True, dictionary=True)
             return True
         except mysql.connector.Error as e:
             self.loggers['errors'].debug(f"Mysql execute error occurred\n\t"
@@ -127,33 +430,147 @@ class DBConnector:
 
     def _execute(self, command: str):
         """ Execute a command string in the database. """
+        self.query_count += 1
+        self.last_statement_failed = False
+        start = time.perf_counter()
         try:
             self.cursor.execute(command)
         except mysql.connector.Error as e:
-            self.loggers['errors'].debug(f"Mysql execute error occurred\n\t"
-                                         f"Error code: {e.errno}\n\t"
-                                         f"SQL State: {e.sqlstate}\n\t"
-                                         f"Message: {e.msg}\n")
+            self._record_statement(command, None, start, 'text', failed=True)
+            self._execute_error(e)
             return False
+        self._record_statement(command, None, start, 'text')
+        self.last_cursor = self.cursor
         return True
 
-    def execute(self, command_tokens: list or str = ""):
+    def _execute_prepared(self, sql: str, params=(), many: bool = False):
+        """ Execute a parameterized statement through the prepared statement cache of the connection.
+        The connection is only re-established when the statement fails because the server went away.
+        :param sql: statement text with %s placeholders
+        :param params: tuple of parameter values, or a sequence of tuples if many is True
+        :param many: execute the statement once for each tuple of parameters
+        :return: the cursor holding the results, or False if an error occurred
+        """
+        self.query_count += 1
+        self.last_statement_failed = False
+        start = time.perf_counter()
+        for attempt in range(2):
+            statement, cursor = self.pool.prepared_cursor(self.db_connection, sql)
+            try:
+                if many:
+                    cursor.executemany(statement, params)
+                else:
+                    cursor.execute(statement, params)
+            except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError) as e:
+                self.pool.forget_statement(self.db_connection, sql)
+                if attempt == 0 and not self.transaction_depth \
+                        and not self.db_connection.is_connected() and self.reconnect():
+                    continue
+                self._record_statement(sql, params, start, 'prepared', failed=True, many=many)
+                self._execute_error(e)
+                return False
+            except mysql.connector.Error as e:
+                self.pool.forget_statement(self.db_connection, sql)
+                self._record_statement(sql, params, start, 'prepared', failed=True, many=many)
+                self._execute_error(e)
+                return False
+            self._record_statement(sql, params, start, 'prepared', many=many)
+            self.last_cursor = cursor
+            return cursor
+        return False
+
+    def _record_statement(self, sql: str, params, start: float, kind: str, failed: bool = False, many: bool = False):
+        """ Log an executed statement with its time, add it to the metrics and to its fingerprint's statistics, and
+        write it to the slow query log when it took slow_query_seconds or longer.
+        :param sql: statement text
+        :param params: parameters of a prepared statement, None for a text statement
+        :param start: time.perf_counter() value taken before executing the statement
+        :param kind: 'prepared' or 'text'
+        :param failed: whether the statement raised an error
+        :param many: params is a sequence of parameter tuples
+        """
+        elapsed = time.perf_counter() - start
+        Metrics.record_statement(elapsed, kind, failed=failed)
+        fingerprint = statement_fingerprint(sql)
+        StatementFingerprints.record(fingerprint, elapsed)
+        self.loggers['data_queries'].info("Executed %s statement in %.1f ms: %s\nParameters: %s",
+                                          kind, elapsed * 1000, sql, params)
+        if self.slow_query_seconds and elapsed >= self.slow_query_seconds:
+            self.slow_queries_logger.warning("%s", json.dumps({
+                'ms': round(elapsed * 1000, 1), 'caller': self._statement_caller(), 'kind': kind, 'failed': failed,
+                'fingerprint': fingerprint, 'sql': sql,
+                'params': f"{len(params)} rows" if many else repr(params)[:500] if params is not None else None}))
+
+    @classmethod
+    def _statement_caller(cls) -> str:
+        """ Function which issued the current statement: the innermost PagesData or QueryTools frame, otherwise the
+        innermost frame outside of this module, as module.qualified_name:line. """
+        frame = sys._getframe(2)
+        caller = None
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+            if module in cls.CALLER_MODULES or (caller is None and module not in (__name__, 'contextlib')):
+                code = frame.f_code
+                caller = f"{module}.{getattr(code, 'co_qualname', code.co_name)}:{frame.f_lineno}"
+                if module in cls.CALLER_MODULES:
+                    return caller
+            frame = frame.f_back
+        return caller or 'unknown'
+
+    def _execute_error(self, e: mysql.connector.Error):
+        """ Log a failed statement, and mark the current transaction, if any, to be rolled back. """
+        self.last_statement_failed = True
+        if self.transaction_depth:
+            self.transaction_failed = True
+        self.loggers['errors'].debug(f"Mysql execute error occurred\n\t"
+                                     f"Error code: {e.errno}\n\t"
+                                     f"SQL State: {e.sqlstate}\n\t"
+                                     f"Message: {e.msg}\n")
+
+    def query(self, sql: str, params: tuple = ()) -> List[dict]:
+        """ Run a parameterized query as a prepared statement and fetch the results
+        :param sql: query text with %s placeholders, e.g. 'SELECT * FROM assets WHERE asset=%s'
+        :param params: tuple of values for the placeholders
+        :return: a list of dictionaries representing the records returned by the database, also empty when the
+        query failed (see last_statement_failed)
+        """
+        cursor = self._execute_prepared(sql, params)
+        if not cursor or not cursor.with_rows:
+            return []
+        return cursor.fetchall()
+
+    def executemany(self, sql: str, seq_params: List[tuple]):
+        """ Execute a parameterized statement once for each tuple of parameters, preparing it only once.
+        :param sql: statement text with %s placeholders
+        :param seq_params: list of tuples of values for the placeholders
+        :return: True if successful, False otherwise
+        """
+        return bool(self._execute_prepared(sql, seq_params, many=True))
+
+    def execute(self, command_tokens: list or str = "", params: tuple = None):
         """ Prep a set of command parts to be sent to the database
         :param command_tokens: list of values in the query or string representing the entire query
-        :return: List of returned values from the query.
+        :param params: tuple of values for %s placeholders. When given, the command runs as a prepared statement.
+        :return: True if the command was executed, False if an error occurred.
         """
-        if not self.db_connection.is_connected():
-            self.reconnect()
         if type(command_tokens) == list:
             command = ' '.join(command_tokens)
         else:
             command = command_tokens
-        self.loggers['data_queries'].info(f"Executing query: {command}")
-        self._execute(command)
+        if params is not None:
+            return bool(self._execute_prepared(command, params))
+        if not self.transaction_depth and not self.db_connection.is_connected():
+            self.reconnect()
+        return self._execute(command)
 
     def get_result(self):
         """ Fetch the results from a command executed to the database. """
-        return self.cursor.fetchall()
+        return self.last_cursor.fetchall()
+
+    @property
+    def lastrowid(self) -> int:
+        """ Id of the row inserted by the last executed command. """
+        return self.last_cursor.lastrowid
 
     def query_and_fetch(self, query) -> list[tuple]:
         """ Execute query and fetch results
@@ -163,23 +580,78 @@ class DBConnector:
         self.execute(query)
         return self.get_result()
 
-    def execute_and_commit(self, query):
-        """ Execute query and commit the change
+    def execute_and_commit(self, query, params: tuple = None):
+        """ Execute query and commit the change. Inside a transaction() block the change is committed with the
+        rest of the transaction instead.
         :param query: the string representing the query
+        :param params: tuple of values for %s placeholders, to run the query as a prepared statement
         """
-        self.execute(query)
-        self.commit()
+        self.execute(query, params)
+        if not self.transaction_depth:
+            self.commit()
+
+    @contextmanager
+    def transaction(self):
+        """ Apply the statements executed in the block as one transaction: committed when the block completes,
+        rolled back if the block raises or any of its statements failed. Nested blocks join the outer transaction.
+        Usage:
+            with db_connection.transaction():
+                db_connection.execute_and_commit(...)
+        :return: the DBConnector object, whose transaction_failed attribute tells whether the changes were rolled back
+        """
+        if self.transaction_depth:
+            self.transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self.transaction_depth -= 1
+            return
+        self.db_connection.rollback()  # end the read snapshot of any earlier statements
+        self.transaction_depth = 1
+        self.transaction_failed = False
+        try:
+            yield self
+        except BaseException:
+            self.transaction_failed = True
+            raise
+        finally:
+            self.transaction_depth = 0
+            try:
+                if self.transaction_failed:
+                    self.loggers['errors'].debug("Mysql: rolling back failed transaction.")
+                    self.db_connection.rollback()
+                else:
+                    self.commit()
+            except mysql.connector.Error as e:
+                self.transaction_failed = True
+                self._execute_error(e)
 
     def commit(self):
         """ Commit any current changes to the database. """
         self.db_connection.commit()
 
+    def check_query_budget(self, budget_name: str):
+        """ Compare the number of statements executed through this connector with the budget configured for it
+        in the mysql settings (query_budgets). Exceeding it is logged, or raises QueryBudgetExceeded when
+        enforce_query_budgets is set.
+        :param budget_name: key of the budget in the query_budgets setting, e.g. 'pepe_page'
+        """
+        budget = self.mysql_settings.get('query_budgets', {}).get(budget_name)
+        if budget is None or self.query_count <= budget:
+            return
+        message = f"Mysql: {budget_name} executed {self.query_count} statements, over its budget of {budget}."
+        if self.mysql_settings.get('enforce_query_budgets', False):
+            raise DBConnector.QueryBudgetExceeded(message)
+        self.loggers['errors'].debug(message)
+
     def close(self):
-        """ Close the database connection.
+        """ Return the database connection to the pool.
         :return: None
         """
-        self.loggers['data_queries'].info("Shutting down db connection.")
-        self.db_connection.close()
+        if self._release is None:  # no connection was checked out
+            return
+        self.loggers['data_queries'].info("Returning db connection to the pool.")
+        self._release()
 
     def escape(self, value: str):
         """ Ensure valid properly escaped strings are sent to the database.
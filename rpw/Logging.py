@@ -1,29 +1,232 @@
+import atexit
+import copy
+import gzip
 import logging
 import os
+import queue
+import random
+import shutil
+import threading
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
+from pprint import pformat
 
 import Settings
 
 loggers = Settings.Logs['loggers']
 
 
+class PrettyPayload:
+    """ Logging argument which pretty prints a payload only when the log record is emitted, so the formatting is
+    skipped for records the logger or its handlers drop. """
+
+    def __init__(self, payload, max_chars: int = 0):
+        """
+        :param payload: object to be pretty printed
+        :param max_chars: length the text is truncated to, 0 for no limit
+        """
+        self.payload = payload
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        text = pformat(self.payload)
+        if self.max_chars and len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}... [{len(text) - self.max_chars} more characters]"
+        return text
+
+
+class LogPipeline:
+    """ Writes the log records of a process from one background thread, so request threads only put records on a
+    bounded queue. Formatting, file writes, rotation and compression of rotated files run on the writer thread.
+    When the queue is full, records are dropped and counted instead of blocking the caller.
+    The writer is restarted in forked worker processes and flushed when the process exits.
+    """
+
+    def __init__(self, queue_size: int):
+        """
+        :param queue_size: maximum number of records waiting to be written
+        """
+        self.queue_size = queue_size
+        self.queue = queue.Queue(queue_size)
+        self.file_handlers = {}  # logger name -> file handler writing its records
+        self.queue_handlers = []
+        self.dropped = 0
+        self.reported_drops = 0
+        self.listener = None
+        self._lock = threading.Lock()
+
+    def add_logger(self, logger_name: str, file_handler: logging.Handler) -> QueueHandler:
+        """ Register the file handler of a logger.
+        :return: handler to attach to the logger, queueing its records for the writer thread
+        """
+        self.file_handlers[logger_name] = file_handler
+        queue_handler = PipelineQueueHandler(self, logger_name)
+        queue_handler.setLevel(file_handler.level)
+        self.queue_handlers.append(queue_handler)
+        if self.listener is None:
+            self.start()
+        return queue_handler
+
+    def start(self):
+        self.listener = PipelineListener(self.queue, PipelineWriter(self))
+        self.listener.start()
+
+    def stop(self):
+        """ Write the queued records and close the files. """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        for file_handler in self.file_handlers.values():
+            file_handler.close()
+
+    def restart_after_fork(self):
+        """ Only the forking thread survives a fork: start a new queue and writer thread in the child process. """
+        self.queue = queue.Queue(self.queue_size)
+        for queue_handler in self.queue_handlers:
+            queue_handler.queue = self.queue
+        self._lock = threading.Lock()
+        self.dropped = self.reported_drops = 0
+        self.listener = None
+        if self.file_handlers:
+            self.start()
+
+    def count_drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {'queued': self.queue.qsize(), 'capacity': self.queue_size, 'dropped': self.dropped}
+
+
+class PipelineQueueHandler(QueueHandler):
+    """ Queues the records of one logger for the LogPipeline writer thread, without waiting when the queue is full.
+    Messages are formatted by the writer thread, so the arguments of a record must not be changed after logging it.
+    """
+
+    def __init__(self, pipeline: LogPipeline, logger_name: str):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.logger_name = logger_name
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:  # tracebacks are formatted while the frames are current
+            record = super().prepare(record)
+        else:
+            record = copy.copy(record)
+        record.log_target = self.logger_name
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.count_drop()
+
+
+class PipelineListener(QueueListener):
+    """ Writer thread of the LogPipeline. """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # waits for the writer to make room in a full queue
+
+
+class PipelineWriter(logging.Handler):
+    """ Handler of the LogPipeline writer thread, passing each record to the file handler of the logger which queued
+    it. """
+
+    def __init__(self, pipeline: LogPipeline):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def handle(self, record: logging.LogRecord):
+        file_handler = self.pipeline.file_handlers.get(getattr(record, 'log_target', ''))
+        if file_handler is None:
+            return
+        if self.pipeline.dropped > self.pipeline.reported_drops:
+            dropped = self.pipeline.dropped - self.pipeline.reported_drops
+            self.pipeline.reported_drops = self.pipeline.dropped
+            self.pipeline.file_handlers.get('errors', file_handler).handle(logging.makeLogRecord({
+                'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"Log queue full: {dropped} records dropped."}))
+        if record.levelno >= file_handler.level:
+            file_handler.handle(record)
+
+
+def gzip_rotator(source: str, destination: str):
+    """ Rotator of RotatingFileHandler compressing the rotated file. """
+    with open(source, 'rb') as source_file, gzip.open(destination, 'wb') as destination_file:
+        shutil.copyfileobj(source_file, destination_file)
+    os.remove(source)
+
+
+pipeline = None  # LogPipeline of the process, created by the first Logger.setup_logger call
+
+
 class Logger:
+    @staticmethod
+    def logger_settings(logger_name: str) -> dict:
+        """ Settings of a logger: its Settings.Logs entry, with the overrides of the active log profile.
+        The profile is set by the RPW_LOG_PROFILE environment variable, or Settings.Logs['profile'].
+        """
+        profile_name = os.environ.get('RPW_LOG_PROFILE') or Settings.Logs.get('profile', '')
+        profile = Settings.Logs.get('profiles', {}).get(profile_name, {})
+        return {**loggers.get(logger_name, loggers['defaults']), **profile.get(logger_name, {})}
+
     @staticmethod
     def setup_logger(logger_name, logger) -> logging.Logger:
         if not Path(Settings.Main['log_path']).exists():
             os.makedirs(Settings.Main['log_path'])
-        logger.setLevel(loggers[logger_name]['log_level'])
-        file_handler = RotatingFileHandler(loggers[logger_name]['log_file'],
+        logger_settings = Logger.logger_settings(logger_name)
+        logger.setLevel(logger_settings['log_level'])
+        file_handler = RotatingFileHandler(logger_settings['log_file'],
                                            maxBytes=10_000_000, backupCount=5, mode='a')
-        file_handler.setFormatter(loggers[logger_name]['log_formatter'])
-        file_handler.setLevel(loggers[logger_name]['log_level'])
-        logger.addHandler(file_handler)
-        logger.setLevel(loggers[logger_name]['log_level'])
+        if Settings.Logs.get('compress_rotated', False):
+            file_handler.namer = lambda name: f"{name}.gz"
+            file_handler.rotator = gzip_rotator
+        file_handler.setFormatter(logger_settings['log_formatter'])
+        file_handler.setLevel(logger_settings['log_level'])
+        if Settings.Logs.get('queue_size', 0) > 0:
+            logger.addHandler(Logger.pipeline().add_logger(logger_name, file_handler))
+        else:
+            logger.addHandler(file_handler)
+        logger.setLevel(logger_settings['log_level'])
 
         return logger
 
+    @staticmethod
+    def pipeline() -> LogPipeline:
+        """ LogPipeline of the process, created on first use. """
+        global pipeline
+        if pipeline is None:
+            pipeline = LogPipeline(Settings.Logs['queue_size'])
+            atexit.register(pipeline.stop)
+            os.register_at_fork(after_in_child=pipeline.restart_after_fork)
+        return pipeline
+
+    @staticmethod
+    def pipeline_stats() -> dict:
+        """ Queued, capacity and dropped record counts of the log pipeline, empty if logging is synchronous. """
+        return pipeline.stats() if pipeline is not None else {}
+
+    @staticmethod
+    def log_payload(logger: logging.Logger, message: str, payload, level: int = logging.INFO):
+        """ Log a message followed by a pretty printed payload, e.g. the data built for a page.
+        Nothing is formatted unless the logger is enabled for the level. The records are sampled at the logger's
+        payload_sample_rate setting and the payload is truncated to its max_payload_chars setting.
+        :param logger: logging.Logger object
+        :param message: text preceding the payload
+        :param payload: object to be pretty printed
+        :param level: logging level of the record
+        """
+        if not logger.isEnabledFor(level):
+            return
+        logger_settings = Logger.logger_settings(logger.name)
+        sample_rate = logger_settings.get('payload_sample_rate', 1.0)
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            return
+        logger.log(level, "%s %s", message, PrettyPayload(payload, logger_settings.get('max_payload_chars', 0)))
+
     @staticmethod
     def timestamp():
         return f"{datetime.now()}"
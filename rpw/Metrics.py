@@ -0,0 +1,274 @@
+# --*-- coding:utf-8 --*--
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+QUERY_COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)  # statements per request
+
+# Applied in order by statement_fingerprint: literals and placeholders become ?, lists of them collapse to (?+)
+FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),  # quoted strings
+    (re.compile(r'"(?:[^"\\]|\\.|"")*"'), '?'),
+    (re.compile(r'(?<![\w.$])0x[0-9a-fA-F]+\b'), '?'),  # hex literals
+    (re.compile(r'(?<![\w.$])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b'), '?'),  # numbers
+    (re.compile(r'%s|%\(\w+\)s'), '?'),  # statement placeholders
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r'\(\s?\?(?:\s?,\s?\?)*\s?\)'), '(?+)'),  # IN lists and VALUES rows of any length
+    (re.compile(r'\(\?\+\)(?:\s?,\s?\(\?\+\))+'), '(?+), ...'),  # multi-row VALUES
+]
+
+
+class Counter:
+    """ Monotonic counter per label set. """
+
+    def __init__(self, name: str, description: str, label_names: tuple = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values = {}  # label values tuple -> count
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: tuple = (), amount: float = 1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """ Cumulative histogram per label set: bucket counts, sum and count of the observed values. """
+
+    def __init__(self, name: str, description: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}  # label values tuple -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, label_values: tuple = ()):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[bucket] += 1
+            counts[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((label_values, list(counts)) for label_values, counts in self.values.items())
+        for label_values, counts in items:
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + ('+Inf',), counts[:-1]):
+                cumulative += count
+                labels = format_labels(self.label_names + ('le',), label_values + (str(upper_bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+@lru_cache(maxsize=4096)
+def statement_fingerprint(sql: str) -> str:
+    """ Normalize a SQL statement so statements differing only in their literal values share one fingerprint, e.g.
+    "SELECT * FROM assets WHERE asset='PEPECASH' LIMIT 10" -> "SELECT * FROM assets WHERE asset=? LIMIT ?"
+    """
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def percentile(values: list, fraction: float) -> float:
+    """ Nearest rank percentile of a list of numbers, e.g. fraction 0.95 for the 95th percentile; 0 if empty. """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def format_labels(label_names: tuple, label_values: tuple) -> str:
+    if not label_names:
+        return ''
+    pairs = []
+    for label_name, label_value in zip(label_names, label_values):
+        escaped = str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{label_name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class RequestStats:
+    """ Statements and external calls made while handling one request. """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.query_count = 0
+        self.query_seconds = 0.0
+
+
+class StatementStats:
+    """ Executions of one statement fingerprint: count, total time, and the most recent times for percentiles. """
+
+    def __init__(self, sample_size: int):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.samples = deque(maxlen=sample_size)
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        self.samples.append(elapsed)
+
+    def summary(self) -> dict:
+        return {'count': self.count, 'total_seconds': self.total_seconds, 'max_seconds': self.max_seconds,
+                'p95_seconds': percentile(list(self.samples), 0.95)}
+
+
+class StatementFingerprints:
+    """ Database statements of the worker process aggregated by fingerprint (see statement_fingerprint).
+    The p95 is taken over the last sample_size executions of each fingerprint. Once max_fingerprints are tracked,
+    new fingerprints are counted under OTHER_FINGERPRINT.
+    """
+    OTHER_FINGERPRINT = '(other)'
+    sample_size = 200
+    max_fingerprints = 1000
+    fingerprints = {}  # fingerprint -> StatementStats
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, fingerprint: str, elapsed: float):
+        with cls._lock:
+            statement_stats = cls.fingerprints.get(fingerprint)
+            if statement_stats is None:
+                if len(cls.fingerprints) >= cls.max_fingerprints:
+                    fingerprint = cls.OTHER_FINGERPRINT
+                statement_stats = cls.fingerprints.setdefault(fingerprint, StatementStats(cls.sample_size))
+            statement_stats.add(elapsed)
+
+    @classmethod
+    def top(cls, count: int = 20, sort_key: str = 'total_seconds') -> list:
+        """ Fingerprints with the highest count, total_seconds, max_seconds or p95_seconds.
+        :return: list of dictionaries with the fingerprint and its statistics
+        """
+        with cls._lock:
+            summaries = [{'fingerprint': fingerprint, **statement_stats.summary()}
+                         for fingerprint, statement_stats in cls.fingerprints.items()]
+        return sorted(summaries, key=lambda summary: summary[sort_key], reverse=True)[:count]
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls.fingerprints = {}
+
+
+class Metrics:
+    """ Request, database and external call metrics of the worker process, rendered in the Prometheus text format.
+    Every worker process keeps its own metrics; a scrape of /metrics returns the metrics of the worker serving it.
+    Gauges, e.g. pool and cache statistics, are read at scrape time from the collectors registered with add_collector.
+    """
+    request_seconds = Histogram('rpw_request_duration_seconds', 'Time to handle a request, by route.',
+                                ('route', 'method', 'status'))
+    request_queries = Histogram('rpw_request_db_statements', 'Database statements executed per request, by route.',
+                                ('route',), buckets=QUERY_COUNT_BUCKETS)
+    request_query_seconds = Histogram('rpw_request_db_duration_seconds',
+                                      'Time spent in database statements per request, by route.', ('route',))
+    statement_seconds = Histogram('rpw_db_statement_duration_seconds', 'Time to execute a database statement.',
+                                  ('kind',))
+    statement_errors = Counter('rpw_db_statement_errors_total', 'Database statements which failed.')
+    external_seconds = Histogram('rpw_external_call_duration_seconds', 'Time of calls to external services.',
+                                 ('service', 'method'))
+    external_errors = Counter('rpw_external_call_errors_total', 'Calls to external services which raised an error.',
+                              ('service', 'method'))
+    collectors = []  # functions returning a list of (metric name, description, {label name: value}, value)
+    _request = ContextVar('rpw_request_stats', default=None)
+
+    @classmethod
+    def begin_request(cls):
+        cls._request.set(RequestStats())
+
+    @classmethod
+    def current_request(cls) -> RequestStats:
+        """ Statistics of the request being handled, None outside of begin_request and end_request. """
+        return cls._request.get()
+
+    @classmethod
+    def end_request(cls, route: str, method: str, status: int):
+        request_stats = cls._request.get()
+        if request_stats is None:
+            return
+        cls._request.set(None)
+        elapsed = time.perf_counter() - request_stats.started_at
+        cls.request_seconds.observe(elapsed, (route, method, str(status)))
+        cls.request_queries.observe(request_stats.query_count, (route,))
+        cls.request_query_seconds.observe(request_stats.query_seconds, (route,))
+
+    @classmethod
+    def record_statement(cls, elapsed: float, kind: str, failed: bool = False):
+        """ Record a database statement, and add it to the current request's totals.
+        :param elapsed: execution time in seconds
+        :param kind: 'prepared' or 'text'
+        :param failed: whether the statement raised an error
+        """
+        cls.statement_seconds.observe(elapsed, (kind,))
+        if failed:
+            cls.statement_errors.inc()
+        request_stats = cls._request.get()
+        if request_stats is not None:
+            request_stats.query_count += 1
+            request_stats.query_seconds += elapsed
+
+    @classmethod
+    @contextmanager
+    def external_call(cls, service: str, method: str = ''):
+        """ Time a call to an external service.
+        Usage:
+            with Metrics.external_call('xchain', 'holders'):
+                response = requests.get(...)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            cls.external_errors.inc((service, method))
+            raise
+        finally:
+            cls.external_seconds.observe(time.perf_counter() - start, (service, method))
+
+    @classmethod
+    def add_collector(cls, collector):
+        """ Register a function returning gauge samples, as a list of (metric name, description, labels dictionary,
+        value) tuples, read on every scrape. """
+        cls.collectors.append(collector)
+
+    @classmethod
+    def render(cls) -> str:
+        """ All metrics in the Prometheus text exposition format. """
+        lines = []
+        for metric in [cls.request_seconds, cls.request_queries, cls.request_query_seconds, cls.statement_seconds,
+                       cls.statement_errors, cls.external_seconds, cls.external_errors]:
+            lines.extend(metric.render())
+        gauges = {}  # metric name -> (description, [(labels, value)])
+        for collector in cls.collectors:
+            for name, description, labels, value in collector():
+                gauges.setdefault(name, (description, []))[1].append((labels, value))
+        for name, (description, samples) in gauges.items():
+            lines.extend([f"# HELP {name} {description}", f"# TYPE {name} gauge"])
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return '\n'.join(lines) + '\n'
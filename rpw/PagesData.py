@@ -1,7 +1,6 @@
 # --*-- coding:utf-8 --*--
 from random import randint
 
-from bs4 import BeautifulSoup as bs
 from flask import url_for, Markup
 from pprint import pformat
 import re
@@ -12,7 +11,8 @@ import logging
 
 import Settings
 from rpw.DataConnectors import DBConnector, BTCPayServerConnector
-from rpw.QueryTools import PepeData, PriceTool, BTCPayServerData, AdvertisingData
+from rpw.Logging import Logger
+from rpw.QueryTools import PepeData, PriceTool, BTCPayServerData, AdvertisingData, FaqContent
 from rpw.Utils import Paginator
 
 pepe_images_url_relative = Settings.Sources['pepe_data']['images_path'].replace(
@@ -192,7 +192,7 @@ class CommonPageData:
         common_data = {
             **Settings.Site
         }
-        loggers['data'].info(f"Common page data: {pformat(common_data)}")
+        Logger.log_payload(loggers['data'], "Common page data:", common_data)
         return common_data
 
 
@@ -239,7 +239,7 @@ class IndexPage:
         }
         db_connection.close()
 
-        loggers['data'].info(f"Index Page Data: {pformat(index_data)}")
+        Logger.log_payload(loggers['data'], "Index Page Data:", index_data)
         return index_data
 
 
@@ -274,7 +274,7 @@ class SubPage:
             loggers['root'].info(f"\t{subpage_str} identified as address format. Launching address page view.")
             address_page_data = AddressPage.create(subpage_str, page_number=page_number, loggers=loggers)
 
-            loggers['data'].info(f"Address Page data: {pformat(address_page_data)}")
+            Logger.log_payload(loggers['data'], "Address Page data:", address_page_data)
             return 'address', address_page_data
 
         db_connection = DBConnector(loggers=loggers)
@@ -288,10 +288,12 @@ class SubPage:
                 dispenser_number = int(dispenser_number)
             except ValueError:
                 dispenser_number = 0
+            db_connection.close()
             pepe_page_data = PepePage.create(subpage_str, dispenser_number=dispenser_number, loggers=loggers)
-            loggers['data'].info(f"Pepe Page Data: {pformat(pepe_page_data)}")
+            Logger.log_payload(loggers['data'], "Pepe Page Data:", pepe_page_data)
             return 'pepe', pepe_page_data
         else:
+            db_connection.close()
             loggers['root'].info(f"Subpage did not match address or pepe name. Returning error page.")
             return '404', {**common_page_data}
 
@@ -336,7 +338,7 @@ class AddressPage:
         }
         db_connection.close()
 
-        loggers['data'].info(f"address_page_data: {pformat(address_page_data)}")
+        Logger.log_payload(loggers['data'], "address_page_data:", address_page_data)
         return address_page_data
 
 
@@ -371,12 +373,15 @@ class PepePage:
                                                      pepe_details=pepe_details,
                                                      fiat_enabled=fiat_enabled,
                                                      loggers=loggers)
+        pepe_order_book = pepe_query_tool.get_pepe_order_book(
+            pepe_name, base_assets=[base_asset for base_asset in ['XCP', 'PEPECASH'] if base_asset != pepe_name])
         if pepe_name != 'XCP':
             pepe_xcp_orders_data = PepeOrders.create(pepe_name,
                                                      base_asset='XCP',
                                                      pepe_query_tool=pepe_query_tool,
                                                      price_tool=price_tool,
                                                      pepe_details=pepe_details,
+                                                     pepe_orders=pepe_order_book['XCP'],
                                                      fiat_enabled=fiat_enabled,
                                                      loggers=loggers)
         else:
@@ -387,6 +392,7 @@ class PepePage:
                                                           pepe_query_tool=pepe_query_tool,
                                                           price_tool=price_tool,
                                                           pepe_details=pepe_details,
+                                                          pepe_orders=pepe_order_book['PEPECASH'],
                                                           fiat_enabled=fiat_enabled,
                                                           loggers=loggers)
         else:
@@ -450,9 +456,10 @@ class PepePage:
             'show_pepecash_orders': pepe_name != 'PEPECASH',
             'fiat_enabled': fiat_enabled
         }
+        db_connection.check_query_budget('pepe_page')
         db_connection.close()
 
-        loggers['data'].info(f"Pepe page data: {pformat(pepe_page_data)}")
+        Logger.log_payload(loggers['data'], "Pepe page data:", pepe_page_data)
         return pepe_page_data
 
 
@@ -496,7 +503,7 @@ class ArtistPage:
             'collections_list_data': collections_list_data
         }
 
-        loggers['data'].info(f"{pformat(artist_page_data)}")
+        Logger.log_payload(loggers['data'], "Artist page data:", artist_page_data)
         return artist_page_data
 
 
@@ -534,11 +541,11 @@ class SearchPage:
         general_page_data = CommonPageData.create()
         search_text = search_text.upper()
 
-        pepe_matches = [pepe_name for pepe_name in pepe_query_tool.pepe_names
-                        if search_text in pepe_name]
-        are_matches = False if len(pepe_matches) == 0 else True
-        if len(pepe_matches) == 1 and pepe_matches[0] == search_text:
+        match_count, pepe_matches = pepe_query_tool.catalog.search_index.search(search_text, limit=1)
+        are_matches = match_count > 0
+        if match_count == 1 and pepe_matches[0] == search_text:
             loggers['root'].info(f"Search text identified as a pepe name.")
+            db_connection.close()
             return True, False  # direct to pepe subpage
         else:
             search_results_data = SearchResults.create(
@@ -553,7 +560,8 @@ class SearchPage:
             'search_results_data': search_results_data,
             'search_text': search_text,
         }
-        loggers['data'].info(f"Search results data: {pformat(search_page_data)}")
+        db_connection.close()
+        Logger.log_payload(loggers['data'], "Search results data:", search_page_data)
         return False, search_page_data  # load search page with search results
 
 
@@ -574,8 +582,6 @@ class AdvertisePage:
         """
         if loggers is None:
             loggers = {'data': logging.getLogger('data')}
-        db_connection = DBConnector(loggers=loggers)
-        pepe_query_tool = PepeData(db_connection, loggers=loggers)
         general_page_data = CommonPageData.create()
         advertise_page_data = {
             'action_url': '/invoice/',
@@ -584,12 +590,11 @@ class AdvertisePage:
             'ad_image_url': url_for('static',
                                     filename=f"images/PUMPURPEPE.png"),
             'pay_button_image': url_for('static', filename='images/pay.png'),
-            'pepe_names_list_str': str(pepe_query_tool.get_pepe_names()),
             'typed_pepe': form_text,
             'successful_payment_url': f"{Settings.Site['domain']}/successful_payment/",
             **general_page_data
         }
-        loggers['data'].info(f"Advertise page data: {pformat(advertise_page_data)}")
+        Logger.log_payload(loggers['data'], "Advertise page data:", advertise_page_data)
         return advertise_page_data
 
 
@@ -637,7 +642,7 @@ class FaqPage:
             'faq_items': faq_items,
             **general_page_data
         }
-        loggers['data'].info(f"Paid page data: {pformat(faq_page_data)}")
+        Logger.log_payload(loggers['data'], "Faq page data:", faq_page_data)
         return faq_page_data
 
 
@@ -658,16 +663,9 @@ class FaqItems:
         if loggers is None:
             loggers = {'data': logging.getLogger('data')}
         questions = []
-        source_file = Settings.Main['faq_file']
-        with open(source_file, 'r') as f:
-            faq_content = bs(''.join(f.readlines()), 'lxml')
-        faq_items = faq_content.find('questions').find_all('faq-item')
-        for i, faq_item in enumerate(faq_items, start=1):
-            question_contents = ''.join(str(s) for s in faq_item.find('question').children).replace('\n', '')
-            answer_contents = ''.join([str(s) for s in faq_item.find('answer').children]).replace('\n', '')
+        for i, faq_item in enumerate(FaqContent.items(loggers=loggers), start=1):
             questions.append({
-                'question': question_contents,
-                'answer': answer_contents,
+                **faq_item,
                 'show_number': 'active' if show_number == i else ''
             })
         return questions
@@ -705,19 +703,57 @@ class SearchResults:
         if loggers is None:
             loggers = {'data': logging.getLogger('data')}
 
-        search_results = pepe_query_tool.get_pepes_by_pattern(search_text)
+        search_results_count = pepe_query_tool.count_pepes_by_pattern(search_text)
+        search_results = pepe_query_tool.get_pepes_by_pattern(search_text,
+                                                              offset=Paginator.offset(page_number, results_per_page),
+                                                              count=results_per_page)
         CardList.setup(pepe_query_tool=pepe_query_tool,
                        card_results=search_results,
+                       total_count=search_results_count,
                        card_results_output_data=search_results_data,
                        cards_per_page=results_per_page,
                        page_number=page_number,
                        page_url_base='/search',
                        list_type='search',
                        search_text=search_text)
-        loggers['data'].info(f"Search results data: {pformat(search_results_data)}")
+        Logger.log_payload(loggers['data'], "Search results data:", search_results_data)
         return search_results_data
 
 
+class PepeSuggestions:
+    """ Class for constructing the pepe name suggestions of the autocomplete endpoint. """
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def create(query_text: str, limit: int = 0, loggers=None) -> dict:
+        """
+        Construct the pepe names suggested for the text typed in a search or pepe name box.
+        :param query_text: text typed so far
+        :param limit: number of suggestions wanted, up to the suggest_limit setting
+        :param loggers: Logging object
+        :return: dictionary with the query text and the list of suggested pepe names
+        """
+        if loggers is None:
+            loggers = {'data': logging.getLogger('data')}
+        max_limit = Settings.Sources['pepe_data'].get('suggest_limit', 15)
+        limit = max_limit if limit <= 0 else min(limit, max_limit)
+        query_text = query_text.strip()
+        suggestions_data = {
+            'query': query_text,
+            'suggestions': []
+        }
+        if not query_text:
+            return suggestions_data
+        db_connection = DBConnector(loggers=loggers)
+        pepe_query_tool = PepeData(db_connection, loggers=loggers)
+        suggestions_data['suggestions'] = pepe_query_tool.suggest_pepe_names(query_text, limit)
+        db_connection.close()
+        Logger.log_payload(loggers['data'], "Suggestions data:", suggestions_data)
+        return suggestions_data
+
+
 class ArtistCollection:
     """ Class for constructing data for the artist collection page. """
 
@@ -748,10 +784,14 @@ class ArtistCollection:
             'address': address,
             'cards': [],
         }
-        artist_collection = pepe_query_tool.get_address_artists(address)
+        artist_collection_count = pepe_query_tool.count_address_artists(address)
+        artist_collection = pepe_query_tool.get_address_artists(address,
+                                                                offset=Paginator.offset(page_number, pepes_per_page),
+                                                                count=pepes_per_page)
         CardList.setup(
             pepe_query_tool=pepe_query_tool,
             card_results=artist_collection,
+            total_count=artist_collection_count,
             card_results_output_data=collection_list_data,
             cards_per_page=pepes_per_page,
             page_number=page_number,
@@ -759,7 +799,7 @@ class ArtistCollection:
             list_type='artist'
         )
 
-        loggers['data'].info(f"Search results data: {pformat(artist_collection)}")
+        Logger.log_payload(loggers['data'], "Search results data:", artist_collection)
         return collection_list_data
 
 
@@ -793,17 +833,21 @@ class AddressCollection:
             'address': address,
             'cards': [],
         }
-        address_collection = pepe_query_tool.get_address_holdings(address)
+        address_collection_count = pepe_query_tool.count_address_holdings(address)
+        address_collection = pepe_query_tool.get_address_holdings(address,
+                                                                  offset=Paginator.offset(page_number, pepes_per_page),
+                                                                  count=pepes_per_page)
         CardList.setup(
             pepe_query_tool=pepe_query_tool,
             card_results=address_collection,
+            total_count=address_collection_count,
             card_results_output_data=collection_list_data,
             cards_per_page=pepes_per_page,
             page_number=page_number,
             page_url_base=f'/{address}',
             list_type='address'
         )
-        loggers['data'].info(f"Search results data: {pformat(address_collection)}")
+        Logger.log_payload(loggers['data'], "Search results data:", address_collection)
         return collection_list_data
 
 
@@ -827,7 +871,7 @@ class FeaturedPepes:
         if loggers is None:
             loggers = {'data': logging.getLogger('data')}
         featured_pepes_list = pepe_query_tool.get_featured_pepes()
-        loggers['data'].info(f"featured_pepes_list: {pformat(featured_pepes_list)}")
+        Logger.log_payload(loggers['data'], "featured_pepes_list:", featured_pepes_list)
         featured_pepes = {}
         for featured_pepe in featured_pepes_list:
             if featured_pepe == 'PUMPURPEPE':
@@ -844,7 +888,7 @@ class FeaturedPepes:
                 'pepe_image_url': pepe_image_url
             }
             featured_pepes[featured_pepe] = featured
-        loggers['data'].info(f"Featured pepes data: {pformat(featured_pepes)}")
+        Logger.log_payload(loggers['data'], "Featured pepes data:", featured_pepes)
         return featured_pepes
 
 
@@ -872,9 +916,10 @@ class LatestDispensers:
             'cards': []
         }
         cards_data = pepe_query_tool.get_latest_pepe_dispensers(count=54)
-        loggers['data'].info(f"cards_data:\n{pformat(cards_data)}")
+        Logger.log_payload(loggers['data'], "cards_data:", cards_data)
+        cards_pepe_details = pepe_query_tool.get_pepe_details_many([card_data['asset'] for card_data in cards_data])
         for i, card_data in enumerate(cards_data):
-            pepe_details = pepe_query_tool.get_pepe_details(card_data['asset'])
+            pepe_details = cards_pepe_details[card_data['asset']]
             pepe_image_url = url_for(
                 'static',
                 filename=pepe_images_url_relative + pepe_query_tool.get_pepe_image_filename(
@@ -890,7 +935,7 @@ class LatestDispensers:
                 'pay': Formats.satoshis_to_str(card_data['satoshirate'])
             }
             data_output['cards'].append(card_values)
-        loggers['data'].info(f"Search results data: {pformat(data_output)}")
+        Logger.log_payload(loggers['data'], "Search results data:", data_output)
         return data_output
 
 
@@ -918,9 +963,10 @@ class RandomPepes:
             'cards': []
         }
         random_pepes = pepe_query_tool.get_random_pepes(count=54)
-        loggers['data'].info(f"random_pepes:{pformat(random_pepes)}")
+        Logger.log_payload(loggers['data'], "random_pepes:", random_pepes)
+        random_pepes_details = pepe_query_tool.get_pepe_details_many(random_pepes)
         for i, pepe_name in enumerate(random_pepes):
-            pepe_details = pepe_query_tool.get_pepe_details(pepe_name)
+            pepe_details = random_pepes_details[pepe_name]
             pepe_image_url = url_for(
                 'static',
                 filename=pepe_images_url_relative + pepe_query_tool.get_pepe_image_filename(
@@ -934,8 +980,8 @@ class RandomPepes:
                 'line_2': f"Supply: {real_supply_str}"
             }
             data_output['cards'].append(card_details)
-            loggers['data'].info(f"Card details: {pformat(card_details)}")
-        loggers['data'].info(f"Search results data: {pformat(data_output)}")
+            Logger.log_payload(loggers['data'], "Card details:", card_details)
+        Logger.log_payload(loggers['data'], "Search results data:", data_output)
         return data_output
 
 
@@ -997,7 +1043,7 @@ class PepeDispensers:
                 'xchain_tx_url': f"https://xchain.io/tx/{pepe_dispenser_data['tx_hash']}"
             }
             data_output['rows'].append(row_values)
-        loggers['data'].info(f"Search results data: {pformat(data_output)}")
+        Logger.log_payload(loggers['data'], "Search results data:", data_output)
         return data_output
 
 
@@ -1014,6 +1060,7 @@ class PepeOrders:
             pepe_query_tool: PepeData = None,
             price_tool: PriceTool = None,
             pepe_details=None,
+            pepe_orders: dict = None,
             fiat_enabled=False,
             loggers=None
     ) -> dict:
@@ -1024,20 +1071,19 @@ class PepeOrders:
         :param pepe_query_tool: PepeData object for querying pepe data
         :param price_tool: Price lookup tool
         :param pepe_details: Data for the pepe
+        :param pepe_orders: open orders of the pepe against the base asset, sorted by PepeData.sort_orders, if already
+        looked up
         :param fiat_enabled: whether to include fiat pricing in the pepe info box
         :param loggers: Logging object
         :return: data to be displayed on the pepe orders list for a pepe page
         """
         if loggers is None:
             loggers = {'data': logging.getLogger('data')}
-        pepe_sell_orders_data = sorted(
-            pepe_query_tool.get_pepe_orders(pepe_name, status='open', base_asset=base_asset)['give'],
-            key=lambda x: x['give_quantity'] / x['get_quantity'], reverse=True
-        )
-        pepe_buy_orders_data = sorted(
-            pepe_query_tool.get_pepe_orders(pepe_name, status='open', base_asset=base_asset)['get'],
-            key=lambda x: x['get_quantity'] / x['give_quantity']
-        )
+        if pepe_orders is None:
+            pepe_orders = PepeData.sort_orders(
+                pepe_query_tool.get_pepe_orders(pepe_name, status='open', base_asset=base_asset))
+        pepe_sell_orders_data = pepe_orders['give']
+        pepe_buy_orders_data = pepe_orders['get']
         output_order_type = {
             'get': 'buy',
             'give': 'sell'
@@ -1075,6 +1121,8 @@ class PepeOrders:
                 'orders': []
             }
         }
+        convert_rate = price_tool.get_xcp_rate() if base_asset == 'XCP' else price_tool.get_pepecash_rate()
+        btc_rate = price_tool.get_btc_rate()
         for db_order_type in ['get', 'give']:
             if db_order_type == 'get':
                 order_data_set = pepe_buy_orders_data
@@ -1093,9 +1141,7 @@ class PepeOrders:
                     order_data[f'{db_order_type}_remaining'], divisible=pepe_details['divisible'])
                 pepe_price_int = base_units / pepe_units
                 pepe_price_str = Formats.format_base_asset(pepe_price_int)
-                convert_rate = price_tool.get_xcp_rate() if base_asset == 'XCP' else price_tool.get_pepecash_rate()
-                price_in_btc = Formats.satoshis_to_str(
-                    convert_rate * pepe_price_int / price_tool.get_btc_rate() * 10 ** 8)
+                price_in_btc = Formats.satoshis_to_str(convert_rate * pepe_price_int / btc_rate * 10 ** 8)
                 usd_value = f"${pepe_price_int * convert_rate:,.2f}"
                 order_values = {
                     'pepe_amount': pepe_stock,
@@ -1107,7 +1153,7 @@ class PepeOrders:
                 }
                 data_output[output_order_type[db_order_type]]['orders'].append(order_values)
 
-        loggers['data'].info(f"Search results data: {pformat(data_output)}")
+        Logger.log_payload(loggers['data'], "Search results data:", data_output)
         return data_output
 
 
@@ -1136,23 +1182,30 @@ class PepeHolders:
         """
         if loggers is None:
             loggers = {'data': logging.getLogger('data')}
-        pepe_holders_data = pepe_query_tool.get_pepe_holdings(pepe_name)
         data_output = {
             'table_headings': ['Holder', 'Amount'],
-            'holders_count': len(pepe_holders_data),
             'rows': []
         }
-        total_real_holdings = Formats.pepe_units_normalize(pepe_details['supply'], pepe_details['divisible'])
-        known_burns = []
-        real_holders = []
-
-        for pepe_holder in pepe_holders_data:
-            if pepe_query_tool.is_burn_address(pepe_holder['address']):
-                known_burns.append(pepe_holder)
-                total_real_holdings -= Formats.pepe_units_normalize(pepe_holder['address_quantity'],
-                                                                    pepe_details['divisible'])
-            else:
-                real_holders.append(pepe_holder)
+        asset_stats = pepe_query_tool.get_asset_stats(pepe_name)
+        if asset_stats:  # totals maintained by db_updater, only the shown holders are read
+            real_holders = pepe_query_tool.get_top_holders(pepe_name, show_holder_count)
+            real_holders_count = asset_stats['holder_count']
+            data_output['holders_count'] = asset_stats['holder_count'] + asset_stats['burn_holder_count']
+            total_real_holdings = Formats.pepe_units_normalize(asset_stats['real_supply'], pepe_details['divisible'])
+        else:  # pepe not yet processed by db_updater since the asset_stats table was added
+            pepe_holders_data = pepe_query_tool.get_pepe_holdings(pepe_name)
+            data_output['holders_count'] = len(pepe_holders_data)
+            total_real_holdings = Formats.pepe_units_normalize(pepe_details['supply'], pepe_details['divisible'])
+            real_holders = []
+            burn_addresses = pepe_query_tool.burn_addresses
+
+            for pepe_holder in pepe_holders_data:
+                if pepe_holder['address'] in burn_addresses:
+                    total_real_holdings -= Formats.pepe_units_normalize(pepe_holder['address_quantity'],
+                                                                        pepe_details['divisible'])
+                else:
+                    real_holders.append(pepe_holder)
+            real_holders_count = len(real_holders)
 
         shown_quantities = 0
         for pepe_holder in real_holders[:show_holder_count]:
@@ -1176,7 +1229,7 @@ class PepeHolders:
         data_output['remaining_quantity'] = Formats.holders_table_amount_str(remain_supply,
                                                                              pepe_details['divisible'],
                                                                              is_normalized=True)
-        data_output['remaining_holders_count'] = len(real_holders) - show_holder_count
+        data_output['remaining_holders_count'] = real_holders_count - show_holder_count
         data_output['real_supply'] = Formats.pepe_normalized_supply_str(total_real_holdings, pepe_details['divisible'])
 
         return data_output
@@ -1197,12 +1250,14 @@ class CardList:
             page_number: int = 0,
             page_url_base: str = '',
             list_type: str = '',
-            search_text=''
+            search_text='',
+            total_count: int = None
     ):
         """
         Set up the data for a card list of pepes.
         :param pepe_query_tool: PepeData object for querying pepe data
         :param card_results: list of card data dictionaries to be displayed
+        :param total_count: number of results over all the pages, if card_results only holds the requested page
         :param card_results_output_data: dictionary to store the general display data
         :param cards_per_page: number of cards to be shown per page, if pagination is used
         :param page_number: page number to show data for, if pagination is used
@@ -1215,17 +1270,24 @@ class CardList:
             card_results_output_data = {}
         if card_results is None:
             card_results = [{}]
+        cards_pepe_details = pepe_query_tool.get_pepe_details_many(
+            [card_data['asset'] for card_data in card_results if 'asset' in card_data])
         all_cards = []
         for card_data in card_results:
+            pepe_details = cards_pepe_details.get(card_data.get('asset'))
             if list_type == 'search':
-                card = SearchResultCard.create(pepe_query_tool, card_data)
+                card = SearchResultCard.create(pepe_query_tool, card_data, pepe_details=pepe_details)
             elif list_type == 'address':
-                card = AddressCollectionCard.create(pepe_query_tool, card_data)
+                card = AddressCollectionCard.create(pepe_query_tool, card_data, pepe_details=pepe_details)
             else:
-                card = ArtistCollectionCard.create(pepe_query_tool, card_data)
+                card = ArtistCollectionCard.create(pepe_query_tool, card_data, pepe_details=pepe_details)
             all_cards.append(card)
 
-        if len(all_cards) > 0:
+        if total_count is not None:  # results already paginated by the source
+            if len(all_cards) > 0:
+                card_results_output_data['cards'] = all_cards
+            page_count = Paginator.page_count(total_count, cards_per_page)
+        elif len(all_cards) > 0:
             cards_paginated = Paginator.paginate(all_cards, cards_per_page)  # create pagination of the current cards
             card_results_output_data['cards'] = cards_paginated[
                 page_number]  # set the list of cards to the current page
@@ -1246,17 +1308,19 @@ class SearchResultCard:
         pass
 
     @staticmethod
-    def create(pepe_query_tool: PepeData, card_data: dict, loggers=None) -> dict:
+    def create(pepe_query_tool: PepeData, card_data: dict, loggers=None, pepe_details: dict = None) -> dict:
         """
         Construct the data to display a pepe card on the search results page
         :param pepe_query_tool: PepeData object for querying pepe data
         :param card_data: data pertaining to the pepe card
         :param loggers: Logging object
+        :param pepe_details: record of the pepe, if already looked up
         :return: data to be displayed for the search result card
         """
         if loggers is None:
             loggers = {'data': logging.getLogger('data')}
-        pepe_details = pepe_query_tool.get_pepe_details(card_data['asset'])
+        if pepe_details is None:
+            pepe_details = pepe_query_tool.get_pepe_details(card_data['asset'])
         real_supply_str = Formats.pepe_quantity_str(pepe_details['real_supply'], pepe_details['divisible'])
         search_result_card = {
             'pepe_name': card_data['asset'],
@@ -1265,7 +1329,7 @@ class SearchResultCard:
             'line_1': f"Series: {card_data['series']}",
             'line_2': f"Supply: {real_supply_str}"
         }
-        loggers['data'].info(f"Search results data: {pformat(search_result_card)}")
+        Logger.log_payload(loggers['data'], "Search results data:", search_result_card)
         return search_result_card
 
 
@@ -1276,17 +1340,19 @@ class ArtistCollectionCard:
         pass
 
     @staticmethod
-    def create(pepe_query_tool: PepeData, card_data: dict, loggers=None) -> dict:
+    def create(pepe_query_tool: PepeData, card_data: dict, loggers=None, pepe_details: dict = None) -> dict:
         """
         Construct the data for a pepe card on the artist collection page.
         :param pepe_query_tool: PepeData object for querying pepe data
         :param card_data: data pertaining to the pepe card
         :param loggers: Logging object
+        :param pepe_details: record of the pepe, if already looked up
         :return: data for displaying a pepe card on the artist collection page.
         """
         if loggers is None:
             loggers = {'data': logging.getLogger('data')}
-        pepe_details = pepe_query_tool.get_pepe_details(card_data['asset'])
+        if pepe_details is None:
+            pepe_details = pepe_query_tool.get_pepe_details(card_data['asset'])
         real_supply_str = Formats.pepe_quantity_str(pepe_details['real_supply'], pepe_details['divisible'])
         artist_collection_card = {
             'pepe_name': card_data['asset'],
@@ -1298,7 +1364,7 @@ class ArtistCollectionCard:
             'line_1': f"Series: {card_data['series']}",
             'line_2': f"Supply: {real_supply_str}"
         }
-        loggers['data'].info(f"Search results data: {pformat(artist_collection_card)}")
+        Logger.log_payload(loggers['data'], "Search results data:", artist_collection_card)
         return artist_collection_card
 
 
@@ -1309,17 +1375,19 @@ class AddressCollectionCard:
         pass
 
     @staticmethod
-    def create(pepe_query_tool: PepeData, card_data: dict, loggers=None) -> dict:
+    def create(pepe_query_tool: PepeData, card_data: dict, loggers=None, pepe_details: dict = None) -> dict:
         """
         Construct the data for displaying a pepe card on the address collection page.
         :param pepe_query_tool: PepeData object for querying pepe data
         :param card_data: ata pertaining to the pepe card
         :param loggers: Logging object
+        :param pepe_details: record of the pepe, if already looked up
         :return: data to be displayed for a pepe card on an address collection page.
         """
         if loggers is None:
             loggers = {'data': logging.getLogger('data')}
-        pepe_details = pepe_query_tool.get_pepe_details(card_data['asset'])
+        if pepe_details is None:
+            pepe_details = pepe_query_tool.get_pepe_details(card_data['asset'])
         own = Formats.pepe_quantity_str(
             card_data['address_quantity'], pepe_details['divisible'])
         real_supply_str = Formats.pepe_quantity_str(pepe_details['real_supply'], pepe_details['divisible'])
@@ -1333,7 +1401,7 @@ class AddressCollectionCard:
                         pepe_name=card_data['asset'])),
             'line_1': f"Owns {own} of {real_supply_str}"
         }
-        loggers['data'].info(f"Search results data: {pformat(address_collection_card)}")
+        Logger.log_payload(loggers['data'], "Search results data:", address_collection_card)
         return address_collection_card
 
 
@@ -1374,7 +1442,7 @@ class BTCPayServerHook:
         :return: None
         """
         btcpayserver_connection = BTCPayServerConnector(loggers=self.loggers)
-        self.loggers['data'].info(pformat(payload_json))
+        Logger.log_payload(self.loggers['data'], "Hook payload:", payload_json)
         self.loggers['purchases'].info(f"process_hook(\n{pformat(payload_json)}\n)")
         btcpayserver_query_tool = BTCPayServerData(btcpayserver_connection, loggers=self.loggers)
         if '__test__' not in payload_json['invoiceId']:
@@ -1402,7 +1470,9 @@ class PaymentQuery:
             loggers = {'data': logging.getLogger('data')}
         db_connection = DBConnector(loggers=loggers)
         pepe_query_tool = PepeData(db_connection, loggers=loggers)
-        return pepe_name in pepe_query_tool.get_pepe_names()
+        is_valid = pepe_name in pepe_query_tool.pepe_names
+        db_connection.close()
+        return is_valid
 
 
 class InvoiceData:
@@ -1,10 +1,15 @@
 # --*-- coding:utf-8 --*--
 import datetime
+import hashlib
 import json
 import logging
+import os
 import random
+import threading
+import time
 from pathlib import Path
 from pprint import pformat
+from types import MappingProxyType
 from typing import List
 
 import requests
@@ -12,7 +17,8 @@ from bs4 import BeautifulSoup
 
 import Settings
 from rpw.DataConnectors import DBConnector, RPCConnector, BTCPayServerConnector, XChainConnector
-from rpw.Utils import JSONTool
+from rpw.Metrics import Metrics
+from rpw.Utils import JSONTool, SearchIndex
 
 DB_TABLE_FIELDS = {  # List of fields corresponding to the values from a query result for each table
     'assets': ['id', 'asset', 'asset_longname', 'description', 'divisible', 'issuer', 'owner', 'source', 'locked',
@@ -27,6 +33,264 @@ DB_TABLE_FIELDS = {  # List of fields corresponding to the values from a query r
 }
 
 
+class SyncState:
+    """ Latest block synced into the database by tools/db_updater.py, as recorded in the db state file. """
+    _state = (None, 0)  # (modification time of the state file, block number)
+
+    @classmethod
+    def latest_block(cls) -> int:
+        """ Block number of the latest database sync. The state file is only re-read when it changes.
+        :return: block number, or 0 if no sync has been recorded
+        """
+        state_file = Settings.Sources['pepe_data']['db_state_file']
+        try:
+            mtime = os.stat(state_file).st_mtime_ns
+        except OSError:
+            return 0
+        if cls._state[0] != mtime:
+            with open(state_file) as f:
+                block = int(f.readline().strip() or 0)
+            cls._state = (mtime, block)
+        return cls._state[1]
+
+
+class SyncedSnapshot:
+    """ Base class for immutable snapshots of database data, loaded once per worker process and shared by every
+    request. A new snapshot is loaded, and swapped in place of the old one, when the version of the data changes
+    (by default, when the synced block advances) or the snapshot is older than its maximum age.
+    Subclasses set the query the snapshot is loaded from and build their lookups from its rows in __init__.
+    A snapshot is never built from a failed query: the previous one is kept, and the load retried on the next call.
+    """
+    class LoadFailed(Exception):
+        pass
+
+    description = 'snapshot'  # name used in log messages
+    query = ''  # query the snapshot is loaded from
+    max_age_setting = 'catalog_max_age'  # Settings.Sources['pepe_data'] key of the maximum age, in seconds
+    _current = None
+    _lock = threading.Lock()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._current = None  # each kind of snapshot is shared separately
+        cls._lock = threading.Lock()
+
+    def __init__(self, rows: List[dict], version: int = 0):
+        """ Build the snapshot from the query results.
+        :param rows: list of dictionaries representing each record
+        :param version: version of the data the rows correspond to
+        """
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def data_version(cls) -> int:
+        """ Current version of the underlying data: the latest synced block. """
+        return SyncState.latest_block()
+
+    @classmethod
+    def current(cls, db_connector: DBConnector = None, loggers=None):
+        """ Snapshot for the current version of the data, loading a new one if required.
+        :param db_connector: DBConnector object used if the snapshot has to be (re)loaded. Without one, a connection
+        is only checked out from the pool for the load.
+        :param loggers: Logging object
+        :return: the shared snapshot object
+        """
+        version = cls.data_version()
+        snapshot = cls._current
+        if snapshot is None or snapshot.is_stale(version):
+            with cls._lock:
+                snapshot = cls._current
+                if snapshot is None or snapshot.is_stale(version):
+                    load_connector = db_connector
+                    try:
+                        if load_connector is None:
+                            load_connector = DBConnector(loggers=loggers)
+                        snapshot = cls.load(load_connector, version, loggers=loggers)
+                    except (cls.LoadFailed, DBConnector.ConnectError) as e:
+                        if snapshot is None:
+                            raise
+                        errors_logger = (loggers or {}).get('errors', logging.getLogger('errors'))
+                        errors_logger.debug(f"{e} Keeping version {snapshot.version}.")
+                        return snapshot
+                    finally:
+                        if db_connector is None and load_connector is not None:
+                            load_connector.close()
+                    cls._current = snapshot
+        return snapshot
+
+    @classmethod
+    def load(cls, db_connector: DBConnector, version: int = 0, loggers=None):
+        """ Load a new snapshot from the database.
+        :param db_connector: DBConnector object for communication with the underlying db.
+        :param version: version of the data the snapshot corresponds to
+        :param loggers: Logging object
+        :return: snapshot object
+        :raise SyncedSnapshot.LoadFailed: the query failed
+        """
+        if loggers is None:
+            loggers = {'data_queries': logging.getLogger('data_queries')}
+        loggers['data_queries'].info(f"Loading {cls.description}, version {version}.")
+        rows = db_connector.query(cls.query)
+        if db_connector.last_statement_failed:
+            raise cls.LoadFailed(f"Loading {cls.description}, version {version}, failed.")
+        return cls(rows, version=version)
+
+    def is_stale(self, version: int) -> bool:
+        """ Whether the snapshot no longer corresponds to the data version, or has exceeded its maximum age. """
+        max_age = Settings.Sources['pepe_data'].get(self.max_age_setting, 600)
+        return version != self.version or time.monotonic() - self.loaded_at > max_age
+
+
+class AssetCatalog(SyncedSnapshot):
+    """ Immutable snapshot of the assets table, shared by every request of a worker process. """
+    description = 'asset catalog'
+    query = 'SELECT * FROM assets'
+
+    def __init__(self, asset_rows: List[dict], version: int = 0):
+        """ Build the catalog from the rows of the assets table.
+        :param asset_rows: list of dictionaries representing each asset record
+        :param version: synced block the rows correspond to
+        """
+        super().__init__(asset_rows, version=version)
+        self.assets = MappingProxyType({row['asset']: row for row in asset_rows})  # pepe name -> asset record
+        self.sorted_names = tuple(sorted(self.assets))
+        self.names = frozenset(self.sorted_names)
+        self.image_files = MappingProxyType({  # image file name without extension -> image file name
+            row['image_file_name'].split('.')[:-1][0]: row['image_file_name'] for row in asset_rows
+        })
+        self.series = MappingProxyType({row['asset']: row['series'] for row in asset_rows})
+        self.divisible = MappingProxyType({row['asset']: bool(row['divisible']) for row in asset_rows})
+        self.search_index = SearchIndex(self.sorted_names)
+
+
+class BurnAddresses(SyncedSnapshot):
+    """ Immutable set of the known burn addresses (addresses.is_burn, seeded from the burn addresses file),
+    shared by every request of a worker process. """
+    description = 'burn addresses'
+    query = 'SELECT address FROM addresses WHERE is_burn=1'
+
+    def __init__(self, address_rows: List[dict], version: int = 0):
+        """ Build the set from the burn address rows of the addresses table.
+        :param address_rows: list of dictionaries with the address of each burn address record
+        :param version: synced block the rows correspond to
+        """
+        super().__init__(address_rows, version=version)
+        self.addresses = frozenset(row['address'] for row in address_rows)
+
+    def __contains__(self, address: str) -> bool:
+        return address in self.addresses
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+
+class RateSnapshot(SyncedSnapshot):
+    """ Immutable copy of the USD rates in the prices table, shared by every request of a worker process.
+    tools/price_updater.py touches the prices state file after each run, which triggers a reload. """
+    description = 'price rates'
+    query = 'SELECT currency, usd_rate FROM prices'
+    max_age_setting = 'prices_max_age'
+
+    def __init__(self, price_rows: List[dict], version: int = 0):
+        """ Build the snapshot from the rows of the prices table.
+        :param price_rows: list of dictionaries with the currency and usd rate of each price record
+        :param version: modification time of the prices state file when the rows were loaded
+        """
+        super().__init__(price_rows, version=version)
+        self.usd_rates = MappingProxyType({row['currency']: row['usd_rate'] or 0 for row in price_rows})
+
+    @classmethod
+    def data_version(cls) -> int:
+        """ Current version of the prices: the modification time of the prices state file. """
+        try:
+            return os.stat(Settings.Sources['pepe_data']['prices_state_file']).st_mtime_ns
+        except (KeyError, OSError):
+            return 0
+
+    @staticmethod
+    def mark_updated():
+        """ Record that the prices table was updated, so every worker reloads its rates. """
+        Path(Settings.Sources['pepe_data']['prices_state_file']).touch()
+
+    def get(self, currency: str) -> float:
+        return self.usd_rates.get(currency, 0)
+
+
+class FaqContent:
+    """ Question and answer items of the FAQ page, parsed once per worker process and reloaded when the modification
+    time of the faq xml file changes. If the JSON file compiled from the xml by tools/faq_compile.py matches the
+    current xml content, it is read instead of parsing the xml.
+    """
+    _items = None
+    _source_mtime = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def items(cls, loggers=None) -> tuple:
+        """ FAQ items of the current faq file.
+        :param loggers: Logging object
+        :return: tuple of read-only dictionaries with the question and answer html of each item
+        """
+        source_file = Settings.Main['faq_file']
+        source_mtime = os.stat(source_file).st_mtime
+        if cls._items is None or source_mtime != cls._source_mtime:
+            with cls._lock:
+                if cls._items is None or source_mtime != cls._source_mtime:
+                    if loggers is None:
+                        loggers = {'data': logging.getLogger('data')}
+                    loggers['data'].info(f"Loading faq items from {source_file}.")
+                    items = cls.read_compiled(source_file)
+                    if items is None:
+                        items = cls.parse(source_file)
+                    cls._items = tuple(MappingProxyType(item) for item in items)
+                    cls._source_mtime = source_mtime
+        return cls._items
+
+    @staticmethod
+    def source_hash(source_file: str) -> str:
+        with open(source_file, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    @staticmethod
+    def parse(source_file: str) -> List[dict]:
+        """ Parse the question and answer html of each faq-item element of the faq xml file. """
+        with open(source_file, 'r') as f:
+            faq_content = BeautifulSoup(''.join(f.readlines()), 'lxml')
+        items = []
+        for faq_item in faq_content.find('questions').find_all('faq-item'):
+            items.append({
+                'question': ''.join(str(s) for s in faq_item.find('question').children).replace('\n', ''),
+                'answer': ''.join([str(s) for s in faq_item.find('answer').children]).replace('\n', '')
+            })
+        return items
+
+    @classmethod
+    def read_compiled(cls, source_file: str) -> List[dict] | None:
+        """ Items of the compiled faq file, or None if there is none or it was compiled from other xml content. """
+        compiled_file = Settings.Main.get('faq_compiled_file', '')
+        if not compiled_file or not os.path.exists(compiled_file):
+            return None
+        compiled = JSONTool.read_json_file(compiled_file)
+        if not compiled or compiled.get('source_hash') != cls.source_hash(source_file):
+            return None
+        return compiled['items']
+
+    @classmethod
+    def compile(cls, source_file: str = '', compiled_file: str = '') -> int:
+        """ Write the parsed faq items to the compiled JSON file.
+        :param source_file: faq xml file, the faq_file setting by default
+        :param compiled_file: file to write, the faq_compiled_file setting by default
+        :return: number of items written
+        """
+        source_file = source_file or Settings.Main['faq_file']
+        compiled_file = compiled_file or Settings.Main['faq_compiled_file']
+        items = cls.parse(source_file)
+        JSONTool.store_json_file(compiled_file, {'source_hash': cls.source_hash(source_file), 'items': items},
+                                 **JSONTool.JSON_PRETTY_KWARGS)
+        return len(items)
+
+
 class PepeData:
     """ Class for obtaining pepe information and dealing with various data requirements """
 
@@ -38,31 +302,54 @@ class PepeData:
             loggers = {'data_queries': logging.getLogger('data_queries')}
         self.loggers = loggers
         self.db_connection = db_connector  # db source of pepe data
-        self.pepe_names = self.get_pepe_names()  # list of tuples: (pepe_name, pepe_id)
-        self.pepe_images = self.get_pepe_image_file_names()  # dictionary of image filenames for each Pepe
+        self.catalog = AssetCatalog.current(db_connector, loggers=loggers)  # shared snapshot of the assets table
+        self.pepe_names = self.catalog.names  # set of pepe names
+        self.pepe_images = self.catalog.image_files  # dictionary of image filenames for each Pepe
+        self.burn_addresses = BurnAddresses.current(db_connector, loggers=loggers)  # shared set of burn addresses
 
     def get_pepe_details(self, pepe_name: str) -> dict:
         """ Details for each any pepe stored in the database
         :param pepe_name: The name of the pepe
         :return: tuple representing the pepe record, or None if no match found
         """
-        query = f'SELECT * FROM assets WHERE asset=\'{pepe_name}\''
-        query_data = self.db_connection.query_and_fetch(query)
+        query = 'SELECT * FROM assets WHERE asset=%s'
+        query_data = self.db_connection.query(query, (pepe_name,))
         if len(query_data) > 0:
             return query_data[0]
         else:
             return {}
 
+    def get_pepe_details_many(self, pepe_names: List[str]) -> dict[str, dict]:
+        """ Details for several pepes at once. Served from the asset catalog; pepes missing from it are looked up
+        in a single query.
+        :param pepe_names: names of the pepes
+        :return: dictionary of pepe name to the pepe record. Names with no record are left out.
+        """
+        details = {}
+        missing = []
+        for pepe_name in pepe_names:
+            asset_row = self.catalog.assets.get(pepe_name)
+            if asset_row is None:
+                missing.append(pepe_name)
+            else:
+                details[pepe_name] = dict(asset_row)
+        if missing:
+            missing = sorted(set(missing))
+            query = f"SELECT * FROM assets WHERE asset IN ({','.join(['%s'] * len(missing))})"
+            for asset_row in self.db_connection.query(query, tuple(missing)):
+                details[asset_row['asset']] = asset_row
+        return details
+
     def get_pepe_dispensers(self, pepe_name: str) -> List[dict]:
         """ List of pepe dispensers for a particular pepe.
         :param pepe_name: Name of the pepe.
         :return: List of dictionary entries representing each dispenser
         """
-        query = f'SELECT * FROM dispensers WHERE asset=\'{pepe_name}\' ' \
-                f'AND SUBSTRING(source,1,1)<>\'3\' ' \
-                f'AND give_remaining>0 ' \
-                f'AND status<>10'
-        data = self.db_connection.query_and_fetch(query)
+        query = 'SELECT * FROM dispensers WHERE asset=%s ' \
+                'AND SUBSTRING(source,1,1)<>\'3\' ' \
+                'AND give_remaining>0 ' \
+                'AND status<>10'
+        data = self.db_connection.query(query, (pepe_name,))
         dispensers = []
         if data:
             for dispenser_data in data:
@@ -76,13 +363,13 @@ class PepeData:
         :param count Number of dispensers to list
         :return: List of dictionary entries representing each dispenser
         """
-        query = f'SELECT * FROM dispensers ' \
-                f'WHERE give_remaining>0 ' \
-                f'AND asset<>\'XCP\' ' \
-                f'AND asset<>\'PEPECASH\' ' \
-                f'AND status<>10 ' \
-                f'ORDER BY block_index DESC LIMIT {count}'
-        data = self.db_connection.query_and_fetch(query)
+        query = 'SELECT * FROM dispensers ' \
+                'WHERE give_remaining>0 ' \
+                'AND asset<>\'XCP\' ' \
+                'AND asset<>\'PEPECASH\' ' \
+                'AND status<>10 ' \
+                'ORDER BY block_index DESC LIMIT %s'
+        data = self.db_connection.query(query, (count,))
         dispensers = []
         if data:
             for dispenser_data in data:
@@ -94,72 +381,146 @@ class PepeData:
         :param pepe_name: Name of the pepe.
         :return: List of dictionaries representing each holder and holdings
         """
-        query = f'SELECT * FROM holdings WHERE asset=\'{pepe_name}\' ORDER BY address_quantity DESC'
-        data = self.db_connection.query_and_fetch(query)
+        query = 'SELECT * FROM holdings WHERE asset=%s ORDER BY address_quantity DESC'
+        data = self.db_connection.query(query, (pepe_name,))
         holdings = []
         if data:
             for holding_data in data:
                 holdings.append(holding_data)
         return holdings
 
+    def get_top_holders(self, pepe_name: str, count: int) -> List[dict]:
+        """ Return the largest holdings of a pepe, excluding the known burn addresses.
+        :param pepe_name: Name of the pepe.
+        :param count: Number of holdings to return
+        :return: List of dictionaries representing each holder and holdings
+        """
+        query = "SELECT holdings.* FROM holdings " \
+                "LEFT JOIN addresses ON addresses.address=holdings.address " \
+                "WHERE holdings.asset=%s AND (addresses.is_burn IS NULL OR addresses.is_burn<>1) " \
+                "ORDER BY holdings.address_quantity DESC LIMIT %s"
+        return self.db_connection.query(query, (pepe_name, count))
+
+    def get_asset_stats(self, pepe_name: str) -> dict:
+        """ Return the stats of a pepe maintained by db_updater: real supply, holder counts, burned quantity,
+        top holder share, open dispenser count and floor price.
+        :param pepe_name: Name of the pepe.
+        :return: Dictionary of the asset_stats record, or an empty dictionary if the pepe has none
+        """
+        query = "SELECT * FROM asset_stats WHERE asset=%s"
+        results = self.db_connection.query(query, (pepe_name,))
+        if results:
+            return results[0]
+        return {}
+
     def derive_pepe_real_supply(self, pepe_name: str) -> int:
         """ Calculate holdings of a pepe, taking into consideration quantities known to have been burned and
         the divisibility status of the pepe. """
         pepe_details = self.get_pepe_details(pepe_name)
-        real_holdings_quantity = pepe_details['supply']
-        pepe_holdings = self.get_pepe_holdings(pepe_name)
-        for pepe_holder in pepe_holdings:
-            if self.is_burn_address(pepe_holder['address']):
-                real_holdings_quantity -= pepe_holder['address_quantity']
-        return real_holdings_quantity
-
-    def get_pepes_by_pattern(self, pattern: str) -> List[dict]:
-        """ Find all pepe details for each Pepe that contains the given pattern
+        return pepe_details['supply'] - self.get_pepe_burned_quantity(pepe_name)
+
+    def get_pepe_burned_quantity(self, pepe_name: str) -> int:
+        """ Total quantity of a pepe held by known burn addresses, summed in the database.
+        For callers which only need totals; the holders themselves are partitioned with the burn_addresses set.
+        :param pepe_name: Name of the pepe.
+        :return: burned quantity, in the pepe's base units
+        """
+        query = "SELECT COALESCE(SUM(holdings.address_quantity), 0) AS burned_quantity FROM holdings " \
+                "JOIN addresses ON addresses.address=holdings.address AND addresses.is_burn=1 " \
+                "WHERE holdings.asset=%s"
+        results = self.db_connection.query(query, (pepe_name,))
+        if results:
+            return int(results[0]['burned_quantity'])
+        return 0
+
+    def get_pepes_by_pattern(self, pattern: str, offset: int = 0, count: int = None) -> List[dict]:
+        """ Find the pepe details for each Pepe that contains the given pattern, ranked by the catalog's search index:
+        an exact match, then the pepes starting with the pattern, then the others.
         :param pattern: String representing the pattern to match in the Pepe name
+        :param offset: Number of ranked matches to skip
+        :param count: Number of matches to return, all of them if None
         :return: List of dictionary entries for each Pepe
         """
-        matched_pepes = sorted([pepe_name for pepe_name in self.pepe_names if pattern in pepe_name])
-        matched_data = []
-        for matched_pepe in matched_pepes:
-            matched_data.append(self.get_pepe_details(matched_pepe))
-        return matched_data
+        total, matched_pepes = self.catalog.search_index.search(pattern, offset=offset, limit=count)
+        matched_details = self.get_pepe_details_many(matched_pepes)
+        return [matched_details[matched_pepe] for matched_pepe in matched_pepes if matched_pepe in matched_details]
+
+    def suggest_pepe_names(self, text: str, limit: int) -> List[str]:
+        """ Pepe names for autocompletion: the names starting with text, then the other names containing it.
+        :param text: Text typed so far
+        :param limit: Maximum number of names to return
+        :return: List of pepe names
+        """
+        return self.catalog.search_index.search(text.upper(), limit=limit)[1]
+
+    def count_pepes_by_pattern(self, pattern: str) -> int:
+        """ Number of Pepes that contain the given pattern.
+        :param pattern: String representing the pattern to match in the Pepe name
+        """
+        return self.catalog.search_index.search(pattern, limit=0)[0]
 
-    def get_address_holdings(self, address: str) -> list:
-        """ List of assets for which an address is a holder.
+    def get_address_holdings(self, address: str, offset: int = 0, count: int = None) -> list:
+        """ List of assets for which an address is a holder, in order of asset name.
         :param address: The address to lookup.
+        :param offset: Number of holdings to skip
+        :param count: Number of holdings to return, all of them if None
         :return: A dictionary connecting to a list of dictionaries entries pertaining to the address
         """
-        query = f"SELECT * FROM holdings WHERE address=\'{address}\' ORDER BY asset"
-        data = self.db_connection.query_and_fetch((query))
+        if count is None:
+            query = "SELECT * FROM holdings WHERE address=%s ORDER BY asset"
+            params = (address,)
+        else:
+            query = "SELECT * FROM holdings WHERE address=%s ORDER BY asset LIMIT %s OFFSET %s"
+            params = (address, count, offset)
+        data = self.db_connection.query(query, params)
         holdings = []
         if data:
             for holding_data in data:
                 holdings.append(holding_data)
         return holdings
 
+    def count_address_holdings(self, address: str) -> int:
+        """ Number of assets for which an address is a holder.
+        :param address: The address to lookup.
+        """
+        query = "SELECT COUNT(*) AS holdings_count FROM holdings WHERE address=%s"
+        results = self.db_connection.query(query, (address,))
+        return results[0]['holdings_count'] if results else 0
+
     def is_burn_address(self, address: str) -> bool:
         """ Determine if a particular address is listed as a burn address.
         :param address the address to be checked.
         :return True if address is as burn address, false otherwise. """
-        query = f"SELECT is_burn FROM addresses WHERE address='{address}'"
-        results = self.db_connection.query_and_fetch(query)
-        if results:
-            return bool(results[0].get('is_burn', False))
-        return False
+        return address in self.burn_addresses
 
-    def get_address_artists(self, address: str) -> list:
-        """ List of assets for which address is an issuer.
+    def get_address_artists(self, address: str, offset: int = 0, count: int = None) -> list:
+        """ List of assets for which address is an issuer, in order of asset name.
         :param address: The address to lookup.
+        :param offset: Number of issuances to skip
+        :param count: Number of issuances to return, all of them if None
         :return: A list of issuances and their corresponding data
         """
-        query = f"SELECT * FROM assets WHERE source='{address}'"
-        data = self.db_connection.query_and_fetch(query)
+        if count is None:
+            query = "SELECT * FROM assets WHERE source=%s ORDER BY asset"
+            params = (address,)
+        else:
+            query = "SELECT * FROM assets WHERE source=%s ORDER BY asset LIMIT %s OFFSET %s"
+            params = (address, count, offset)
+        data = self.db_connection.query(query, params)
         issuances = []
         if data:
             for issuances_data in data:
                 issuances.append(issuances_data)
         return issuances
 
+    def count_address_artists(self, address: str) -> int:
+        """ Number of assets for which address is an issuer.
+        :param address: The address to lookup.
+        """
+        query = "SELECT COUNT(*) AS issuances_count FROM assets WHERE source=%s"
+        results = self.db_connection.query(query, (address,))
+        return results[0]['issuances_count'] if results else 0
+
     def get_pepe_orders(self, pepe_name: str, status: str = 'open', base_asset: str = '') -> dict:
         """ Get all orders corresponding to a particular pepe.
         :param pepe_name: name of pepe
@@ -168,15 +529,15 @@ class PepeData:
         :return: a dictionary with 'get' and 'give' keys corresponding to get and give orders for the pepe
         """
         if not base_asset:
-            query_get = f'SELECT * FROM orders WHERE get_asset=\'{pepe_name}\' AND status=\'{status}\''
-            query_give = f'SELECT * FROM orders WHERE give_asset=\'{pepe_name}\' AND status=\'{status}\''
+            query_get = 'SELECT * FROM orders WHERE get_asset=%s AND status=%s'
+            query_give = 'SELECT * FROM orders WHERE give_asset=%s AND status=%s'
+            params = (pepe_name, status)
         else:
-            query_get = f'SELECT * FROM orders WHERE get_asset=\'{pepe_name}\' AND status=\'{status}\' ' \
-                        f'AND give_asset=\'{base_asset}\''
-            query_give = f'SELECT * FROM orders WHERE give_asset=\'{pepe_name}\' AND status=\'{status}\' ' \
-                         f'AND get_asset=\'{base_asset}\';'
-        orders_data_get = self.db_connection.query_and_fetch(query_get)
-        orders_data_give = self.db_connection.query_and_fetch(query_give)
+            query_get = 'SELECT * FROM orders WHERE get_asset=%s AND status=%s AND give_asset=%s'
+            query_give = 'SELECT * FROM orders WHERE give_asset=%s AND status=%s AND get_asset=%s'
+            params = (pepe_name, status, base_asset)
+        orders_data_get = self.db_connection.query(query_get, params)
+        orders_data_give = self.db_connection.query(query_give, params)
         orders_get, orders_give = [], []
         if orders_data_get:
             for order_data in orders_data_get:
@@ -189,6 +550,41 @@ class PepeData:
             'give': orders_give
         }
 
+    @staticmethod
+    def sort_orders(pepe_orders: dict) -> dict:
+        """ Sort orders in the order of the order book: sell (give) orders by descending give/get quantity ratio,
+        buy (get) orders by ascending get/give quantity ratio.
+        :param pepe_orders: dictionary with 'get' and 'give' keys, as returned by get_pepe_orders
+        :return: dictionary with the sorted 'get' and 'give' lists
+        """
+        return {
+            'get': sorted(pepe_orders['get'], key=lambda x: x['get_quantity'] / x['give_quantity']),
+            'give': sorted(pepe_orders['give'], key=lambda x: x['give_quantity'] / x['get_quantity'], reverse=True)
+        }
+
+    def get_pepe_order_book(self, pepe_name: str, base_assets: List[str], status: str = 'open') -> dict:
+        """ Orders of a pepe against several base assets, fetched with one query, then split per base asset and
+        sorted as by sort_orders.
+        :param pepe_name: name of pepe
+        :param base_assets: base assets of the markets, e.g. ['XCP', 'PEPECASH']
+        :param status: status of the orders to lookup
+        :return: dictionary of base asset to a dictionary with sorted 'get' and 'give' lists
+        """
+        order_book = {base_asset: {'get': [], 'give': []} for base_asset in base_assets}
+        if not base_assets:
+            return order_book
+        base_placeholders = ','.join(['%s'] * len(base_assets))
+        query = f"SELECT * FROM orders WHERE get_asset=%s AND status=%s AND give_asset IN ({base_placeholders}) " \
+                f"UNION ALL " \
+                f"SELECT * FROM orders WHERE give_asset=%s AND status=%s AND get_asset IN ({base_placeholders})"
+        params = (pepe_name, status, *base_assets, pepe_name, status, *base_assets)
+        for order_data in self.db_connection.query(query, params):
+            if order_data['get_asset'] == pepe_name:
+                order_book[order_data['give_asset']]['get'].append(order_data)
+            else:
+                order_book[order_data['get_asset']]['give'].append(order_data)
+        return {base_asset: PepeData.sort_orders(pepe_orders) for base_asset, pepe_orders in order_book.items()}
+
     def get_random_pepes(self, count: int = 54) -> list:
         """
         Generate a list of random pepe names
@@ -197,10 +593,7 @@ class PepeData:
         :return: list of pepe names
         """
 
-        random_pepes = set()
-        while len(random_pepes) < count:
-            random_pepes.add(random.choice(self.get_pepe_names()))
-        return list(random_pepes)
+        return random.sample(self.catalog.sorted_names, min(count, len(self.catalog.sorted_names)))
 
     def featured_pepe_random(self, count: int = 54):
         """
@@ -208,10 +601,10 @@ class PepeData:
         :param count: Number of pepes to select from
         :return: randomly selected pepe name.
         """
-        query = f"SELECT * FROM dispensers " \
-                f"WHERE asset <> 'XCP' AND asset <> 'PEPECASH' " \
-                f"ORDER BY block_index DESC LIMIT {count}"
-        db_results = self.db_connection.query_and_fetch(query)
+        query = "SELECT * FROM dispensers " \
+                "WHERE asset <> 'XCP' AND asset <> 'PEPECASH' " \
+                "ORDER BY block_index DESC LIMIT %s"
+        db_results = self.db_connection.query(query, (count,))
         latest_pepes = sorted(set([result['asset'] for result in db_results]))
         return random.choice(latest_pepes)
 
@@ -225,7 +618,7 @@ class PepeData:
 
         # Get current slot entries
         slots_query = "SELECT asset FROM ad_slots"
-        slots_db_results = self.db_connection.query_and_fetch(slots_query)
+        slots_db_results = self.db_connection.query(slots_query)
         current_slots_entries = [slot_entry['asset'] for slot_entry in slots_db_results]
 
         for i, entry in enumerate(current_slots_entries):
@@ -262,22 +655,16 @@ class PepeData:
         return pepe_list
 
     def get_pepe_names(self) -> List[str]:
-        """ Generates the list pepe names from the database
-        :return: list of strings of pepe names
+        """ Generates the list pepe names from the asset catalog
+        :return: alphabetically sorted list of strings of pepe names
         """
-        query = 'SELECT asset FROM assets'
-        results = self.db_connection.query_and_fetch(query)
-        return [result['asset'] for result in results]
+        return list(self.catalog.sorted_names)
 
     def get_pepe_image_file_names(self) -> dict:
-        """ Generates the list pepe image file names from the database.
+        """ Generates the list pepe image file names from the asset catalog.
         :return: list of strings of pepe image file names
         """
-        query = 'SELECT image_file_name FROM assets'
-        results = self.db_connection.query_and_fetch(query)
-        return {
-            result['image_file_name'].split('.')[:-1][0]: result['image_file_name'] for result in results
-        }
+        return self.catalog.image_files
 
     @classmethod
     def get_pepe_id(cls, pepe_reference: str or int) -> str:
@@ -475,17 +862,20 @@ class BTCPayServerData:
         self.client = self.btcpayserver_connection.get_client()
 
     def get_invoice_data(self, invoice_id: str) -> dict:
-        return self.client.get_invoice(invoice_id)
+        with Metrics.external_call('btcpayserver', 'get_invoice'):
+            return self.client.get_invoice(invoice_id)
 
     def get_invoice_status(self):
         pass
 
     def create_invoice(self, purchase_data: dict) -> str:
-        return self.client.create_invoice(purchase_data).get('id', False)
+        with Metrics.external_call('btcpayserver', 'create_invoice'):
+            return self.client.create_invoice(purchase_data).get('id', False)
 
     def enqueue_ad(self, invoice_id: str):
         self.loggers['purchases'].info(f"Calling enqueue_ad({invoice_id})\n")
-        invoice_data = self.client.get_invoice(invoice_id=invoice_id)
+        with Metrics.external_call('btcpayserver', 'get_invoice'):
+            invoice_data = self.client.get_invoice(invoice_id=invoice_id)
         self.loggers['data'].info(f"invoice_data: \n{invoice_data}\n")
         self.loggers['purchases'].info(f"invoice_data: \n{invoice_data}\n")
 
@@ -494,12 +884,12 @@ class BTCPayServerData:
 
         table = 'ad_queue'
         pepe_name = invoice_data['itemDesc'].split()[6]
-        query = f"INSERT INTO {table} (asset,paid_invoice,block_amount) " \
-                f"VALUES ('{pepe_name}','{invoice_id}',{block_amount})"
-        self.loggers['data'].info(f"db_query: {query}")
-        self.loggers['purchases'].info(f"db_query: {query}")
+        query = f"INSERT INTO {table} (asset,paid_invoice,block_amount) VALUES (%s,%s,%s)"
+        params = (pepe_name, invoice_id, block_amount)
+        self.loggers['data'].info(f"db_query: {query}, parameters: {params}")
+        self.loggers['purchases'].info(f"db_query: {query}, parameters: {params}")
 
-        self.db_connection.execute(query)
+        self.db_connection.execute_and_commit(query, params)
         self.db_connection.close()
 
 
@@ -511,19 +901,20 @@ class AdvertisingData:
         self.db_connector = db_connector
 
     def get_queued_ad(self, invoice_id: str):
-        query_ad_slots = f"SELECT * FROM ad_queue WHERE paid_invoice='{invoice_id}'"
+        query_ad_slots = "SELECT * FROM ad_queue WHERE paid_invoice=%s"
         self.loggers['data_queries'].info(query_ad_slots)
-        queued_ad = [ad for ad in self.db_connector.query_and_fetch(query_ad_slots)]
+        queued_ad = [ad for ad in self.db_connector.query(query_ad_slots, (invoice_id,))]
         return queued_ad
 
     def estimate_time_to_listing(self, queue_id):
-        query_blocks_ahead = f"SELECT sum(block_amount) FROM ad_queue WHERE id<'{queue_id}'"
+        query_blocks_ahead = "SELECT sum(block_amount) FROM ad_queue WHERE id<%s"
         self.loggers['data_queries'].info(query_blocks_ahead)
-        blocks_ahead = self.db_connector.query_and_fetch()[0].get('sum(block_amount)', 0) // 3
-        query_current_ads = f"SELECT block_remain FROM ad_slots"
+        blocks_ahead = (self.db_connector.query(query_blocks_ahead, (queue_id,))[0]
+                        .get('sum(block_amount)') or 0) // 3
+        query_current_ads = "SELECT block_remain FROM ad_slots"
         self.loggers['data_queries'].info(query_current_ads)
         current_ads_remain_blocks_max = max(
-            [ad['block_remain'] for ad in self.db_connector.query_and_fetch(query_current_ads)])
+            [ad['block_remain'] for ad in self.db_connector.query(query_current_ads)])
         estimated_block_wait = current_ads_remain_blocks_max + blocks_ahead
         estimated_days = estimated_block_wait / 144
         if estimated_days < 1:
@@ -554,25 +945,27 @@ class AdvertisingData:
 
 
 class PriceTool:
-    """ Lookup the current prices, stored in the database"""
+    """ Lookup the current prices, stored in the database. Every conversion made with one PriceTool object uses
+    the same rates. """
 
     def __init__(self, db_connection: DBConnector, loggers=None):
         if loggers is None:
             loggers = {'data_queries': logging.getLogger('data_queries')}
         self.loggers = loggers
         self.db_connection = db_connection
+        self.rates = RateSnapshot.current(db_connection, loggers=loggers)  # shared snapshot of the prices table
+
+    def get_rate(self, currency: str) -> float:
+        return self.rates.get(currency)
 
     def get_btc_rate(self) -> float:
-        query = 'SELECT usd_rate FROM prices WHERE currency=\'BTC\''
-        return self.db_connection.query_and_fetch(query)[0].get('usd_rate', 0)
+        return self.get_rate('BTC')
 
     def get_xcp_rate(self) -> float:
-        query = 'SELECT usd_rate FROM prices WHERE currency=\'XCP\''
-        return self.db_connection.query_and_fetch(query)[0].get('usd_rate', 0)
+        return self.get_rate('XCP')
 
     def get_pepecash_rate(self) -> float:
-        query = 'SELECT usd_rate FROM prices WHERE currency=\'PEPECASH\''
-        return self.db_connection.query_and_fetch(query)[0].get('usd_rate', 0)
+        return self.get_rate('PEPECASH')
 
     def convert_satoshis_to_usd(self, units: int, convert_from: str = 'BTC'):
         if convert_from == 'PEPECASH':
@@ -609,7 +1002,9 @@ class XChainData:
         """ XChain block level
         :return: current block level on XChain
         """
-        return int(self.xchain_connection.query('network')['network_info']['mainnet']['block_height'])
+        block_height = int(self.xchain_connection.query('network')['network_info']['mainnet']['block_height'])
+        self.xchain_connection.observe_tip(block_height)
+        return block_height
 
     def get_pepe_details(self, pepe_name: str) -> dict:
         """ Current details of a pepe asset.
@@ -643,31 +1038,58 @@ class XChainData:
         """
         return self.xchain_connection.query('issuances', [pepe_name])['data'][-1]['issuer']
 
-    def get_pepe_holdings(self, pepe_name: str) -> dict:
+    def get_pepe_divisible(self, pepe_name: str) -> bool:
+        """ Divisibility of a pepe, when not passed on from get_pepe_details. Read from the response cache when the
+        asset was queried before, otherwise from the database; XChain is not queried again.
+        :param pepe_name: name of pepe
+        :return: True if the pepe is divisible
+        """
+        divisible = self.xchain_connection.cached_field('asset', [pepe_name], 'divisible')
+        if divisible is None:
+            divisible = self.stored_asset_details(pepe_name)['divisible']
+        return bool(divisible)
+
+    def stored_asset_details(self, asset: str) -> dict:
+        """ Details of an asset as currently stored in the database, or {} when it is not stored. The read snapshot
+        of the connection is ended first, so rows written by another connection since the last call are seen.
+        :param asset: name of the asset
+        """
+        self.db_connection.commit()
+        return self.pepe_query_tool.get_pepe_details(asset)
+
+    def get_pepe_holdings(self, pepe_name: str, divisible: bool = None) -> dict:
         """
         Get list of holdings for a pepe
         :param pepe_name: name of pepe
+        :param divisible: divisibility of the pepe, e.g. from get_pepe_details, if already known
         :return: Dictionary listing holdings for pepe
         """
         pepe_holdings = self.xchain_connection.query('holders', [pepe_name]).get('data', [])
-        pepe_details = self.pepe_query_tool.get_pepe_details(pepe_name)
+        if divisible is None:
+            divisible = self.get_pepe_divisible(pepe_name)
         for pepe_holding in pepe_holdings:
             pepe_holding.pop('estimated_value')
             pepe_holding.pop('percentage')
-            if pepe_details['divisible']:
+            if divisible:
                 pepe_holding['address_quantity'] = int(float(pepe_holding.pop('quantity')) * 100_000_000)
             else:
                 pepe_holding['address_quantity'] = int(pepe_holding.pop('quantity'))
         return pepe_holdings
 
-    def get_pepe_dispensers(self, pepe_name: str):
+    def get_pepe_dispensers(self, pepe_name: str, divisible: bool = None):
+        """ Get list of dispensers for a pepe
+        :param pepe_name: name of pepe
+        :param divisible: divisibility of the pepe, e.g. from get_pepe_details, if already known
+        :return: list of dispensers of the pepe
+        """
         pepe_dispensers = self.xchain_connection.query('dispensers', [pepe_name]).get('data', [])
-        pepe_details = self.pepe_query_tool.get_pepe_details(pepe_name)
+        if divisible is None:
+            divisible = self.get_pepe_divisible(pepe_name)
         for pepe_dispenser in pepe_dispensers:
             pepe_dispenser.pop('asset_longname')
             pepe_dispenser.pop('timestamp')
             pepe_dispenser['satoshirate'] = int(float(pepe_dispenser['satoshirate']) * 100_000_000)
-            if pepe_details['divisible']:
+            if divisible:
                 pepe_dispenser['escrow_quantity'] = int(float(pepe_dispenser['escrow_quantity']) * 100_000_000)
                 pepe_dispenser['give_quantity'] = int(float(pepe_dispenser['give_quantity']) * 100_000_000)
                 pepe_dispenser['give_remaining'] = int(float(pepe_dispenser['give_remaining']) * 100_000_000)
@@ -677,21 +1099,24 @@ class XChainData:
                 pepe_dispenser['give_remaining'] = int(pepe_dispenser['give_remaining'])
         return pepe_dispensers
 
-    def get_pepe_orders(self, pepe_name: str) -> dict:
-        """ Get orders for a pepe
+    def get_pepe_orders(self, pepe_name: str, pepe_details: dict = None) -> dict:
+        """ Get orders for a pepe. Orders against an asset which is not stored in the database are left out.
         :param pepe_name: Pepe for which to find orders
+        :param pepe_details: details of the pepe from get_pepe_details, so its orders are kept before the pepe itself
+        is written to the database
         :return: dictionary with keys, 'give', 'get' showing the list of give and get orders
         """
         pepe_orders_raw = self.xchain_connection.query('orders', [pepe_name]).get('data', [])
-        pepe_orders_all = []
+        assets_details = {pepe_name: pepe_details} if pepe_details else {}
         for pepe_order in pepe_orders_raw:
-            get_asset_details = self.pepe_query_tool.get_pepe_details(pepe_order['get_asset'])
-            give_asset_details = self.pepe_query_tool.get_pepe_details(pepe_order['give_asset'])
-            if get_asset_details and give_asset_details:
-                pepe_orders_all.append(pepe_order)
+            for asset in [pepe_order['get_asset'], pepe_order['give_asset']]:
+                if asset not in assets_details:
+                    assets_details[asset] = self.stored_asset_details(asset)
+        pepe_orders_all = [pepe_order for pepe_order in pepe_orders_raw
+                           if assets_details[pepe_order['get_asset']] and assets_details[pepe_order['give_asset']]]
         for pepe_order in pepe_orders_all:
-            get_asset_details = self.pepe_query_tool.get_pepe_details(pepe_order['get_asset'])
-            give_asset_details = self.pepe_query_tool.get_pepe_details(pepe_order['give_asset'])
+            get_asset_details = assets_details[pepe_order['get_asset']]
+            give_asset_details = assets_details[pepe_order['give_asset']]
             pepe_order.pop('get_asset_longname', '')
             pepe_order.pop('give_asset_longname', '')
             pepe_order.pop('timestamp', '')
@@ -741,10 +1166,8 @@ class XChainData:
         if not block_index:
             block_index = str(self.get_btc_current_block())
         logging.info(f"Listing pepes referenced in block {block_index}")
-        message_types = ['burns', 'credits', 'debits', 'destructions', 'dispensers', 'dispenses', 'dividends', 'orders',
-                         'order_matches', 'sends']
         pepes_in_block = set()
-        for message_type in message_types:
+        for message_type in XChainConnector.BLOCK_MESSAGE_METHODS:
             result = self.xchain_connection.query(message_type, [block_index])
             if result and result['data']:
                 for item in result['data']:
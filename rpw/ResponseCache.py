@@ -0,0 +1,172 @@
+# --*-- coding:utf-8 --*--
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class ResponseCache:
+    """ On-disk cache of API responses which never change once final, keyed by method and parameters.
+    Each cached method has a policy:
+    PERMANENT: the response is final as soon as it is received.
+    FINAL_BLOCK: the first parameter is a block index, and the response is final once the block is final_depth blocks
+    below the latest block observed (observe_tip), as a chain reorganization cannot reach it anymore.
+    FINAL_OLDEST_ITEM: the response lists items with a block_index in 'data', and is stored once the list is not empty
+    and its oldest item is in a final block, e.g. the originating issuance of an asset.
+    A tuple of field names: only those fields of the response are final. They are stored and read with field(), while
+    get() is never served for the method.
+    Entries are kept in a SQLite file, so they survive between runs and are shared by the processes using the file.
+    """
+    PERMANENT = 'permanent'
+    FINAL_BLOCK = 'final_block'
+    FINAL_OLDEST_ITEM = 'final_oldest_item'
+    COUNTER_NAMES = ['hits', 'misses', 'stores']  # hits and misses of get(), the lookups of whole responses
+
+    def __init__(self, cache_file: str, policies: dict, final_depth: int = 6, loggers=None):
+        """ Open, or create, the cache file.
+        :param cache_file: path of the SQLite file
+        :param policies: dictionary of method name -> PERMANENT, FINAL_BLOCK or tuple of final field names
+        :param final_depth: blocks below the tip a block has to be for its responses to be final
+        :param loggers: Logging object
+        """
+        if loggers is None:
+            loggers = {'errors': logging.getLogger('errors')}
+        self.loggers = loggers
+        self.cache_file = cache_file
+        self.policies = policies
+        self.final_depth = final_depth
+        self.counters = dict.fromkeys(ResponseCache.COUNTER_NAMES, 0)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        self.tip = self._read_tip()
+
+    def _connect(self) -> sqlite3.Connection:
+        """ Connection of the current process, shared by its threads under the lock. Reopened after a fork. """
+        if self._connection is None or self._connection_pid != os.getpid():
+            Path(self.cache_file).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.cache_file, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS responses (method TEXT NOT NULL, params TEXT NOT NULL, "
+                               "response TEXT NOT NULL, stored_at REAL NOT NULL, PRIMARY KEY (method, params))")
+            connection.execute("CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            connection.commit()
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def params_key(params) -> str:
+        return json.dumps([str(param) for param in params or []])
+
+    def _read_tip(self) -> int:
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM state WHERE name='tip'").fetchone()
+        return row[0] if row else 0
+
+    def observe_tip(self, block_index: int):
+        """ Record the latest block of the chain. The tip only moves forward, so an older one is ignored. """
+        if block_index <= self.tip:
+            return
+        self.tip = block_index
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT INTO state (name, value) VALUES ('tip', ?) "
+                               "ON CONFLICT(name) DO UPDATE SET value=MAX(value, excluded.value)", (block_index,))
+            connection.commit()
+
+    def is_final_block(self, block_index) -> bool:
+        """ Whether a block is final_depth blocks below the latest block observed. """
+        block_index = str(block_index)
+        return block_index.isdigit() and self.tip > 0 and int(block_index) <= self.tip - self.final_depth
+
+    def is_final(self, method: str, params) -> bool:
+        """ Whether the whole response of the query can no longer change, and can be served from the cache.
+        A FINAL_OLDEST_ITEM response is only stored once final (see is_final_response), so it is always served. """
+        policy = self.policies.get(method)
+        if policy in [ResponseCache.PERMANENT, ResponseCache.FINAL_OLDEST_ITEM]:
+            return True
+        if policy == ResponseCache.FINAL_BLOCK:
+            return self.is_final_block(params[0] if params else '')
+        return False
+
+    def is_final_response(self, method: str, params, response: dict) -> bool:
+        """ Whether a received response can no longer change, and can be stored. """
+        if self.policies.get(method) == ResponseCache.FINAL_OLDEST_ITEM:
+            items = response.get('data')
+            if not isinstance(items, list) or not items:
+                return False
+            block_indexes = [item.get('block_index') for item in items if isinstance(item, dict)]
+            if len(block_indexes) != len(items) or None in block_indexes:
+                return False
+            return self.is_final_block(min(int(block_index) for block_index in block_indexes))
+        return self.is_final(method, params)
+
+    def _read(self, method: str, params, count: bool = True):
+        with self._lock:
+            row = self._connect().execute("SELECT response FROM responses WHERE method=? AND params=?",
+                                          (method, ResponseCache.params_key(params))).fetchone()
+            if count:
+                self.counters['hits' if row else 'misses'] += 1
+        return json.loads(row[0]) if row else None
+
+    def get(self, method: str, params):
+        """ Cached response of a final query.
+        :return: the response, or None when the query is not final or not cached yet
+        """
+        if not self.is_final(method, params):
+            return None
+        return self._read(method, params)
+
+    def field(self, method: str, params, field_name: str):
+        """ Cached value of a final field of a method's response, e.g. the divisibility of an asset.
+        :return: the value, or None when not cached yet
+        """
+        if field_name not in self.policies.get(method, ()):
+            return None
+        response = self._read(method, params, count=False)
+        return response.get(field_name) if response else None
+
+    def store(self, method: str, params, response):
+        """ Store the response of a query, or its final fields, when the policy of the method allows it.
+        Responses which are not a dictionary, or report an error, are not stored.
+        """
+        policy = self.policies.get(method)
+        if not isinstance(response, dict) or not response or 'error' in response:
+            return
+        if isinstance(policy, tuple):
+            if not all(field_name in response for field_name in policy):
+                return
+            response = {field_name: response[field_name] for field_name in policy}
+        elif not self.is_final_response(method, params, response):
+            return
+        try:
+            response_json = json.dumps(response)
+        except (TypeError, ValueError) as e:
+            self.loggers['errors'].debug(f"Response cache: {method} {params} not stored: {e}")
+            return
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO responses (method, params, response, stored_at) "
+                               "VALUES (?, ?, ?, ?)",
+                               (method, ResponseCache.params_key(params), response_json, time.time()))
+            connection.commit()
+            self.counters['stores'] += 1
+
+    def clear(self):
+        """ Remove every cached response, and forget the tip. """
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.execute("DELETE FROM state")
+            connection.commit()
+            self.counters = dict.fromkeys(ResponseCache.COUNTER_NAMES, 0)
+        self.tip = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {**self.counters, 'entries': entries, 'tip': self.tip}
@@ -1,11 +1,141 @@
 # --*-- coding:utf-8 --*--
 import json
 import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
 from pathlib import Path
+from typing import List
+from urllib.parse import urlsplit
 
 import qrcode
 import requests
 from math import ceil
+from requests.adapters import HTTPAdapter
+
+import Settings
+
+
+class HTTPSessions:
+    """ Keep-alive HTTP sessions shared by the threads of a process, one per upstream service and host, so repeated
+    calls reuse pooled connections instead of opening a new (TLS) connection each time.
+    Requests have connect and read timeouts, and are retried on connection errors, timeouts and the retry_statuses
+    (429 and 5xx), waiting a random time up to an exponentially growing backoff, or the Retry-After of the response.
+    Settings: Settings.Sources['http']['defaults'], overridden per service by Settings.Sources['http'][service].
+    Sessions are keyed by process id, so a forked worker never reuses a socket of its parent.
+    """
+    COUNTER_NAMES = ['requests', 'retries', 'failures']
+    _sessions = {}  # (pid, service, scheme://host) -> requests.Session
+    counters = {}  # service -> {'requests': attempts sent, 'retries': attempts repeated, 'failures': calls given up}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def service_settings(service: str) -> dict:
+        http_settings = Settings.Sources.get('http', {})
+        return {**http_settings.get('defaults', {}), **http_settings.get(service, {})}
+
+    @classmethod
+    def session(cls, service: str, url: str) -> requests.Session:
+        """ Session of the current process for a service and the host of the url, created on first use. """
+        parts = urlsplit(url)
+        key = (os.getpid(), service, f"{parts.scheme}://{parts.netloc}")
+        session = cls._sessions.get(key)
+        if session is not None:
+            return session
+        with cls._lock:
+            if key not in cls._sessions:
+                cls._sessions = {k: v for k, v in cls._sessions.items() if k[0] == key[0]}
+                pool_size = cls.service_settings(service).get('pool_maxsize', 10)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False, max_retries=0)
+                session.mount(key[2], adapter)
+                cls._sessions[key] = session
+                cls.counters.setdefault(service, dict.fromkeys(cls.COUNTER_NAMES, 0))
+            return cls._sessions[key]
+
+    @classmethod
+    def count(cls, service: str, counter: str):
+        with cls._lock:
+            service_counters = cls.counters.setdefault(service, dict.fromkeys(cls.COUNTER_NAMES, 0))
+            service_counters[counter] += 1
+
+    @classmethod
+    def request(cls, method: str, url: str, service: str = 'default', **kwargs) -> requests.Response:
+        """ Send a request through the pooled session of the service, retrying failed attempts.
+        :param method: HTTP method, e.g. 'GET'
+        :param url: full url of the request
+        :param service: name of the upstream in the http settings, e.g. 'xchain'
+        :param kwargs: further arguments of requests.Session.request, e.g. data, headers, auth
+        :return: the response; after the last retry, the response with the retried status
+        :raise requests.RequestException: the connection error or timeout of the last attempt
+        """
+        service_settings = cls.service_settings(service)
+        retries = service_settings.get('retries', 0)
+        retry_statuses = set(service_settings.get('retry_statuses', []))
+        kwargs.setdefault('timeout', (service_settings.get('connect_timeout', 5),
+                                      service_settings.get('read_timeout', 30)))
+        session = cls.session(service, url)
+        for attempt in range(retries + 1):
+            cls.count(service, 'requests')
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == retries:
+                    cls.count(service, 'failures')
+                    raise
+                logging.info(f"HTTP {service}: {method} {url} failed ({e}), retrying.")
+                delay = cls.backoff(service_settings, attempt)
+            else:
+                if response.status_code not in retry_statuses:
+                    return response
+                if attempt == retries:
+                    cls.count(service, 'failures')
+                    return response
+                logging.info(f"HTTP {service}: {method} {url} returned {response.status_code}, retrying.")
+                delay = cls.backoff(service_settings, attempt, response.headers.get('Retry-After'))
+                response.close()
+            cls.count(service, 'retries')
+            time.sleep(delay)
+
+    @staticmethod
+    def backoff(service_settings: dict, attempt: int, retry_after: str = None) -> float:
+        """ Seconds to wait before retrying: the Retry-After of the response when given in seconds, otherwise a
+        random time up to backoff * 2^attempt. Both are capped at backoff_max. """
+        backoff_max = service_settings.get('backoff_max', 10)
+        if retry_after is not None and retry_after.strip().isdigit():
+            return min(float(retry_after), backoff_max)
+        return random.uniform(0, min(backoff_max, service_settings.get('backoff', 0.5) * 2 ** attempt))
+
+    @classmethod
+    def get(cls, url: str, service: str = 'default', **kwargs) -> requests.Response:
+        return cls.request('GET', url, service=service, **kwargs)
+
+    @classmethod
+    def post(cls, url: str, service: str = 'default', **kwargs) -> requests.Response:
+        return cls.request('POST', url, service=service, **kwargs)
+
+    @classmethod
+    def stats(cls) -> dict:
+        """ Counters of each service, with the connections opened and the requests sent over reused connections.
+        :return: dictionary of service name -> dictionary of counters
+        """
+        with cls._lock:
+            stats = {service: {**service_counters, 'connections': 0, 'reused': 0}
+                     for service, service_counters in cls.counters.items()}
+            sessions = [(key[1], session) for key, session in cls._sessions.items() if key[0] == os.getpid()]
+        for service, session in sessions:
+            for adapter in session.adapters.values():
+                pools = adapter.poolmanager.pools
+                for pool_key in pools.keys():
+                    pool = pools.get(pool_key)
+                    if pool is None:
+                        continue
+                    stats[service]['connections'] += pool.num_connections
+                    stats[service]['reused'] += max(0, pool.num_requests - pool.num_connections)
+        return stats
 
 
 class JSONTool:
@@ -67,13 +197,14 @@ class JSONTool:
             cp_file.write(cp_str)
 
     @classmethod
-    def query_endpoint(cls, query_url) -> dict | bool:
+    def query_endpoint(cls, query_url, service: str = 'default') -> dict | bool:
         """ Request data from an api that returns json formulated data
         :param query_url: The full url of the query
+        :param service: upstream of the url in the http settings, whose pooled session, timeouts and retries are used
         :return: dictionary object representing the response from the api or None if an decoding error occurred
         """
         logging.info(f"Querying endpoint: {query_url}")
-        response = requests.get(query_url)
+        response = HTTPSessions.get(query_url, service=service)
         data = ""
         try:
             data = json.loads(response.text)
@@ -105,3 +236,84 @@ class Paginator:
         c = items_per_page
         p = ceil(len(data_set) / c)  # number of pages
         return [data_set[i * c:i * c + c] for i in range(p)]
+
+    @staticmethod
+    def page_count(item_count: int, items_per_page: int) -> int:
+        return ceil(item_count / items_per_page) if items_per_page else 0
+
+    @staticmethod
+    def offset(page_number: int, items_per_page: int) -> int:
+        """ Number of items before a page, counting pages from 0. """
+        return max(page_number, 0) * items_per_page
+
+
+class SearchIndex:
+    """ In-memory index of names for prefix and substring search.
+    Prefixes are looked up with bisect in the sorted names. Substrings are looked up in posting lists of the 1, 2 and 3
+    character grams of every name: for search text longer than a trigram, the posting lists of its trigrams are
+    intersected and the candidates checked with a substring test.
+    """
+    GRAM_SIZE = 3
+
+    def __init__(self, names):
+        """ Build the index.
+        :param names: iterable of the names to index
+        """
+        self.sorted_names = tuple(sorted(set(names)))
+        postings = defaultdict(list)  # gram -> ascending positions in sorted_names of the names containing it
+        for position, name in enumerate(self.sorted_names):
+            grams = {name[i:i + size] for size in range(1, self.GRAM_SIZE + 1) for i in range(len(name) - size + 1)}
+            for gram in grams:
+                postings[gram].append(position)
+        self.postings = {gram: tuple(positions) for gram, positions in postings.items()}
+
+    def prefix_range(self, prefix: str) -> range:
+        """ Positions in sorted_names of the names starting with prefix. """
+        start = bisect_left(self.sorted_names, prefix)
+        end = bisect_right(self.sorted_names, prefix + '\U0010ffff', lo=start)
+        return range(start, end)
+
+    def prefix_matches(self, prefix: str, limit: int = None) -> List[str]:
+        """ Names starting with prefix, in alphabetical order.
+        :param prefix: start of the names
+        :param limit: maximum number of names to return
+        """
+        positions = self.prefix_range(prefix)
+        if limit is not None:
+            positions = positions[:limit]
+        return [self.sorted_names[position] for position in positions]
+
+    def substring_positions(self, text: str) -> List[int]:
+        """ Positions in sorted_names of the names containing text, in ascending order. """
+        if not text:
+            return list(range(len(self.sorted_names)))
+        if len(text) <= self.GRAM_SIZE:
+            return list(self.postings.get(text, ()))
+        trigram_postings = []
+        for i in range(len(text) - self.GRAM_SIZE + 1):
+            positions = self.postings.get(text[i:i + self.GRAM_SIZE])
+            if positions is None:
+                return []
+            trigram_postings.append(positions)
+        trigram_postings.sort(key=len)
+        candidates = set(trigram_postings[0])
+        for positions in trigram_postings[1:]:
+            candidates.intersection_update(positions)
+            if not candidates:
+                return []
+        return sorted(position for position in candidates if text in self.sorted_names[position])
+
+    def search(self, text: str, offset: int = 0, limit: int = None) -> tuple[int, List[str]]:
+        """ Names containing text, ranked: an exact match first, then the names starting with text, then the other
+        names containing it, each group in alphabetical order.
+        :param text: text to search for
+        :param offset: number of ranked matches to skip
+        :param limit: maximum number of names to return, all of them if None
+        :return: Tuple. first element: total number of matches. second element: the requested page of names.
+        """
+        positions = self.substring_positions(text)
+        prefix_positions = self.prefix_range(text)
+        ranked = [position for position in positions if position in prefix_positions]
+        ranked.extend(position for position in positions if position not in prefix_positions)
+        end = None if limit is None else offset + limit
+        return len(ranked), [self.sorted_names[position] for position in ranked[offset:end]]
@@ -3,13 +3,18 @@ import logging
 import traceback
 from pprint import pformat
 
-from flask import Flask, jsonify
+from flask import Flask, Response, abort, jsonify
 from flask import render_template, request, redirect
 from werkzeug.exceptions import HTTPException
 
+import Settings
+from rpw.Caching import PageCache, ConditionalGet
+from rpw.DataConnectors import DBConnector
+from rpw.Metrics import Metrics, StatementFingerprints
 from rpw.PagesData import IndexPage, ArtistPage, SearchPage, SubPage, AdvertisePage, BTCPayServerHook, PaidPage, \
-    FaqPage, CommonPageData, InvoiceData
+    FaqPage, CommonPageData, InvoiceData, PepeSuggestions
 from rpw.Logging import Logger
+from rpw.Utils import HTTPSessions
 
 # Flask main object
 app = Flask(__name__, instance_relative_config=True)
@@ -25,13 +30,62 @@ loggers = {
     'data': Logger.setup_logger('data', logging.getLogger('data')),
     'data_queries': Logger.setup_logger('data_queries', logging.getLogger('data_queries')),
     'errors': Logger.setup_logger('errors', logging.getLogger('errors')),
+    'slow_queries': Logger.setup_logger('slow_queries', logging.getLogger('slow_queries')),
     'purchases': Logger.setup_logger('purchases', logging.getLogger('purchases'))
 }
 
+# Rendered pages, shared by the requests of this worker process
+page_cache = PageCache(loggers=loggers)
+# ETag/Last-Modified validators and Cache-Control headers of the page routes
+conditional_get = ConditionalGet(loggers=loggers)
+
+
+def metrics_samples() -> list:
+    """ Gauges read on each /metrics scrape: connection pools, page cache, conditional GETs, the log queue, the HTTP
+    sessions of the upstream services, and the statement fingerprints with the most total time. """
+    samples = []
+    for pool_stats in DBConnector.pool_stats():
+        labels = {'database': pool_stats['database']}
+        for name, value in pool_stats.items():
+            if name != 'database':
+                samples.append((f"rpw_db_pool_{name}", f"Connection pool {name.replace('_', ' ')}.", labels, value))
+        prepared = pool_stats['statement_cache_hits'] + pool_stats['statements_prepared']
+        samples.append(('rpw_db_statement_cache_hit_ratio', 'Prepared statements served from the statement cache.',
+                        labels, pool_stats['statement_cache_hits'] / prepared if prepared else 0))
+    page_cache_stats = page_cache.stats()
+    for name in ['hits', 'disk_hits', 'misses', 'stores', 'invalidations', 'disk_evictions', 'entries']:
+        samples.append((f"rpw_page_cache_{name}", f"Page cache {name.replace('_', ' ')}.", {},
+                        page_cache_stats[name]))
+    lookups = page_cache_stats['hits'] + page_cache_stats['disk_hits'] + page_cache_stats['misses']
+    samples.append(('rpw_page_cache_hit_ratio', 'Page cache lookups served from memory or disk.', {},
+                    (page_cache_stats['hits'] + page_cache_stats['disk_hits']) / lookups if lookups else 0))
+    for name, value in conditional_get.stats().items():
+        samples.append((f"rpw_conditional_get_{name}", f"Conditional GET requests {name.replace('_', ' ')}.", {},
+                        value))
+    for name, value in Logger.pipeline_stats().items():
+        samples.append((f"rpw_log_queue_{name}", f"Log queue {name}.", {}, value))
+    for service, http_stats in HTTPSessions.stats().items():
+        for name, value in http_stats.items():
+            samples.append((f"rpw_http_{name}", f"HTTP {name} to an upstream service.", {'service': service}, value))
+    for statement in StatementFingerprints.top(Settings.Metrics.get('top_fingerprints', 0)):
+        labels = {'fingerprint': statement['fingerprint']}
+        samples.append(('rpw_db_fingerprint_statements', 'Statements executed, by fingerprint.', labels,
+                        statement['count']))
+        samples.append(('rpw_db_fingerprint_seconds', 'Total statement time, by fingerprint.', labels,
+                        statement['total_seconds']))
+        samples.append(('rpw_db_fingerprint_p95_seconds', '95th percentile of recent statement times, by fingerprint.',
+                        labels, statement['p95_seconds']))
+    return samples
+
+
+Metrics.add_collector(metrics_samples)
+
 
 # Flask app entry point
 def create_app():
     @app.route('/')
+    @conditional_get.conditional('index')
+    @page_cache.cached('index')
     def index():
         """ Render template for root of website
          :return: Flask rendered template
@@ -44,6 +98,8 @@ def create_app():
 
     @app.route('/<page_name>/', methods=['GET', 'POST'], defaults={'page_number': 1})
     @app.route('/<page_name>/<int:page_number>/', methods=['GET', 'POST'])
+    @conditional_get.conditional('sub_page')
+    @page_cache.cached('sub_page')
     def sub_page(page_name: str, page_number: int):
         """ Given a valid sub-page name, render either a pepe or an address page, or a 404 page.
         :param page_number: page number to show in the rendering
@@ -66,10 +122,13 @@ def create_app():
             return render_template('address.html', **subpage_data[1])
         else:  # invalid page type
             loggers['root'].info("Rendering template: 404.html")
-            return render_template('404.html', **subpage_data[1])
+            # not found status, so the page cache never stores a page per unknown path
+            return render_template('404.html', **subpage_data[1]), 404
 
     @app.route('/artist/<address_str>/', methods=['GET', 'POST'], defaults={'page_number': 1})
     @app.route('/artist/<address_str>/<int:page_number>/', methods=['GET', 'POST'])
+    @conditional_get.conditional('artist')
+    @page_cache.cached('artist')
     def artist(address_str, page_number):
         """ Render a page showing all the pepe issuers, represented by an address
         :param address_str:  Address of the issuer
@@ -98,6 +157,8 @@ def create_app():
 
     @app.route('/search/<search_text>/', defaults={'page_number': 1})
     @app.route('/search/<search_text>/<int:page_number>/')
+    @conditional_get.conditional('search')
+    @page_cache.cached('search')
     def search(search_text, page_number):
         """ Render page showing the results of a search query term.
         :param search_text: Text of query
@@ -133,6 +194,18 @@ def create_app():
             **ad_page_data
         )
 
+    @app.route('/api/suggest')
+    @conditional_get.conditional('suggest')
+    def suggest():
+        """ Pepe name suggestions for the text typed in a search or pepe name box.
+        Query arguments: q, the text typed so far, and optionally limit, the number of suggestions wanted.
+        :return: JSON object with the query text and the list of suggested pepe names
+        """
+        query_text = request.args.get('q', '')
+        limit = request.args.get('limit', 0, type=int)
+        loggers['root'].info(f"Calling route /api/suggest with query {query_text}")
+        return jsonify(PepeSuggestions.create(query_text, limit=limit, loggers=loggers))
+
     @app.route('/faq/', defaults={'show_number': 0})
     @app.route('/faq/<show_number>/')
     def faq(show_number):
@@ -209,6 +282,31 @@ def create_app():
             loggers['purchases'].info(f"Webhook request was attempted and failed.")
             return 'POST Method not supported', 405
 
+    @app.before_request
+    def start_request_metrics():
+        Metrics.begin_request()
+
+    @app.after_request
+    def record_request_metrics(response):
+        route = request.url_rule.endpoint if request.url_rule else 'unmatched'
+        Metrics.end_request(route, request.method, response.status_code)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """ Request, database, external call and cache metrics of this worker process, in the Prometheus text format.
+        Only served to the addresses in the Metrics settings, directly or through a proxy.
+        """
+        metrics_settings = Settings.Metrics
+        allowed_addresses = metrics_settings.get('allowed_addresses', [])
+        client_addresses = [request.remote_addr] + [address.strip() for address in
+                                                    request.headers.get('X-Forwarded-For', '').split(',')
+                                                    if address.strip()]
+        if not metrics_settings.get('enabled', False) \
+                or (allowed_addresses and any(address not in allowed_addresses for address in client_addresses)):
+            abort(404)
+        return Response(Metrics.render(), mimetype='text/plain; version=0.0.4')
+
     @app.errorhandler(Exception)
     def handle_exception(e):
         """ Render error page when site error occurs that is not handled. """
@@ -1,27 +1,35 @@
 /**
  JQuery Autocomplete and supporting functions.
+ Pepe names are suggested by the /api/suggest endpoint (see pepe_suggest.js).
  */
 $(function () {
     $("#pepe-input-text-box").autocomplete({
-        source: function (request, response) {
-            var results = $.ui.autocomplete.filter(pepe_names, request.term);
-            response(results.slice(0, 15))
-        }
+        source: suggest_pepe_names,
+        minLength: 1
     });
 });
 
 
-function verify_pepe(pepe_name, pepe_list) {
-    if (!(pepe_list.includes(pepe_name))) {
-        errorTarget = document.getElementById('invalid_pepe');
-        errorTarget.textContent = pepe_name + " is not a rare pepe name. Please re-enter the name.";
-        return false;
-    } else {
-        tagTarget = document.getElementsByName('checkoutDesc')[0];
-        tagTarget.value = tagTarget.value.replace('_PEPE_NAME_', get_typed_pepe());
-        input_box_select();
-        return true;
-    }
+function verify_pepe(pepe_name) {
+    // ask the suggest endpoint whether the typed name is a pepe, then submit the form if it is
+    var form = document.getElementById('btcpay-form');
+    $.getJSON('/api/suggest', {q: pepe_name, limit: 1})
+        .done(function (data) {
+            if (!(data.suggestions.includes(pepe_name))) {
+                errorTarget = document.getElementById('invalid_pepe');
+                errorTarget.textContent = pepe_name + " is not a rare pepe name. Please re-enter the name.";
+                return;
+            }
+            tagTarget = document.getElementsByName('checkoutDesc')[0];
+            if (tagTarget) {
+                tagTarget.value = tagTarget.value.replace('_PEPE_NAME_', get_typed_pepe());
+            }
+            if (typeof input_box_select === 'function') {
+                input_box_select();
+            }
+            HTMLFormElement.prototype.submit.call(form);  // the submit button shadows form.submit
+        });
+    return false;
 }
 
 function get_typed_pepe() {
@@ -0,0 +1,32 @@
+/**
+ Pepe name suggestions from the /api/suggest endpoint, for JQuery UI autocomplete boxes.
+ */
+var pepe_suggestions_cache = {};
+
+function suggest_pepe_names(request, response) {
+    var term = request.term.trim().toUpperCase();
+    if (term in pepe_suggestions_cache) {
+        response(pepe_suggestions_cache[term]);
+        return;
+    }
+    $.getJSON('/api/suggest', {q: term})
+        .done(function (data) {
+            pepe_suggestions_cache[term] = data.suggestions;
+            response(data.suggestions);
+        })
+        .fail(function () {
+            response([]);
+        });
+}
+
+$(function () {
+    $("#search-input").autocomplete({
+        source: suggest_pepe_names,
+        minLength: 2,
+        delay: 150,
+        select: function (event, ui) {
+            $("#search-input").val(ui.item.value);
+            $("#section-search-form").submit();
+        }
+    });
+});
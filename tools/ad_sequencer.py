@@ -16,9 +16,12 @@ logging.basicConfig(filename='../logs/ad_sequencer.log',
 
 
 class AdSequencer:
+    AD_SLOT_COLUMNS = ('slot_number', 'asset', 'block_remain', 'paid_invoice')  # fields of the default ads settings
+
     def __init__(self):
         self.LAST_BLOCK_FILE = "../rpw/static/data/ad_latest_block_check"
-        self.default_ads = Ads['default_ads']
+        self.default_ads = {name: dict(zip(AdSequencer.AD_SLOT_COLUMNS, ad))
+                            for name, ad in Ads['default_ads'].items()}
         self.cp_connection = RPCConnector()
         self.cp_data = CPData(self.cp_connection)
         self.db_connection = DBConnector()
@@ -39,90 +42,94 @@ class AdSequencer:
         return last_block_checked
 
     def decrement_blocks_remaining(self):
-        for i in range(1, 4):
-            query_decrement = f'UPDATE ad_slots SET ' \
-                              f'block_remain=IF(block_remain=0, 0, block_remain-1) WHERE slot_number={i}'
-            print(f"Query: {query_decrement}")
-            self.db_connection.execute(query_decrement)
+        query_decrement = 'UPDATE ad_slots SET ' \
+                          'block_remain=IF(block_remain=0, 0, block_remain-1) WHERE slot_number=%s'
+        print(f"Query: {query_decrement}")
+        self.db_connection.executemany(query_decrement, [(i,) for i in range(1, 4)])
 
     def get_current_ads(self):
         # ads history, Just informational, not part of the algorithm
         query_ad_slots = 'SELECT * FROM ad_slots'
-        ad_slots = [ad for ad in self.db_connection.query_and_fetch(query_ad_slots)]
+        ad_slots = self.db_connection.query(query_ad_slots)
         print(f"Current ad slots:\n{pformat(ad_slots)}\n")
         return ad_slots
 
     def get_active_ads_count(self):
-        query_active = 'SELECT COUNT(*) FROM ad_slots WHERE block_remain>0'
-        active_ads = [ad for ad in self.db_connection.query_and_fetch(query_active)]
+        query_active = 'SELECT COUNT(*) AS active FROM ad_slots WHERE block_remain>0'
+        active_ads = self.db_connection.query(query_active)
         print(f"Active ads:\n{pformat(active_ads)}\n")
-        return active_ads[0][0]
+        return active_ads[0]['active']
 
     def get_finished_ads_count(self):
-        query_finished = 'SELECT COUNT(*) FROM ad_slots WHERE block_remain=0'
-        finished_ads = [ad for ad in self.db_connection.query_and_fetch(query_finished)]
+        query_finished = 'SELECT COUNT(*) AS finished FROM ad_slots WHERE block_remain=0'
+        finished_ads = self.db_connection.query(query_finished)
         print(f"Finished ads:\n{pformat(finished_ads)}\n")
-        return finished_ads[0][0]
+        return finished_ads[0]['finished']
 
     def get_ready_ads(self, count: int):
-        query_ad_queue = f'SELECT * FROM ad_queue ORDER BY id LIMIT {count}'
-        queued_ads = [ad for ad in self.db_connection.query_and_fetch(query_ad_queue)]
+        # a queued ad fills a slot for its block_amount, so it is also read as the block_remain of the slot
+        query_ad_queue = 'SELECT id, asset, block_amount, block_amount AS block_remain, paid_invoice ' \
+                         'FROM ad_queue ORDER BY id LIMIT %s'
+        queued_ads = self.db_connection.query(query_ad_queue, (count,))
         print(f"Query: {query_ad_queue}")
         return queued_ads
 
     def display_ad_slots(self):
         # ads history, Just informational, not part of the algorithm
         query_ad_slots = 'SELECT * FROM ad_slots'
-        ad_slots = [ad for ad in self.db_connection.query_and_fetch(query_ad_slots)]
+        ad_slots = self.db_connection.query(query_ad_slots)
         print(f"Running:\n{pformat(ad_slots)}\n")
 
     def display_ad_queue(self):
         # ads history, Just informational, not part of the algorithm
         query_ad_queue = 'SELECT * FROM ad_queue'
-        ad_queue = [ad for ad in self.db_connection.query_and_fetch(query_ad_queue)]
+        ad_queue = self.db_connection.query(query_ad_queue)
         print(f"Queue:\n{pformat(ad_queue)}\n")
 
     def display_ad_history(self):
         # ads history, Just informational, not part of the algorithm
         query_ad_history = 'SELECT * FROM ad_history'
-        historical_ads = [ad for ad in self.db_connection.query_and_fetch(query_ad_history)]
+        historical_ads = self.db_connection.query(query_ad_history)
         print(f"History:\n{pformat(historical_ads)}\n")
 
     def display_ad_slot_history(self):
         # ads history, Just informational, not part of the algorithm
         query_ad_history = 'SELECT * FROM ad_slot_history'
         print(f"Slot history query: {query_ad_history}")
-        slot_ads_history = [ad for ad in self.db_connection.query_and_fetch(query_ad_history)]
+        slot_ads_history = self.db_connection.query(query_ad_history)
         print(f"History:\n{pformat(slot_ads_history)}\n")
 
     def move_to_history(self, ad_queue_entry: dict):
         # insert queued ad into ad_history
         print(f"Move to history...")
-        query_insert_to_history = f'INSERT INTO ad_history ' \
-                                  f'(asset,block_amount,paid_invoice) ' \
-                                  f'VALUES (\'{ad_queue_entry[1]}\',\'{ad_queue_entry[2]}\',\'{ad_queue_entry[3]}\')'
+        query_insert_to_history = 'INSERT INTO ad_history ' \
+                                  '(asset,block_amount,paid_invoice) ' \
+                                  'VALUES (%s,%s,%s)'
         print(f"Query: {query_insert_to_history}")
-        self.db_connection.execute(query_insert_to_history)
+        self.db_connection.execute(query_insert_to_history,
+                                   (ad_queue_entry['asset'], ad_queue_entry['block_amount'],
+                                    ad_queue_entry['paid_invoice']))
 
         # purge queued ad from the queue
         print(f"Delete from ad queue...")
-        query_delete = f"DELETE FROM ad_queue WHERE id={ad_queue_entry[0]}"
+        query_delete = "DELETE FROM ad_queue WHERE id=%s"
         print(f"Query: {query_delete}")
-        self.db_connection.execute(query_delete)
+        self.db_connection.execute(query_delete, (ad_queue_entry['id'],))
 
-    def update_slot(self, slot_number: int, new_ad: tuple or list):
-        query_update = f"UPDATE ad_slots SET " \
-                       f"asset='{new_ad[1]}',block_remain={new_ad[2]},paid_invoice='{new_ad[3]}' " \
-                       f"WHERE slot_number={slot_number}"
+    def update_slot(self, slot_number: int, new_ad: dict):
+        query_update = "UPDATE ad_slots SET " \
+                       "asset=%s,block_remain=%s,paid_invoice=%s " \
+                       "WHERE slot_number=%s"
         print(f"Query: {query_update}")
-        self.db_connection.execute(query_update)
+        self.db_connection.execute(query_update,
+                                   (new_ad['asset'], new_ad['block_remain'], new_ad['paid_invoice'], slot_number))
 
     def add_queued_ad(self, data_set: tuple or list):
-        query_insert = f"INSERT INTO ad_queue " \
-                       f"(asset,paid_invoice,block_amount) " \
-                       f"VALUES {str(tuple(data_set))}"
+        query_insert = "INSERT INTO ad_queue " \
+                       "(asset,paid_invoice,block_amount) " \
+                       "VALUES (%s,%s,%s)"
         print(f"Query: {query_insert}")
-        self.db_connection.execute(query_insert)
+        self.db_connection.execute(query_insert, tuple(data_set))
 
     def random_ad_queue(self, count: int):
         def random_block_amount():
@@ -143,10 +150,10 @@ class AdSequencer:
         self.display_ad_slot_history()
 
     def update_slot_history(self, current_block: int, entries: list):
-        query = f"INSERT INTO ad_slot_history (block_level,slot1,slot2,slot3) " \
-                f"VALUES ('{current_block}','{entries[0]}','{entries[1]}','{entries[2]}')"
+        query = "INSERT INTO ad_slot_history (block_level,slot1,slot2,slot3) " \
+                "VALUES (%s,%s,%s,%s)"
         print(query)
-        self.db_connection.execute(query)
+        self.db_connection.execute(query, (current_block, entries[0], entries[1], entries[2]))
 
     @classmethod
     def insert_random_ads(cls, count: int, db_connection: None):
@@ -185,8 +192,8 @@ def main():
 
         print("\n--Determine active and expired ads:")
         slots = {
-            'active': [slot_entry for slot_entry in current_slots if slot_entry[2] > 0],
-            'expired': [slot_entry for slot_entry in current_slots if slot_entry[2] == 0]
+            'active': [slot_entry for slot_entry in current_slots if slot_entry['block_remain'] > 0],
+            'expired': [slot_entry for slot_entry in current_slots if slot_entry['block_remain'] == 0]
         }
         print(f"{pformat(slots)}")
 
@@ -203,9 +210,8 @@ def main():
                 next_ad = next_ads.pop(0)
                 print(f"Next ad: {next_ad}")
                 slots['active'].append(next_ad)
-                if expired_ad[2] != '__default__':
-                    print("--Archiving ad")
-                    ad_sequencer.move_to_history(next_ad)
+                print("--Archiving ad")
+                ad_sequencer.move_to_history(next_ad)
         print(f"{pformat(slots)}")
 
         print("\n--Determine new slot positions...")
@@ -235,12 +241,13 @@ def main():
 
         print(f"Updating slot history...")
         new_ads = ad_sequencer.get_current_ads()
-        ad_sequencer.update_slot_history(latest_cp_block, [new_ads[0][1], new_ads[1][1], new_ads[2][1]])
+        ad_sequencer.update_slot_history(latest_cp_block, [new_ad['asset'] for new_ad in new_ads[:3]])
 
         print("\nFinal database state: ")
         ad_sequencer.display_state()
 
-        print("\nClose database and exit.")
+        print("\nCommit, close database and exit.")
+        ad_sequencer.db_connection.commit()
         ad_sequencer.db_connection.close()
 
 
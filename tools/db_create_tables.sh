@@ -1,2 +1,2 @@
 #!/bin/bash
-mysql -u 'root' -p < ../rpw/static/sql/CounterpartyPepes.sql
+mysql -u 'root' -p < ../rpw/static/sql/CounterpartyPepes.sql && python migrate.py
@@ -3,6 +3,9 @@
 import set_paths
 import Settings
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
 import qrcode
 import sys
@@ -14,6 +17,7 @@ from rpw.Utils import JSONTool
 from rpw.Logging import Logger
 
 logger = Logger.setup_logger('db_updater', logging.getLogger('db_updater'))
+Logger.setup_logger('slow_queries', logging.getLogger('slow_queries'))
 
 STATE_FILE = Settings.Sources['pepe_data']['db_state_file']
 ADDRESS_QR_PATH = Settings.Sources['pepe_data']['qr_codes']
@@ -36,8 +40,12 @@ class MysqlUpdater:
         self.db_connection = DBConnector()
         self.data_connection = XChainConnector()
         self.cp_data = XChainData(self.data_connection)
+        self.fetch_workers = Settings.Sources['xchain'].get('fetch_workers', 1)
+        self.prefetch_pepes = Settings.Sources['xchain'].get('prefetch_pepes', self.fetch_workers)
+        self._fetcher = threading.local()  # XChainData of each fetch thread, with its own database connection
         self.pepe_data = PepeData(self.db_connection)
         self.pepes_list = self.pepe_data.get_pepe_names()
+        self.table_columns = {}  # table name -> list of column names, filled by db_filter
         self.last_db_block = self.get_latest_db_block()
         self.current_block = self.cp_data.get_btc_current_block()
 
@@ -54,36 +62,35 @@ class MysqlUpdater:
         for condition in conditions:
             column = condition['field']
             columns.append(column)
-        conditions_string = self.create_conditions_string(conditions)
+        conditions_string, conditions_params = self.create_conditions_string(conditions)
         columns_string = ','.join(columns)
 
         check_query = f"SELECT {columns_string} FROM {table} WHERE {conditions_string} LIMIT 1"
-        result = self.db_connection.query_and_fetch(check_query)
+        result = self.db_connection.query(check_query, conditions_params)
         if not result:
             return False
         else:
             return True
 
-    def create_conditions_string(self, conditions: dict):
+    def create_conditions_string(self, conditions: dict) -> tuple[str, tuple]:
+        """ Build the WHERE clause for a list of field/value conditions.
+        :return: the clause with %s placeholders and the tuple of values to bind to them
+        """
         conditions_strings = []
+        conditions_params = []
         for condition in conditions:
             column = condition['field']
-            value = self.prep_object_for_mysql(condition['value'])
-            conditions_strings.append(f"{column}={value}")
+            conditions_strings.append(f"{column}=%s")
+            conditions_params.append(self.prep_object_for_mysql(condition['value']))
         conditions_string = ' AND '.join(conditions_strings)
-        return conditions_string
+        return conditions_string, tuple(conditions_params)
 
     def prep_object_for_mysql(self, value: object):
-        obj_type = type(value)
-        if obj_type in [int, float, complex, None]:
-            new = str(value)
-        elif obj_type == bool:
-            new = '1' if value else '0'
-        elif value is None:
-            new = '\"\"'
-        else:  # 'str' and all other types
-            new = f"\'{self.db_connection.converter.escape(value)}\'"
-        return new
+        """ Value to bind as a statement parameter. Escaping is left to the prepared statement; missing values
+        are stored as empty strings, as they always have been. """
+        if value is None:
+            return ''
+        return value
 
     def prep_dict_for_db(self, data: dict):
         if type(data) == dict:
@@ -94,25 +101,27 @@ class MysqlUpdater:
 
     def db_filter(self, table: str, data: dict):
         """ Since XChain may add fields to their api that we do not use, they will be filtered out. """
-        query_fields = f"DESCRIBE {table}"
-        fields_list = self.db_connection.query_and_fetch(query_fields)
+        if table not in self.table_columns:
+            query_fields = f"DESCRIBE {table}"
+            fields_list = self.db_connection.query_and_fetch(query_fields)
+            self.table_columns[table] = [record['Field'] for record in fields_list]
         # fix xchain character issue.  status field shows â€\u0090 instead of -:
         if 'status' in data:
             if 'â€\u0090' in data['status']:
                 data['status'] = str(data['status']).replace('â€\u0090', '-')
-        columns = [record['Field'] for record in fields_list]
+        columns = self.table_columns[table]
         return {k: v for k, v in data.items() if k in columns}
 
     def db_insert(self, table: str, data: dict, append: str = ""):
         data = self.db_filter(table, self.prep_dict_for_db(data))
         columns_str = ', '.join([column for column in data.keys()])
-        values_str = ", ".join([str(value) for value in data.values()])
+        values_str = ", ".join(['%s'] * len(data))
         query = f"INSERT INTO {table} ({columns_str}) values ({values_str})"
         if append:
             query += f" {append}"
         log_and_print(f"MySQL execute: {query}")
-        self.db_connection.execute_and_commit(query)
-        insert_id = self.db_connection.cursor.lastrowid
+        self.db_connection.execute_and_commit(query, tuple(data.values()))
+        insert_id = self.db_connection.lastrowid
         log_and_print(f"Successful inserted data with id# {insert_id},")
 
     def db_update(self, table: str = "", data=None, match_conditions=None):
@@ -123,11 +132,11 @@ class MysqlUpdater:
         log_and_print(f"Db Update: {pformat(data)}")
         log_and_print(f"Match_conditions: {match_conditions}")
         data = self.db_filter(table, self.prep_dict_for_db(data))
-        conditions_str = self.create_conditions_string(match_conditions)
-        updates_str = ', '.join([f"{key}={value}" for key, value in data.items()])
+        conditions_str, conditions_params = self.create_conditions_string(match_conditions)
+        updates_str = ', '.join([f"{key}=%s" for key in data.keys()])
         query = f"UPDATE {table} SET {updates_str} WHERE {conditions_str}"
         log_and_print(f"MySQL execute: {query}")
-        self.db_connection.execute_and_commit(query)
+        self.db_connection.execute_and_commit(query, tuple(data.values()) + conditions_params)
 
     @staticmethod
     def get_latest_db_block():
@@ -176,16 +185,15 @@ class MysqlUpdater:
         log_and_print("Adding addresses to the database.")
         unique_addresses = set()
         query = 'SELECT DISTINCT source FROM dispensers'
-        results = self.db_connection.query_and_fetch(query)
+        results = self.db_connection.query(query)
         for result in results:
             unique_addresses.add(result['source'])
         for address in unique_addresses:
             conditions = [{'field': 'address', 'value': address}]
             if not self.check_exists('addresses', conditions):
                 log_and_print(f"Adding {address} to the database.")
-                query = f"INSERT INTO addresses (address) VALUES (\'{address}\') " \
-                        f"ON DUPLICATE KEY UPDATE address=\'{address}\'"
-                self.db_connection.execute_and_commit(query)
+                query = "INSERT INTO addresses (address) VALUES (%s) ON DUPLICATE KEY UPDATE address=%s"
+                self.db_connection.execute_and_commit(query, (address, address))
         log_and_print("Done.")
 
     def process_dispenser(self, dispenser_data: dict):
@@ -217,9 +225,48 @@ class MysqlUpdater:
                 f"does not exist in the database. Inserting.")
             self.db_insert(table='orders', data=order_data)
 
+    def update_asset_stats(self, pepe_name: str):
+        """ Recompute the asset_stats row of a pepe from its asset, holdings and dispensers records. """
+        asset_details = self.pepe_data.get_pepe_details(pepe_name)
+        if not asset_details:
+            return
+        holders_query = "SELECT " \
+                        "COALESCE(SUM(IF(addresses.is_burn=1, 0, 1)), 0) AS holder_count, " \
+                        "COALESCE(SUM(IF(addresses.is_burn=1, 1, 0)), 0) AS burn_holder_count, " \
+                        "COALESCE(SUM(IF(addresses.is_burn=1, holdings.address_quantity, 0)), 0) AS burned_quantity, " \
+                        "COALESCE(MAX(IF(addresses.is_burn=1, 0, holdings.address_quantity)), 0) " \
+                        "AS top_holder_quantity " \
+                        "FROM holdings LEFT JOIN addresses ON addresses.address=holdings.address " \
+                        "WHERE holdings.asset=%s"
+        holders_stats = self.db_connection.query(holders_query, (pepe_name,))[0]
+        dispensers = self.pepe_data.get_pepe_dispensers(pepe_name)
+        unit = 10 ** 8 if asset_details['divisible'] else 1
+        floor_price = min([dispenser['satoshirate'] / dispenser['give_quantity'] * unit
+                           for dispenser in dispensers if dispenser['give_quantity']], default=None)
+        real_supply = asset_details['supply'] - int(holders_stats['burned_quantity'])
+        top_holder_quantity = int(holders_stats['top_holder_quantity'])
+        stats = {
+            'asset': pepe_name,
+            'real_supply': real_supply,
+            'holder_count': int(holders_stats['holder_count']),
+            'burn_holder_count': int(holders_stats['burn_holder_count']),
+            'burned_quantity': int(holders_stats['burned_quantity']),
+            'top_holder_quantity': top_holder_quantity,
+            'top_holder_share': top_holder_quantity / real_supply if real_supply > 0 else 0,
+            'open_dispenser_count': len(dispensers),
+            'floor_price': floor_price,
+            'updated_block': self.current_block
+        }
+        log_and_print(f"Asset stats: {pformat(stats)}")
+        columns_str = ', '.join(stats.keys())
+        values_str = ', '.join(['%s'] * len(stats))
+        updates_str = ', '.join([f"{column}=VALUES({column})" for column in stats.keys() if column != 'asset'])
+        query = f"INSERT INTO asset_stats ({columns_str}) VALUES ({values_str}) ON DUPLICATE KEY UPDATE {updates_str}"
+        self.db_connection.execute_and_commit(query, tuple(stats.values()))
+
     def generate_qr_codes(self):
-        query = f"SELECT address FROM addresses"
-        results = self.db_connection.query_and_fetch(query)
+        query = "SELECT address FROM addresses"
+        results = self.db_connection.query(query)
         for result in results:
             address = result['address']
             target = Path(ADDRESS_QR_PATH) / f'{address}.png'
@@ -275,91 +322,156 @@ class MysqlUpdater:
         with open(Settings.Sources['pepe_data']['burn_addresses']) as f:
             for raw_line in f.readlines():
                 burn_addresses.append(raw_line.strip())
-        for burn_address in burn_addresses:
-            # insert the address into the database
-            db_query = f"INSERT INTO addresses (address, is_burn) VALUES ('{burn_address}', '1')"
-            log_and_print(f"Query: {db_query}")
-            self.db_connection.execute_and_commit(db_query)
+        # insert the addresses into the database
+        db_query = "INSERT INTO addresses (address, is_burn) VALUES (%s, 1)"
+        log_and_print(f"Query: {db_query}")
+        self.db_connection.executemany(db_query, [(burn_address,) for burn_address in burn_addresses])
+        self.db_connection.commit()
 
     def initiate_db_full_sync(self):
         log_and_print("Populating list of pepe assets...")
         self.sync_pepe_list(self.pepes_list)
 
+    def fetcher_data(self) -> XChainData:
+        """ XChainData of the current fetch thread. The data lookups of XChainData read the database, so each
+        thread has its own rather than sharing the connection of the writer. Those reads end their snapshot first
+        (XChainData.stored_asset_details), so the rows committed by the writer are seen. """
+        if threading.current_thread() is threading.main_thread():
+            return self.cp_data
+        if not hasattr(self._fetcher, 'cp_data'):
+            self._fetcher.cp_data = XChainData(XChainConnector())
+        return self._fetcher.cp_data
+
+    def fetch_pepe(self, pepe_name: str) -> tuple:
+        """ Fetch everything about a pepe from xchain: its asset details, holders, dispensers and orders. """
+        cp_data = self.fetcher_data()
+        asset_details_cp = cp_data.get_pepe_details(pepe_name)
+        # the pepe may not be in the database yet, so its divisibility is taken from the fetched details
+        holders_list = cp_data.get_pepe_holdings(pepe_name, asset_details_cp['divisible'])
+        dispensers_list = cp_data.get_pepe_dispensers(pepe_name, asset_details_cp['divisible'])
+        current_cp_orders_dict = cp_data.get_pepe_orders(pepe_name, asset_details_cp)
+        return asset_details_cp, holders_list, dispensers_list, current_cp_orders_dict
+
+    def fetched_pepes(self, pepe_names: list):
+        """ Fetched data of each pepe, in the order of the list. With more than one fetch worker, the data of the
+        next prefetch_pepes pepes is fetched on a thread pool while the current one is written; XChainConnector
+        bounds the requests in flight.
+        :return: iterator of (pepe name, fetch_pepe result) tuples
+        """
+        if self.fetch_workers <= 1:
+            for pepe_name in pepe_names:
+                yield pepe_name, self.fetch_pepe(pepe_name)
+            return
+        executor = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='xchain_fetch')
+        pending = deque()
+        upcoming = iter(pepe_names)
+        try:
+            for pepe_name in upcoming:
+                pending.append((pepe_name, executor.submit(self.fetch_pepe, pepe_name)))
+                if len(pending) > self.prefetch_pepes:
+                    pepe_name, future = pending.popleft()
+                    yield pepe_name, future.result()
+            while pending:
+                pepe_name, future = pending.popleft()
+                yield pepe_name, future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def sync_pepe_list(self, pepes_sublist):
         log_and_print(f"Updating db")
         # populate data for the provided list of pepe names
         log_and_print(f"Updating records for pepes:\n {pepes_sublist}")
-        for pepe_name in pepes_sublist:
+        # everything is fetched from xchain first, so the transaction is not held open during the api calls
+        for pepe_name, fetched in self.fetched_pepes(list(pepes_sublist)):
+            asset_details_cp, holders_list, dispensers_list, current_cp_orders_dict = fetched
             log_and_print(f"Pepe: {pepe_name}")
-            asset_details_cp = self.cp_data.get_pepe_details(pepe_name)
             log_and_print(f"Cp details: {pformat(asset_details_cp)}")
-            asset_details_db = self.pepe_data.get_pepe_details(pepe_name)
-            log_and_print(f"Db details: {pformat(asset_details_db)}")
-            self.process_asset(asset_details_cp)
-
-            log_and_print("Populating pepe holders into the database...")
-            # holders_list = [holder_data for holder_data in self.cp_data.get_pepe_holdings(pepe_name)]
-            holders_list = self.cp_data.get_pepe_holdings(pepe_name)
             log_and_print(f"CP Holder details: {pformat(holders_list)}")
-
-            # calculate each addresses quantities
-            address_list = set([holding['address'] for holding in holders_list])
-            for address in address_list:
-                address_holdings = sum(
-                    [int(float(holding['address_quantity'])) for holding in holders_list if
-                     holding['address'] == address])
-                address_data = {
-                    'address': address,
-                    'address_quantity': address_holdings,
-                    'escrow': None
-                }
-                self.process_holding(holder_data=address_data, asset=pepe_name)
-
-            log_and_print("Populating pepe dispensers into the database")
-            dispensers_list = self.cp_data.get_pepe_dispensers(pepe_name)
             log_and_print(f"Dispensers details {pformat(dispensers_list)}")
-            for dispenser_data in dispensers_list:
-                self.process_dispenser(dispenser_data=dispenser_data)
-
-            log_and_print("Populating pepe orders into the database")
-            if pepe_name in ['XCP', 'PEPECASH']:
-                base_asset = 'XCP' if pepe_name == 'PEPECASH' else 'XCP'
-            else:
-                base_asset = ''
-            current_db_orders_dict = self.pepe_data.get_pepe_orders(pepe_name, base_asset=base_asset)
-            current_cp_orders_dict = self.cp_data.get_pepe_orders(pepe_name)
-            current_cp_orders_by_hash = {od['tx_hash']: od
-                                         for od in current_cp_orders_dict['give'] + current_cp_orders_dict['get']}
-            log_and_print(f"DB Orders: {pformat(current_db_orders_dict)}")
             log_and_print(f"CP Orders: {pformat(current_cp_orders_dict)}")
-            current_db_orders_tx_hashes = [current_order['tx_hash'] for current_order in
-                                           current_db_orders_dict.get('get', [])
-                                           + current_db_orders_dict.get('give', [])]
-            current_cp_orders_tx_hashes = [current_order['tx_hash'] for current_order in
-                                           current_cp_orders_dict.get('get', [])
-                                           + current_cp_orders_dict.get('give', [])]
-            new_cp_orders = set(current_cp_orders_tx_hashes) - set(current_db_orders_tx_hashes)
-            for order_tx_hash in current_db_orders_tx_hashes:
-                order_details = {}
-                for order in current_db_orders_dict['give'] + current_db_orders_dict['get']:
-                    if order['tx_hash'] == order_tx_hash:
-                        order_details = current_cp_orders_by_hash[order_tx_hash]
-                if order_details:
-                    self.process_order(order_details, pepe_name)
-            for order_tx_hash in new_cp_orders:
-                order_details = {}
-                for order in current_cp_orders_dict['give'] + current_cp_orders_dict['get']:
-                    if order['tx_hash'] == order_tx_hash:
-                        order_details = current_cp_orders_by_hash[order_tx_hash]
-                if order_details:
-                    self.process_order(order_details, pepe_name)
+
+            # apply the asset, holdings, dispensers and orders changes of the pepe as a single transaction
+            with self.db_connection.transaction():
+                self.sync_pepe_records(pepe_name, asset_details_cp, holders_list, dispensers_list,
+                                       current_cp_orders_dict)
+            if self.db_connection.transaction_failed:
+                log_and_print(f"Updating {pepe_name} failed; its changes were rolled back.")
+
+    def sync_pepe_records(self, pepe_name: str, asset_details_cp: dict, holders_list: list, dispensers_list: list,
+                          current_cp_orders_dict: dict):
+        asset_details_db = self.pepe_data.get_pepe_details(pepe_name)
+        log_and_print(f"Db details: {pformat(asset_details_db)}")
+        self.process_asset(asset_details_cp)
+
+        log_and_print("Populating pepe holders into the database...")
+        # calculate each addresses quantities
+        address_list = set([holding['address'] for holding in holders_list])
+        for address in address_list:
+            address_holdings = sum(
+                [int(float(holding['address_quantity'])) for holding in holders_list if
+                 holding['address'] == address])
+            address_data = {
+                'address': address,
+                'address_quantity': address_holdings,
+                'escrow': None
+            }
+            self.process_holding(holder_data=address_data, asset=pepe_name)
+
+        log_and_print("Populating pepe dispensers into the database")
+        for dispenser_data in dispensers_list:
+            self.process_dispenser(dispenser_data=dispenser_data)
+
+        log_and_print("Populating pepe orders into the database")
+        if pepe_name in ['XCP', 'PEPECASH']:
+            base_asset = 'XCP' if pepe_name == 'PEPECASH' else 'XCP'
+        else:
+            base_asset = ''
+        current_db_orders_dict = self.pepe_data.get_pepe_orders(pepe_name, base_asset=base_asset)
+        current_cp_orders_by_hash = {od['tx_hash']: od
+                                     for od in current_cp_orders_dict['give'] + current_cp_orders_dict['get']}
+        log_and_print(f"DB Orders: {pformat(current_db_orders_dict)}")
+        current_db_orders_tx_hashes = [current_order['tx_hash'] for current_order in
+                                       current_db_orders_dict.get('get', [])
+                                       + current_db_orders_dict.get('give', [])]
+        current_cp_orders_tx_hashes = [current_order['tx_hash'] for current_order in
+                                       current_cp_orders_dict.get('get', [])
+                                       + current_cp_orders_dict.get('give', [])]
+        new_cp_orders = set(current_cp_orders_tx_hashes) - set(current_db_orders_tx_hashes)
+        for order_tx_hash in current_db_orders_tx_hashes:
+            order_details = {}
+            for order in current_db_orders_dict['give'] + current_db_orders_dict['get']:
+                if order['tx_hash'] == order_tx_hash:
+                    order_details = current_cp_orders_by_hash[order_tx_hash]
+            if order_details:
+                self.process_order(order_details, pepe_name)
+        for order_tx_hash in new_cp_orders:
+            order_details = {}
+            for order in current_cp_orders_dict['give'] + current_cp_orders_dict['get']:
+                if order['tx_hash'] == order_tx_hash:
+                    order_details = current_cp_orders_by_hash[order_tx_hash]
+            if order_details:
+                self.process_order(order_details, pepe_name)
+
+        # record the block of the change, used by the site to validate cached pages of the pepe
+        block_data = self.db_filter('assets', {'updated_block': self.current_block})
+        if block_data:
+            self.db_update(table='assets', data=block_data,
+                           match_conditions=[{'field': 'asset', 'value': pepe_name}])
+        self.update_asset_stats(pepe_name)
 
     def get_pepes_in_block(self, block_numbers: list or str):
         if type(block_numbers) == str:
             block_numbers = [block_numbers]
         pepes_set = set()
-        for block_number in block_numbers:
-            pepes_set.update(self.cp_data.pepe_pepes_in_block(block_number, self.pepes_list))
+        if self.fetch_workers <= 1:
+            for block_number in block_numbers:
+                pepes_set.update(self.cp_data.pepe_pepes_in_block(block_number, self.pepes_list))
+            return pepes_set
+        with ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='xchain_fetch') as executor:
+            for block_pepes in executor.map(
+                    lambda block_number: self.fetcher_data().pepe_pepes_in_block(block_number, self.pepes_list),
+                    block_numbers):
+                pepes_set.update(block_pepes)
         return pepes_set
 
 
@@ -368,7 +480,7 @@ def pretty_print_dict(message: str, data: dict):
 
 
 def display_syntax():
-    print("db_populate.sh [full]|[list pepe_name,pepe_name,...]|[start pepe_name]|[sync]|[addresses]")
+    print("db_populate.sh [full]|[list pepe_name,pepe_name,...]|[start pepe_name]|[sync]|[addresses]|[stats]")
 
 
 if __name__ == "__main__":
@@ -408,6 +520,11 @@ if __name__ == "__main__":
                 pepes_list = m.pepes_list
             m.initiate_db()
             exit()
+        elif sys.argv[1] == 'stats':  # rebuild the asset_stats rows of every pepe
+            for pepe_name in m.pepes_list:
+                with m.db_connection.transaction():
+                    m.update_asset_stats(pepe_name)
+            exit()
         elif sys.argv[1] == 'addresses':  # only do addresses
             m.process_addresses()
             m.generate_qr_codes()
@@ -0,0 +1,26 @@
+#!../venv/bin/python
+""" Compile the faq xml file into the JSON file read by the site, so the workers do not parse the xml.
+Run it on deploy, or after editing the faq. The site falls back to parsing the xml while the JSON file is missing
+or was compiled from other xml content.
+
+Usage: faq_compile.py [faq_xml_file [json_file]]
+"""
+import set_paths
+import sys
+
+import Settings
+from rpw.QueryTools import FaqContent
+
+
+def display_syntax():
+    print("faq_compile.py [faq_xml_file [json_file]]")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        display_syntax()
+        exit(1)
+    source_file = sys.argv[1] if len(sys.argv) > 1 else Settings.Main['faq_file']
+    compiled_file = sys.argv[2] if len(sys.argv) > 2 else Settings.Main['faq_compiled_file']
+    item_count = FaqContent.compile(source_file, compiled_file)
+    print(f"Wrote {item_count} faq items from {source_file} to {compiled_file}")
@@ -0,0 +1,293 @@
+#!../venv/bin/python
+""" Versioned schema migrations for the site database, and a check of the query plans of the site queries.
+
+The applied migrations are recorded in the schema_version table. Every step of a migration can be re-run safely,
+so a migration interrupted part way is completed by running the script again.
+
+Usage: migrate.py [up]|[status]|[check [python_file ...]]
+"""
+import set_paths
+import ast
+import datetime
+import logging
+import re
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+from rpw.DataConnectors import DBConnector
+from rpw.Logging import Logger
+
+logger = Logger.setup_logger('migrate', logging.getLogger('migrate'))
+
+Index = namedtuple('Index', ['table', 'name', 'columns', 'unique'], defaults=[False])
+DropIndex = namedtuple('DropIndex', ['table', 'name'])
+Engine = namedtuple('Engine', ['table', 'engine'])
+AddColumn = namedtuple('AddColumn', ['table', 'name', 'definition'])
+
+SITE_TABLES = ['assets', 'dispensers', 'holdings', 'orders', 'addresses', 'prices',
+               'ad_slots', 'ad_queue', 'ad_history', 'ad_slot_history', 'schema_version']  # as of migration 4
+
+MIGRATIONS = [
+    {
+        'version': 1,
+        'description': 'Bounded column types for the text columns used in lookups',
+        'steps': [
+            "ALTER TABLE orders MODIFY tx_hash VARCHAR(64), MODIFY give_asset VARCHAR(40), "
+            "MODIFY get_asset VARCHAR(40), MODIFY status VARCHAR(20)",
+            "ALTER TABLE dispensers MODIFY status VARCHAR(16)",
+        ]
+    },
+    {
+        'version': 2,
+        'description': 'Indexes for the pepe page, grid and address page lookups',
+        'steps': [
+            # dispensers of a pepe (asset=, give_remaining>), latest dispensers (ORDER BY block_index)
+            Index('dispensers', 'asset_give_remaining', ['asset', 'give_remaining']),
+            DropIndex('dispensers', 'asset'),
+            Index('dispensers', 'block_index', ['block_index']),
+            Index('dispensers', 'tx_index', ['tx_index']),
+            # open orders of a pepe against a base asset, from both sides of the book
+            Index('orders', 'get_asset_status', ['get_asset', 'status', 'give_asset']),
+            Index('orders', 'give_asset_status', ['give_asset', 'status', 'get_asset']),
+            # holders of a pepe by quantity, holdings of an address by asset
+            Index('holdings', 'asset_quantity', ['asset', 'address_quantity']),
+            Index('holdings', 'address_asset', ['address', 'asset']),
+            DropIndex('holdings', 'asset'),
+            DropIndex('holdings', 'address'),
+            # pepes of an artist, burn addresses
+            Index('assets', 'source', ['source']),
+            Index('addresses', 'is_burn', ['is_burn']),
+        ]
+    },
+    {
+        'version': 3,
+        'description': 'One holdings record per address and asset',
+        'steps': [
+            "DELETE older FROM holdings older JOIN holdings newer "
+            "ON older.asset=newer.asset AND older.address=newer.address AND older.id<newer.id",
+            Index('holdings', 'asset_address', ['asset', 'address'], unique=True),
+        ]
+    },
+    {
+        'version': 4,
+        'description': 'InnoDB storage: row locks and consistent reads while the updater writes',
+        'steps': [Engine(table, 'InnoDB') for table in SITE_TABLES]
+    },
+    {
+        'version': 5,
+        'description': 'Last synced block that changed each pepe, for page validators',
+        'steps': [
+            AddColumn('assets', 'updated_block', 'INTEGER UNSIGNED NOT NULL DEFAULT 0'),
+        ]
+    },
+    {
+        'version': 6,
+        'description': 'Per-asset holder, supply and market stats maintained by db_updater',
+        'steps': [
+            "CREATE TABLE IF NOT EXISTS asset_stats ("
+            "asset VARCHAR(40) NOT NULL PRIMARY KEY, "
+            "real_supply BIGINT, "  # supply less the quantities held by burn addresses
+            "holder_count INTEGER UNSIGNED, "  # holders other than burn addresses
+            "burn_holder_count INTEGER UNSIGNED, "
+            "burned_quantity BIGINT UNSIGNED, "
+            "top_holder_quantity BIGINT UNSIGNED, "
+            "top_holder_share DOUBLE, "  # top holder quantity / real supply
+            "open_dispenser_count INTEGER UNSIGNED, "
+            "floor_price DOUBLE, "  # lowest open dispenser price, in satoshis per whole pepe
+            "updated_block INTEGER UNSIGNED"
+            ") ENGINE = InnoDB DEFAULT CHARSET = utf8 COLLATE = utf8_unicode_ci",
+        ]
+    },
+    {
+        'version': 7,
+        'description': 'Pepes of an artist in name order, for paginated artist pages',
+        'steps': [
+            Index('assets', 'source_asset', ['source', 'asset']),
+            DropIndex('assets', 'source'),
+        ]
+    },
+]
+
+# Tables with a handful of rows, for which a full scan is the expected plan
+SMALL_TABLES = {'prices', 'ad_slots', 'ad_queue', 'ad_history', 'ad_slot_history', 'schema_version'}
+# Queries which deliberately read the whole table
+ALLOWED_FULL_SCANS = {
+    'SELECT * FROM assets',  # asset catalog snapshot
+}
+DEFAULT_CHECK_FILES = [Path(set_paths.script_path.parent) / 'rpw' / 'QueryTools.py']
+
+
+def log_and_print(*args, **kwargs):
+    print(*args, **kwargs)
+    message = " ".join(map(str, args))
+    logger.info(message)
+
+
+class Migrator:
+
+    def __init__(self):
+        self.db_connection = DBConnector()
+
+    def ensure_version_table(self):
+        self.run("CREATE TABLE IF NOT EXISTS schema_version ("
+                 "version INTEGER UNSIGNED NOT NULL PRIMARY KEY, "
+                 "description VARCHAR(255), "
+                 "applied_at DATETIME)")
+
+    def applied_versions(self) -> set:
+        return {row['version'] for row in self.db_connection.query('SELECT version FROM schema_version')}
+
+    def run(self, statement: str):
+        """ Execute a statement, stopping the migration if it fails. """
+        log_and_print(f"  {statement}")
+        if not self.db_connection.execute(statement):
+            log_and_print("Statement failed; see the errors log. Fix the problem and run the migration again.")
+            exit(1)
+
+    def index_exists(self, table: str, name: str) -> bool:
+        query = "SELECT COUNT(*) AS index_columns FROM information_schema.statistics " \
+                "WHERE table_schema=DATABASE() AND table_name=%s AND index_name=%s"
+        return self.db_connection.query(query, (table, name))[0]['index_columns'] > 0
+
+    def table_engine(self, table: str) -> str:
+        query = "SELECT engine AS table_engine FROM information_schema.tables " \
+                "WHERE table_schema=DATABASE() AND table_name=%s"
+        results = self.db_connection.query(query, (table,))
+        return results[0]['table_engine'] if results else ''
+
+    def column_exists(self, table: str, name: str) -> bool:
+        query = "SELECT COUNT(*) AS table_columns FROM information_schema.columns " \
+                "WHERE table_schema=DATABASE() AND table_name=%s AND column_name=%s"
+        return self.db_connection.query(query, (table, name))[0]['table_columns'] > 0
+
+    def apply_step(self, step):
+        if isinstance(step, AddColumn):
+            if self.column_exists(step.table, step.name):
+                log_and_print(f"  Column {step.table}.{step.name} exists.")
+                return
+            self.run(f"ALTER TABLE {step.table} ADD COLUMN {step.name} {step.definition}")
+        elif isinstance(step, Engine):
+            if self.table_engine(step.table).lower() == step.engine.lower():
+                log_and_print(f"  Table {step.table} already uses {step.engine}.")
+                return
+            self.run(f"ALTER TABLE {step.table} ENGINE={step.engine}")
+        elif isinstance(step, Index):
+            if self.index_exists(step.table, step.name):
+                log_and_print(f"  Index {step.table}.{step.name} exists.")
+                return
+            unique = 'UNIQUE ' if step.unique else ''
+            self.run(f"CREATE {unique}INDEX {step.name} ON {step.table} ({','.join(step.columns)})")
+        elif isinstance(step, DropIndex):
+            if not self.index_exists(step.table, step.name):
+                log_and_print(f"  Index {step.table}.{step.name} already removed.")
+                return
+            self.run(f"DROP INDEX {step.name} ON {step.table}")
+        else:
+            self.run(step)
+
+    def migrate(self):
+        self.ensure_version_table()
+        applied = self.applied_versions()
+        pending = [migration for migration in MIGRATIONS if migration['version'] not in applied]
+        if not pending:
+            log_and_print("Schema is up to date.")
+            return
+        for migration in pending:
+            log_and_print(f"Applying migration {migration['version']}: {migration['description']}")
+            for step in migration['steps']:
+                self.apply_step(step)
+            self.db_connection.execute_and_commit(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)",
+                (migration['version'], migration['description'], datetime.datetime.now()))
+        log_and_print("Done.")
+
+    def status(self):
+        self.ensure_version_table()
+        applied = self.applied_versions()
+        for migration in MIGRATIONS:
+            state = 'applied' if migration['version'] in applied else 'pending'
+            print(f"{migration['version']:>3}  {state:<8} {migration['description']}")
+
+    def check(self, python_files: list) -> bool:
+        """ EXPLAIN every SELECT template found in the given files.
+        :return: True if none of the queries scans a whole table, False otherwise
+        """
+        passed = True
+        for python_file in python_files:
+            for line_number, template in QueryTemplates.extract(python_file):
+                plan = self.explain(template)
+                if plan is None:
+                    log_and_print(f"FAIL {python_file}:{line_number} could not be explained: {template}")
+                    passed = False
+                    continue
+                full_scans = [row['table'] for row in plan
+                              if row.get('type') == 'ALL' and row.get('table') not in SMALL_TABLES
+                              and not str(row.get('table')).startswith('<')]  # <union1,2>, <derived2>: temporary
+                if full_scans and template not in ALLOWED_FULL_SCANS:
+                    log_and_print(f"FAIL {python_file}:{line_number} full scan of {','.join(full_scans)}: "
+                                  f"{template}")
+                    passed = False
+                else:
+                    access = ', '.join(f"{row.get('table')}:{row.get('type')}({row.get('key') or '-'})"
+                                       for row in plan)
+                    print(f"ok   {python_file}:{line_number} {access}")
+        return passed
+
+    def explain(self, template: str):
+        """ Query plan of a query template, with sample values in place of its placeholders. """
+        statement = re.sub(r'LIMIT\s+%s', 'LIMIT 10', template, flags=re.IGNORECASE)
+        statement = re.sub(r'OFFSET\s+%s', 'OFFSET 0', statement, flags=re.IGNORECASE).replace('%s', "'0'")
+        if not self.db_connection.execute(f"EXPLAIN {statement}"):
+            return None
+        return self.db_connection.get_result()
+
+
+class QueryTemplates:
+    """ Extraction of the SQL query templates assigned in a python source file. """
+
+    @staticmethod
+    def extract(python_file) -> list:
+        """ Find the SELECT statements assigned to names containing 'query', e.g. query, query_get, slots_query.
+        Values interpolated in f-strings are replaced with %s placeholders.
+        :param python_file: path of the source file
+        :return: list of (line number, query template) tuples
+        """
+        tree = ast.parse(Path(python_file).read_text())
+        templates = []
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Assign):
+                continue
+            names = [target.id for target in node.targets if isinstance(target, ast.Name)]
+            if not any('query' in name for name in names):
+                continue
+            template = QueryTemplates.literal(node.value)
+            if template and template.lstrip().upper().startswith('SELECT'):
+                templates.append((node.lineno, template))
+        return sorted(templates)
+
+    @staticmethod
+    def literal(node) -> str:
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return node.value
+        if isinstance(node, ast.JoinedStr):
+            return ''.join(part.value if isinstance(part, ast.Constant) else '%s' for part in node.values)
+        return ''
+
+
+def display_syntax():
+    print("migrate.py [up]|[status]|[check [python_file ...]]")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'up'
+    if command == 'up':
+        Migrator().migrate()
+    elif command == 'status':
+        Migrator().status()
+    elif command == 'check':
+        files = sys.argv[2:] or DEFAULT_CHECK_FILES
+        exit(0 if Migrator().check(files) else 1)
+    else:
+        display_syntax()
+        exit(1)
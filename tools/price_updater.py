@@ -4,6 +4,7 @@ import set_paths
 from pprint import pprint
 from pycoingecko import CoinGeckoAPI
 from db_updater import MysqlUpdater
+from rpw.QueryTools import RateSnapshot
 
 BASE_CURRENCY = 'USD'
 FIAT_LIST = {
@@ -76,6 +77,7 @@ def run():
         }
         print(f"match_conditions: {match_conditions}\nupdates: {updates}")
         m.db_update(table=DB_TABLE, data=updates, match_conditions=match_conditions)
+    RateSnapshot.mark_updated()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+#!../venv/bin/python
+""" Summarize the slow query log: the statement fingerprints with the most total time, with their count, total, p95
+and maximum time, and the functions which issued them. The rotated log files, compressed or not, are read as well.
+
+Statements are written to the slow query log by DBConnector when they take Settings.Sources['mysql']
+['slow_query_seconds'] or longer, so the totals only cover the slow executions of each fingerprint.
+
+Usage: slow_query_report.py [log_file [count [total|count|p95|max]]]
+"""
+import set_paths
+import gzip
+import json
+import sys
+from collections import Counter
+from pathlib import Path
+
+import Settings
+from rpw.Metrics import percentile
+
+SORT_KEYS = {'total': 'total_ms', 'count': 'count', 'p95': 'p95_ms', 'max': 'max_ms'}
+
+
+def display_syntax():
+    print("slow_query_report.py [log_file [count [total|count|p95|max]]]")
+
+
+def log_files(log_file: Path) -> list:
+    """ The log file and its rotations, e.g. slow_queries.log.1 or slow_queries.log.1.gz, oldest first. """
+    rotated = sorted(log_file.parent.glob(f"{log_file.name}.*"), key=lambda path: path.name, reverse=True)
+    return rotated + ([log_file] if log_file.exists() else [])
+
+
+def read_records(paths: list):
+    """ Slow statement records of the log files: the JSON object following the level name on each line. """
+    for path in paths:
+        opener = gzip.open if path.suffix == '.gz' else open
+        with opener(path, 'rt', encoding='utf-8', errors='replace') as log:
+            for line in log:
+                start = line.find('{')
+                if start == -1:
+                    continue
+                try:
+                    yield json.loads(line[start:])
+                except json.JSONDecodeError:
+                    continue
+
+
+def summarize(records) -> list:
+    """ Aggregate the slow statement records by fingerprint.
+    :return: list of dictionaries: fingerprint, count, total_ms, p95_ms, max_ms, failed and the callers by count
+    """
+    fingerprints = {}
+    for record in records:
+        summary = fingerprints.setdefault(record['fingerprint'], {'times': [], 'failed': 0, 'callers': Counter()})
+        summary['times'].append(record['ms'])
+        summary['failed'] += bool(record.get('failed'))
+        summary['callers'][record.get('caller', 'unknown')] += 1
+    return [{'fingerprint': fingerprint, 'count': len(summary['times']), 'total_ms': sum(summary['times']),
+             'p95_ms': percentile(summary['times'], 0.95), 'max_ms': max(summary['times']),
+             'failed': summary['failed'], 'callers': summary['callers'].most_common()}
+            for fingerprint, summary in fingerprints.items()]
+
+
+def print_report(summaries: list, count: int, sort_key: str):
+    summaries = sorted(summaries, key=lambda summary: summary[sort_key], reverse=True)
+    print(f"{len(summaries)} fingerprints, {sum(summary['count'] for summary in summaries)} slow statements. "
+          f"Top {min(count, len(summaries))} by {sort_key}:")
+    for rank, summary in enumerate(summaries[:count], start=1):
+        print(f"\n{rank}. count {summary['count']}  total {summary['total_ms']:.0f} ms  "
+              f"p95 {summary['p95_ms']:.0f} ms  max {summary['max_ms']:.0f} ms"
+              + (f"  failed {summary['failed']}" if summary['failed'] else ''))
+        print(f"   {summary['fingerprint']}")
+        for caller, calls in summary['callers'][:3]:
+            print(f"   <- {caller} ({calls})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 4 or (len(sys.argv) > 3 and sys.argv[3] not in SORT_KEYS) \
+            or (len(sys.argv) > 2 and not sys.argv[2].isdigit()):
+        display_syntax()
+        exit(1)
+    log_file = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(Settings.Logs['loggers']['slow_queries']['log_file'])
+    top_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    sort_name = sys.argv[3] if len(sys.argv) > 3 else 'total'
+    paths = log_files(log_file)
+    if not paths:
+        print(f"No slow query log at {log_file}")
+        exit(1)
+    print_report(summarize(read_records(paths)), top_count, SORT_KEYS[sort_name])